@@ -5,12 +5,46 @@ This module starts the Linked Data API
 import logging
 from flask import Flask
 from controller import routes
+from model.search_index import SEARCH_INDEX
+from model.fuzzy_index import FUZZY_INDEX
+from model.autocomplete import AUTOCOMPLETE_INDEX
+from model.spatial_index import SPATIAL_INDEX
+from model import metrics, dggs
 import conf
 from pprint import pformat
 
 app = Flask(__name__, template_folder=conf.TEMPLATES_DIR, static_folder=conf.STATIC_DIR)
 app.register_blueprint(routes.routes)
 
+# time every request, by stage, for the Server-Timing header and /metrics
+metrics.init_app(app)
+
+
+def warm_up():
+    '''
+    Builds the state that every worker needs in this process, so that a preforking server (gunicorn --preload,
+    mod_wsgi's WSGIImportScript) that calls it before forking shares it, copy-on-write, with all its workers: the
+    search, fuzzy search, autocomplete and spatial indexes, the DGGS instance and the map page. No database connection
+    is left open.
+    '''
+    SEARCH_INDEX.start(wait=True)
+    FUZZY_INDEX.start(wait=True)
+    AUTOCOMPLETE_INDEX.start(wait=True)
+    SPATIAL_INDEX.start(wait=True)
+    dggs.rdggs()
+    app.test_client().get('/map')
+    conf.db_pool_close()
+
+
+if conf.WARM_UP:
+    warm_up()
+else:
+    # build the register search and spatial indexes in the background so the first searches don't wait for them
+    SEARCH_INDEX.start()
+    FUZZY_INDEX.start()
+    AUTOCOMPLETE_INDEX.start()
+    SPATIAL_INDEX.start()
+
 logger = logging.getLogger('app')
 
 # run the Flask app
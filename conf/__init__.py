@@ -1,9 +1,15 @@
 from os.path import dirname, realpath, join, abspath
 import os
+import logging
+import threading
+import time
 import psycopg2
 from psycopg2 import extras
 import yaml
 
+from .pool import ConnectionPool
+from model import metrics
+
 
 APP_DIR = dirname(dirname(realpath(__file__)))
 TEMPLATES_DIR = join(dirname(dirname(abspath(__file__))), 'view', 'templates')
@@ -12,22 +18,284 @@ STATIC_DIR = join(dirname(dirname(abspath(__file__))), 'view', 'static')
 LOGFILE = APP_DIR + '/flask.log'
 DEBUG = True
 
+# serve the data from this CSV file (in the sample-data/placename_sample.csv layout) instead of Postgres, see
+# model/backend.py. No database or secrets.yml is needed then.
+SNAPSHOT_CSV_FILE = os.environ.get('PLACENAMES_SNAPSHOT_CSV') or None
+
+# serve the Turtle, N-Triples and JSON-LD of the items from this file written by tools/build_store.py, see
+# model/item_store.py
+ITEM_STORE_FILE = os.environ.get('PLACENAMES_ITEM_STORE') or None
+# seconds between checks for a new item store file
+ITEM_STORE_CHECK_INTERVAL = 10
+
+# keep rendered item and register responses in this SQLite file, shared by all the worker processes on the host, see
+# model/shared_cache.py. Put it on a local disk, or in /dev/shm to hold it in memory.
+SHARED_CACHE_FILE = os.environ.get('PLACENAMES_SHARED_CACHE') or None
+# the most bytes of responses it holds, the largest response it keeps, how often (in seconds) an entry's last use is
+# recorded, and how long (in seconds) to wait for another process's write
+SHARED_CACHE_MAX_BYTES = 512 * 2 ** 20
+SHARED_CACHE_MAX_ENTRY_BYTES = 2 ** 20
+SHARED_CACHE_TOUCH_INTERVAL = 60
+SHARED_CACHE_TIMEOUT = 5
+
 # get db conn settings from yaml file
 directory = os.path.dirname(os.path.realpath(__file__))
 file = os.path.join(directory, "secrets.yml")
-DB_CON_DICT = yaml.safe_load(open(file))
+DB_CON_DICT = yaml.safe_load(open(file)) if os.path.exists(file) else None
 
 if DB_CON_DICT is None:
-    print('You must set up a secrets.yml file containing the DB login credentials')
-    exit()
+    DB_CON_DICT = {}
+    if SNAPSHOT_CSV_FILE is None:
+        # the app still starts, and reports the database as offline
+        print('You must set up a secrets.yml file containing the DB login credentials')
+
+# optional connection pool settings, see ConnectionPool for their meaning
+DB_POOL_SETTINGS = DB_CON_DICT.get('db_pool') or {}
+
+# build the in-memory indexes and other shared state at import, before a preforking server forks (see app.warm_up())
+WARM_UP = os.environ.get('PLACENAMES_WARM_UP') == '1'
+
+# in-memory indexes (see model/dataset.py) check whether the gazetteer has changed this often, in seconds
+INDEX_CHECK_INTERVAL = 300
+# build the in-memory indexes from a CSV file in the sample-data/placename_sample.csv layout instead of the database
+INDEX_CSV_FILE = None
+
+# register counts and pages are cached for this many seconds, keeping at most this many entries
+REGISTER_CACHE_TTL = 600
+REGISTER_CACHE_SIZE = 2048
+
+# item records shared by the Place and Placename views (see model/record.py): at most this many are kept, each for at
+# most this many seconds, and they are checked against the dataset's latest SUPPLY_DATE this often, in seconds
+RECORD_CACHE_SIZE = 50000
+RECORD_CACHE_TTL = 86400
+RECORD_CACHE_CHECK_INTERVAL = 60
+
+# map clusters (see model/placemap.py): at most this many points per response, about this many grid cells across a
+# 256 pixel map tile, and cached for this many seconds, keeping at most this many entries
+MAP_MAX_FEATURES = 500
+MAP_GRID_CELLS_PER_TILE = 4
+MAP_CACHE_TTL = 600
+MAP_CACHE_SIZE = 1024
+
+# the most placenames the nearest and within routes return in one response
+SPATIAL_MAX_RESULTS = 1000
+
+# the most letters a word of a fuzzy register search (?match=fuzzy) may differ by from a word of a name, for words of
+# five or more letters; shorter words may differ by one letter, or none for one or two letter words. The fuzzy index
+# holds every word with up to this many letters deleted, so its size grows quickly with it
+FUZZY_MAX_DISTANCE = 2
+
+# the most completions /collections/placenames/autocomplete returns, and how many seconds browsers and proxies may reuse
+# a response for
+AUTOCOMPLETE_MAX_RESULTS = 50
+AUTOCOMPLETE_MAX_AGE = 600
+
+# number of computed DGGS cells remembered by model.dggs.cell_id()
+DGGS_CACHE_SIZE = 100000
+# column holding each row's precomputed resolution 9 DGGS cell, see sql/dggs_cell_column.sql
+DGGS_CELL_COLUMN = 'DGGS_CELL_9'
+
+# the item columns shared by the Place and Placename item views and the bulk routes. The last column is the stored
+# DGGS cell, or NULL if the table has no DGGS_CELL_COLUMN.
+PLACENAME_ITEM_COLUMNS = '''
+        "NAME",
+        "AUTHORITY",
+        "SUPPLY_DATE",
+        "FEATURE",
+        "CATEGORY",
+        "GROUP",
+        "LATITUDE",
+        "LONGITUDE",
+        {dggs_cell}'''
+
+# the single-row lookup of the item views
+PLACENAME_ITEM_QUERY = '''
+    SELECT''' + PLACENAME_ITEM_COLUMNS + '''
+    FROM "PLACENAMES"
+    WHERE "ID" = $1
+'''
+
+# the most placename IDs /collections/placenames/batch looks up in one request
+BATCH_MAX_IDS = 1000
+
+# SUPPLY_DATE of one item, all that is needed to revalidate a cached item response
+PLACENAME_MODIFIED_QUERY = '''
+    SELECT "SUPPLY_DATE" FROM "PLACENAMES" WHERE "ID" = $1
+'''
+
+# part of every ETag (see model/conditional.py): change it when a release changes how items or registers are rendered
+CONTENT_VERSION = 1
+
+# rows read per round trip by db_stream(), e.g. for the dataset dumps
+DB_STREAM_BATCH_SIZE = 5000
+
+logger = logging.getLogger('conf')
+
+_pool = None
+_pool_lock = threading.Lock()
+_placenames_columns = None
+
+
+def db_pool():
+    '''
+    Returns the process-wide connection pool, creating it on first use so that no connections are opened at import
+    time (and none are inherited by forked worker processes)
+    '''
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                if 'db_con' not in DB_CON_DICT:
+                    raise psycopg2.OperationalError('No database connection settings, see secrets.yml')
+                pool = ConnectionPool(DB_CON_DICT['db_con'], **DB_POOL_SETTINGS)
+                columns = _read_placenames_columns(pool)
+                pool.prepare('placename_item', PLACENAME_ITEM_QUERY.format(dggs_cell=_dggs_cell(columns)))
+                pool.prepare('placename_modified', PLACENAME_MODIFIED_QUERY)
+                _pool = pool
+    return _pool
+
 
+def _read_placenames_columns(pool):
+    global _placenames_columns
+    pooled = pool.getconn()
+    try:
+        with pooled.conn.cursor() as cur:
+            cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name = 'PLACENAMES'")
+            _placenames_columns = {row[0] for row in cur.fetchall()}
+    finally:
+        pool.putconn(pooled)
+    return _placenames_columns
+
+
+def _dggs_cell(columns):
+    return '"{}"'.format(DGGS_CELL_COLUMN) if DGGS_CELL_COLUMN in columns else 'NULL'
+
+
+def placename_item_columns():
+    '''
+    PLACENAME_ITEM_COLUMNS for this database, for selecting item rows in bulk
+    '''
+    return PLACENAME_ITEM_COLUMNS.format(dggs_cell=_dggs_cell(placenames_columns()))
+
+
+def placenames_columns():
+    '''
+    The names of the columns of the PLACENAMES table, read once when the connection pool is created
+    '''
+    db_pool()
+    return _placenames_columns
+
+
+def db_pool_close():
+    '''
+    Closes the idle pooled connections, e.g. before a preforking server forks its workers
+    '''
+    if _pool is not None:
+        _pool.closeall()
+
+
+def db_pool_stats():
+    return db_pool().stats()
+
+
+def db_pool_metrics():
+    '''
+    Connection pool gauges for metrics.expose(), none if the pool has not been created
+    '''
+    if _pool is None:
+        return []
+    stats = _pool.stats()
+    return [
+        ('placenames_db_pool_connections', 'gauge', 'Pooled database connections',
+         [([('state', 'idle')], stats['idle']), ([('state', 'in_use')], stats['in_use'])]),
+        ('placenames_db_pool_acquisitions_total', 'counter', 'Connections taken from the pool',
+         [([], stats['acquisitions'])]),
+        ('placenames_db_pool_timeouts_total', 'counter', 'Requests that gave up waiting for a connection',
+         [([], stats['timeouts'])]),
+        ('placenames_db_pool_wait_seconds_total', 'counter', 'Time spent waiting for connections',
+         [([], stats['wait_total'])])
+    ]
 
-def db_select(q):
+
+def _db_run(execute, statement):
+    pool = db_pool()
+    with metrics.stage('db_connect'):
+        pooled = pool.getconn()
+    broken = False
+    try:
+        cur = pooled.conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
+        try:
+            started = time.time()
+            with metrics.stage('db_select'):
+                execute(pooled, cur)
+                rows = cur.fetchall()
+            duration = time.time() - started
+            pool.record_query(duration)
+            metrics.DB_QUERIES.inc(statement)
+            logger.debug('db query: waited {:.4f}s for a connection, ran for {:.4f}s'.format(pooled.waited, duration))
+            return rows
+        finally:
+            cur.close()
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        pool.putconn(pooled, broken=broken)
+
+
+def db_select(q, params=None):
     try:
-        conn = psycopg2.connect(**DB_CON_DICT['db_con'])
+        return _db_run(lambda pooled, cur: cur.execute(q, params), 'select')
+    except Exception as e:
+        print(e)
 
-        cur = conn.cursor(cursor_factory=psycopg2.extras.DictCursor)
-        cur.execute(q)
-        return cur.fetchall()
+
+def db_select_prepared(name, params):
+    '''
+    Executes a statement registered with ConnectionPool.prepare(), PREPAREing it on the connection the first time
+    '''
+    def execute(pooled, cur):
+        db_pool().ensure_prepared(pooled, cur, name)
+        cur.execute('EXECUTE {} ({})'.format(name, ', '.join(['%s'] * len(params))), params)
+
+    try:
+        return _db_run(execute, name)
     except Exception as e:
         print(e)
+
+
+def db_stream(q, params=None, batch_size=DB_STREAM_BATCH_SIZE):
+    '''
+    Yields the rows of a query in lists of at most batch_size, read through a server-side cursor so that only one batch
+    is held in memory however many rows there are. The pooled connection is held until the generator is exhausted or
+    closed, so close it (e.g. by letting Flask close a streamed response) when stopping early.
+    '''
+    pool = db_pool()
+    pooled = pool.getconn()
+    broken = False
+    try:
+        # server-side (named) cursors only live inside a transaction
+        pooled.conn.autocommit = False
+        cur = pooled.conn.cursor('db_stream')
+        try:
+            cur.itersize = batch_size
+            cur.execute(q, params)
+            metrics.DB_QUERIES.inc('stream')
+            while True:
+                rows = cur.fetchmany(batch_size)
+                if not rows:
+                    break
+                yield rows
+        finally:
+            cur.close()
+    except (psycopg2.OperationalError, psycopg2.InterfaceError):
+        broken = True
+        raise
+    finally:
+        if not broken:
+            try:
+                pooled.conn.rollback()
+                pooled.conn.autocommit = True
+            except psycopg2.Error:
+                broken = True
+        pool.putconn(pooled, broken=broken)
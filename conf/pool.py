@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+'''
+A small thread-safe pool of psycopg2 connections
+
+Connections are created on demand up to maxconn, health checked when they are handed out and recycled once they
+reach max_lifetime. Each connection remembers which named prepared statements it has already PREPAREd so fixed
+lookups are only planned once per backend. Acquire wait times and query times are recorded so the pool can be sized
+against the number of Flask threads / mod_wsgi processes.
+'''
+import os
+import threading
+import time
+from collections import deque
+
+import psycopg2
+from psycopg2 import extensions
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class _PooledConnection(object):
+    __slots__ = ('conn', 'created', 'last_used', 'prepared', 'waited')
+
+    def __init__(self, conn):
+        self.conn = conn
+        self.created = time.time()
+        self.last_used = self.created
+        self.prepared = set()
+        self.waited = 0.0  # how long the current holder waited to acquire this connection
+
+
+class ConnectionPool(object):
+    """
+    Hands out psycopg2 connections to at most maxconn concurrent users, blocking for up to timeout seconds when all
+    connections are in use.
+    """
+
+    def __init__(self, con_dict, minconn=1, maxconn=10, timeout=30, max_lifetime=3600, check_idle=30,
+                 stats_window=1000):
+        self.con_dict = con_dict
+        self.minconn = int(minconn)
+        self.maxconn = int(maxconn)
+        self.timeout = float(timeout)
+        self.max_lifetime = float(max_lifetime)  # seconds before a connection is closed and replaced
+        self.check_idle = float(check_idle)      # connections idle for longer than this are pinged before use
+        self.prepared_statements = {}            # name -> (argument types, query)
+
+        self._pid = os.getpid()
+        self._lock = threading.Lock()
+        self._available = threading.Condition(self._lock)
+        self._idle = deque()
+        self._in_use = 0
+
+        self._acquisitions = 0
+        self._timeouts = 0
+        self._created = 0
+        self._discarded = 0
+        self._wait_total = 0.0
+        self._wait_max = 0.0
+        self._queries = 0
+        self._query_total = 0.0
+        self._waits = deque(maxlen=stats_window)
+        self._query_times = deque(maxlen=stats_window)
+
+        for i in range(self.minconn):
+            self._idle.append(self._connect())
+
+    def _connect(self):
+        conn = psycopg2.connect(**self.con_dict)
+        conn.autocommit = True  # the API only reads, so no transaction is left open between queries
+        with self._lock:
+            self._created += 1
+        return _PooledConnection(conn)
+
+    def _discard(self, pooled):
+        # called with the lock held, as it counts the connection
+        self._discarded += 1
+        try:
+            pooled.conn.close()
+        except Exception:
+            pass
+
+    def _healthy(self, pooled):
+        conn = pooled.conn
+        if conn.closed:
+            return False
+        if time.time() - pooled.created > self.max_lifetime:
+            return False
+        if conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+            return False
+        if time.time() - pooled.last_used > self.check_idle:
+            try:
+                with conn.cursor() as cur:
+                    cur.execute('SELECT 1')
+            except psycopg2.Error:
+                return False
+        return True
+
+    def _check_fork(self):
+        # connections must never be shared across a fork (e.g. a preforking mod_wsgi/gunicorn master), so a child
+        # process forgets the parent's connections without closing the parent's sockets
+        if os.getpid() != self._pid:
+            with self._lock:
+                if os.getpid() != self._pid:
+                    self._pid = os.getpid()
+                    self._idle.clear()
+                    self._in_use = 0
+
+    def getconn(self):
+        self._check_fork()
+        started = time.time()
+        with self._available:
+            while not self._idle and self._in_use >= self.maxconn:
+                remaining = self.timeout - (time.time() - started)
+                if remaining <= 0:
+                    self._timeouts += 1
+                    raise PoolTimeout('No database connection became free within {} seconds'.format(self.timeout))
+                self._available.wait(remaining)
+            pooled = self._idle.pop() if self._idle else None
+            self._in_use += 1
+
+        try:
+            if pooled is not None and not self._healthy(pooled):
+                with self._lock:
+                    self._discard(pooled)
+                pooled = None
+            if pooled is None:
+                pooled = self._connect()
+        except Exception:
+            self.putconn(None)
+            raise
+
+        waited = time.time() - started
+        pooled.waited = waited
+        with self._lock:
+            self._acquisitions += 1
+            self._wait_total += waited
+            self._wait_max = max(self._wait_max, waited)
+            self._waits.append(waited)
+        return pooled
+
+    def putconn(self, pooled, broken=False):
+        with self._available:
+            self._in_use -= 1
+            if pooled is not None:
+                if broken or pooled.conn.closed or len(self._idle) >= self.maxconn:
+                    self._discard(pooled)
+                else:
+                    if pooled.conn.info.transaction_status != extensions.TRANSACTION_STATUS_IDLE:
+                        try:
+                            pooled.conn.rollback()
+                        except psycopg2.Error:
+                            self._discard(pooled)
+                            self._available.notify()
+                            return
+                    pooled.last_used = time.time()
+                    self._idle.append(pooled)
+            self._available.notify()
+
+    def prepare(self, name, query, arg_types=('text',)):
+        """
+        Registers a named statement. Each connection PREPAREs it the first time it is executed on that connection.
+        The query uses Postgres' positional parameters ($1, $2, ...).
+        """
+        self.prepared_statements[name] = (tuple(arg_types), query)
+
+    def ensure_prepared(self, pooled, cur, name):
+        if name not in pooled.prepared:
+            arg_types, query = self.prepared_statements[name]
+            cur.execute('PREPARE {} ({}) AS {}'.format(name, ', '.join(arg_types), query))
+            pooled.prepared.add(name)
+
+    def record_query(self, duration):
+        with self._lock:
+            self._queries += 1
+            self._query_total += duration
+            self._query_times.append(duration)
+
+    def closeall(self):
+        with self._lock:
+            while self._idle:
+                self._discard(self._idle.pop())
+
+    def stats(self):
+        """
+        Returns a dict of pool counters and acquire wait / query time percentiles (in seconds) over the most recent
+        stats_window operations
+        """
+        def percentiles(samples):
+            ordered = sorted(samples)
+            if not ordered:
+                return {'p50': None, 'p95': None, 'p99': None}
+            return {
+                'p{}'.format(p): ordered[min(len(ordered) - 1, int(len(ordered) * p / 100.0))]
+                for p in (50, 95, 99)
+            }
+
+        with self._lock:
+            return {
+                'minconn': self.minconn,
+                'maxconn': self.maxconn,
+                'idle': len(self._idle),
+                'in_use': self._in_use,
+                'created': self._created,
+                'discarded': self._discarded,
+                'acquisitions': self._acquisitions,
+                'timeouts': self._timeouts,
+                'wait_total': self._wait_total,
+                'wait_max': self._wait_max,
+                'wait': percentiles(self._waits),
+                'queries': self._queries,
+                'query_total': self._query_total,
+                'query': percentiles(self._query_times)
+            }
@@ -1,16 +1,38 @@
-from flask import Blueprint, request, Response, render_template
+from flask import Blueprint, request, Response, render_template, jsonify, url_for
 from model.placename import Placename
 from model.place import Place
-from pyldapi import ContainerRenderer
+from model import register, dump, batch, conditional, placemap, dggs, backend, metrics, item_store, facets, \
+    shared_cache
+from model.dataset import data_version
+from model.search_index import SEARCH_INDEX
+from model.fuzzy_index import FUZZY_INDEX
+from model.autocomplete import AUTOCOMPLETE_INDEX, normalise
+from model.gazetteer import GAZETTEERS
+from model.spatial_index import SPATIAL_INDEX, FILTERS
+from model.cache import QueryCache, CACHES
 import conf
-import folium
 import os
+from urllib.parse import urlencode
 
 print(__name__)
 routes = Blueprint('controller', __name__)
 
 DEFAULT_ITEMS_PER_PAGE=50
 
+# values of the register match parameter: substring (LIKE) search, the default, or ranked fuzzy search
+MATCH_MODES = ('contains', 'fuzzy')
+
+# label, comment and parent container label of each register
+REGISTERS = {
+    'placenames': ('Place Names Register', 'A register of Place Names', 'Placenames'),
+    'places': ('Places Register', 'A register of Places', 'Places')
+}
+
+REGISTER_CACHE = QueryCache('register', maxsize=conf.REGISTER_CACHE_SIZE, ttl=conf.REGISTER_CACHE_TTL)
+MAP_CACHE = QueryCache('map', maxsize=conf.MAP_CACHE_SIZE, ttl=conf.MAP_CACHE_TTL)
+# the map page doesn't depend on the data, so it is kept for good (one entry per script root), apart from the clusters
+MAP_PAGE_CACHE = QueryCache('map_page', maxsize=16, ttl=None)
+
 @routes.route('/fsdf_home', strict_slashes=True)
 def fsdf_home():
     return render_template('fsdf_home.html')
@@ -26,141 +48,424 @@ def dataset_ttl():
     return Response(ttl_txt, mimetype='text/turtle')
 
 
-@routes.route('/collections/placenames/')
-def placenames():
+def _facet_cube(version, search, dggs_cell):
+    # the facet value combination counts of a search, shared by all its pages, filters and facets
+    return REGISTER_CACHE.get_or_compute(('cube', version, search, dggs_cell),
+                                         lambda: backend.get().facet_cube(search, dggs_cell))
+
+
+def _current_index(holder, version):
+    # the holder's index if it was built from the data at version (or from its own CSV file), else None
+    index = holder.get()
+    return index if holder.csv_file is not None or holder.version == version else None
+
+
+def _register_page(version, search, per_page, page, after, before, dggs_cell=None, fuzzy=False, filters=None):
+    '''
+    One page of a register at the data version (see data_version()), which is part of every cache key so that no
+    page or count read before a resupply is used with the new version
+    '''
+    if fuzzy:
+        # _render_register() has checked that the index is built
+        return FUZZY_INDEX.get().register_page(search, per_page, page=page)
+    index = _current_index(SEARCH_INDEX, version) if search and not dggs_cell and not filters else None
+    if index is not None:
+        # searches are answered from the in-memory index once it has been built
+        return index.register_page(search, per_page, page=page, after=after, before=before)
+
+    if filters:
+        # the number of placenames with the filtered values is a sum of facet counts
+        no_of_items, _ = facets.facet_counts(_facet_cube(version, search, dggs_cell), [], filters)
+    else:
+        # get the register length from the backend, shared by all pages of the same search
+        no_of_items = REGISTER_CACHE.get_or_compute(('count', version, search, dggs_cell),
+                                                    lambda: backend.get().register_count(search, dggs_cell))
+
+    # get the id and name for each placename record
+    items, page, prev_cursor, next_cursor = backend.get().register_page(
+        no_of_items, per_page, page=page, search=search, after=after, before=before, dggs=dggs_cell, filters=filters)
+    return no_of_items, items, page, prev_cursor, next_cursor
+
+
+def register_response(label, comment, parent_container_label, items, no_of_items, page, per_page, prev_cursor=None,
+                      next_cursor=None, search_string=None, dggs_cell=None, search_mode=None, filters=None,
+                      facet_counts=None):
+    '''
+    The response to the current request for one page of a register, e.g. REGISTERS['placenames']
+    '''
+    return register.RegisterRenderer(request=request,
+                                     instance_uri=request.base_url,
+                                     label=label,
+                                     comment=comment,
+                                     parent_container_uri='http://linked.data.gov.au/def/placenames/PlaceName',
+                                     parent_container_label=parent_container_label,
+                                     members=items,
+                                     members_total_count=no_of_items,
+                                     page=page,
+                                     per_page=per_page,
+                                     prev_cursor=prev_cursor,
+                                     next_cursor=next_cursor,
+                                     profiles=None,
+                                     default_profile_token=None,
+                                     super_register=None,
+                                     page_size_max=1000,
+                                     register_template=None,
+                                     search_query=search_string,
+                                     search_enabled=True,
+                                     dggs_cell=dggs_cell,
+                                     search_mode=search_mode,
+                                     filters=filters,
+                                     facet_counts=facet_counts
+                                     ).render()
+
+
+def _shared_cache_key():
+    # a register page is negotiated by its renderer, so the profile and mediatype are keyed as they were asked for
+    query = sorted((k, v) for k, v in request.args.items(multi=True) if k not in ('_profile', '_mediatype', '_format'))
+    profile = request.args.get('_profile') or request.headers.get('Accept-Profile')
+    mediatype = request.args.get('_mediatype') or request.args.get('_format') or request.headers.get('Accept')
+    return shared_cache.key(request.endpoint, urlencode(query), profile, mediatype)
+
+
+def _render_register(label, comment, parent_container_label):
     # Search specific items using keywords
     search_string = request.values.get('search')
 
     try:
-        # get the register length from the online DB
-        sql = 'SELECT COUNT(*) FROM "PLACENAMES"'
-        if search_string:
-            sql += '''WHERE UPPER("ID") LIKE '%{search_string}%' OR UPPER("NAME") LIKE '%{search_string}%';
-                   '''.format(search_string=search_string.strip().upper())
-
-        no_of_items = conf.db_select(sql)[0][0]
-
         page = int(request.values.get('page')) if request.values.get('page') is not None else 1
         per_page = int(request.values.get('per_page')) \
                    if request.values.get('per_page') is not None else DEFAULT_ITEMS_PER_PAGE
-        offset = (page - 1) * per_page
-
-        # get the id and name for each placename record in the database
-        sql = '''SELECT "ID", "NAME" FROM "PLACENAMES"'''
-        if search_string:
-            sql += '''WHERE UPPER("ID") LIKE '%{search_string}%' OR UPPER("NAME") LIKE '%{search_string}%'
-                   '''.format(search_string=search_string.strip().upper())
-        sql += '''ORDER BY "AUTHORITY", cast('0' || regexp_replace("AUTH_ID", '\D+', '') as integer), "AUTH_ID"
-                OFFSET {} LIMIT {}'''.format(offset, per_page)
-
-        items = []
-        for item in conf.db_select(sql):
-            items.append(
-                (item[0], item[1])
-            )
+        if page < 1 or per_page < 1:
+            raise ValueError('page and per_page must be positive integers')
+        # "after" and "before" are the opaque cursors used by the next and prev links
+        after = request.values.get('after')
+        before = request.values.get('before')
+        if after is not None:
+            register.decode_cursor(after)
+        if before is not None:
+            register.decode_cursor(before)
+        # only list placenames inside this AusPIX cell
+        dggs_cell = dggs.parse_cell(request.values['dggs']) if request.values.get('dggs') else None
+        match = request.values.get('match') or MATCH_MODES[0]
+        if match not in MATCH_MODES:
+            raise ValueError('match must be one of {}'.format(', '.join(MATCH_MODES)))
+        # fuzzy matches are ranked by distance, not in register order, so they are paged by number only
+        fuzzy = match == 'fuzzy' and bool(search_string and search_string.strip())
+        # facet counts for ?facets=AUTHORITY,FEATURE and only the placenames with ?authority=VIC etc.
+        facet_names = facets.parse_facets(request.values.get('facets'))
+        filters = facets.parse_filters(request.values)
+        if fuzzy and (dggs_cell or after or before or facet_names or filters):
+            raise ValueError('a fuzzy search cannot be combined with dggs, after, before, facets or facet filters')
+    except ValueError as e:
+        return Response(str(e), mimetype='text/plain', status=400)
+    if fuzzy and FUZZY_INDEX.get() is None:
+        return Response('The fuzzy search index is still being built, try again shortly', mimetype='text/plain',
+                        status=503, headers={'Retry-After': '30'})
+
+    # the search is matched case-insensitively and ignoring surrounding spaces, so normalise it for the cache key
+    search = search_string.strip().upper() if search_string else None
+
+    def render():
+        try:
+            cache_key = (request.endpoint, version, search, fuzzy, dggs_cell, tuple(sorted(filters.items())),
+                         None if after or before else page, per_page, after, before)
+            with metrics.stage('register_page'):
+                no_of_items, items, page_no, prev_cursor, next_cursor = REGISTER_CACHE.get_or_compute(
+                    cache_key,
+                    lambda: _register_page(version, search, per_page, page, after, before, dggs_cell, fuzzy, filters))
+            facet_counts = None
+            if facet_names:
+                with metrics.stage('register_facets'):
+                    _, facet_counts = facets.facet_counts(_facet_cube(version, search, dggs_cell), facet_names,
+                                                          filters)
+        except Exception as e:
+            print(e)
+            return Response('The Place Names database is offline', mimetype='text/plain', status=500)
+
+        with metrics.stage('register_render'):
+            return register_response(label, comment, parent_container_label, items, no_of_items, page_no, per_page,
+                                     prev_cursor, next_cursor, search_string=search_string, dggs_cell=dggs_cell,
+                                     search_mode='fuzzy' if fuzzy else None, filters=filters,
+                                     facet_counts=facet_counts)
+
+    try:
+        # the registers change whenever any row does, so their validators come from the (cached) data version
+        version = REGISTER_CACHE.get_or_compute(('version',), data_version)
+        count, modified = version
+        has_cells = backend.get().has_dggs_cells()
     except Exception as e:
         print(e)
         return Response('The Place Names database is offline', mimetype='text/plain', status=500)
+    if dggs_cell and not has_cells:
+        return Response('Filtering by DGGS cell needs the precomputed cells, see sql/dggs_cell_column.sql',
+                        mimetype='text/plain', status=501)
+    if fuzzy and _current_index(FUZZY_INDEX, version) is None:
+        # an index of older data still answers until it is rebuilt, but its pages get neither validators of the
+        # current version nor a place in the shared cache
+        return render()
+    # rendered pages are shared with the other worker processes, see model/shared_cache.py
+    return conditional.conditional(request, (request.endpoint, count), modified,
+                                   lambda: shared_cache.cached(_shared_cache_key(), version, render))
+
+
+def _render_item(model, item_id):
+    if conditional.is_conditional(request):
+        # revalidation only needs the item's SUPPLY_DATE, so check it before loading and rendering the item
+        stored, modified = item_store.supply_date(item_id)
+        if not stored:
+            modified = backend.get().modified(item_id)
+        if modified is not None:
+            return conditional.conditional(request, (request.endpoint, item_id), modified,
+                                           lambda: model(request, request.base_url).render())
 
-    return ContainerRenderer(request=request,
-                            instance_uri=request.url,
-                            label='Place Names Register', 
-                            comment='A register of Place Names',
-                            parent_container_uri='http://linked.data.gov.au/def/placenames/PlaceName',
-                            parent_container_label='Placenames',
-                            members=items,
-                            members_total_count=no_of_items,
-                            profiles=None,
-                            default_profile_token=None,
-                            super_register=None,
-                            page_size_max=1000,
-                            register_template=None,
-                            per_page=per_page,
-                            search_query=search_string,
-                            search_enabled=True
-                            ).render()
+    item = model(request, request.base_url)
+    response = item.render()
+    modified = getattr(item, 'supplyDate', None)
+    if modified is not None and response.status_code == 200:
+        conditional.add_validators(response, conditional.etag(request, (request.endpoint, item_id), modified), modified)
+    return response
+
+
+@routes.route('/collections/placenames/')
+def placenames():
+    return _render_register(*REGISTERS['placenames'])
 
 
 @routes.route('/collections/places/')
 def places():
-    # Search specific items using keywords
-    search_string = request.values.get('search')
-    # get the total register count from the XML API
+    return _render_register(*REGISTERS['places'])
+
+
+@routes.route('/collections/placenames/dump')
+def placenames_dump():
+    '''
+    The whole dataset as N-Triples, Turtle or CSV, streamed in batches and gzipped on the fly if the client accepts it
+    '''
+    mediatype = request.values.get('_mediatype') or request.values.get('_format') or \
+        request.accept_mimetypes.best_match(dump.MEDIATYPES, default=dump.MEDIATYPES[0])
+    if mediatype not in dump.MEDIATYPES:
+        return Response('Supported mediatypes are ' + ', '.join(dump.MEDIATYPES), mimetype='text/plain', status=400)
+
     try:
-        # get the register length from the online DB
-        sql = '''SELECT COUNT(*) FROM "PLACENAMES"'''
-        if search_string:
-            sql += '''WHERE UPPER("ID") LIKE '%{search_string}%' OR UPPER("NAME") LIKE '%{search_string}%';
-                   '''.format(search_string=search_string.strip().upper())
-        no_of_items = conf.db_select(sql)[0][0]
+        chunks = dump.dump(mediatype)
+    except Exception as e:
+        print(e)
+        return Response('The Place Names database is offline', mimetype='text/plain', status=500)
 
-        page = int(request.values.get('page')) if request.values.get('page') is not None else 1
-        per_page = int(request.values.get('per_page')) if request.values.get(
-            'per_page') is not None else DEFAULT_ITEMS_PER_PAGE
-        offset = (page - 1) * per_page
-
-        sql = '''SELECT "ID", "NAME" FROM "PLACENAMES"'''
-        if search_string:
-            sql += '''WHERE UPPER("ID") LIKE '%{search_string}%' OR UPPER("NAME") LIKE '%{search_string}%'
-                   '''.format(search_string=search_string.strip().upper())
-        sql += '''ORDER BY "AUTHORITY", cast('0' || regexp_replace("AUTH_ID", '\D+', '') as integer), "AUTH_ID"
-                OFFSET {} LIMIT {}'''.format(offset, per_page)
-
-        items = []
-        for item in conf.db_select(sql):
-            items.append(
-                (item[0], item[1])
-            )
+    headers = {
+        'Content-Disposition': 'attachment; filename=placenames.' + dump.EXTENSIONS[mediatype],
+        'Vary': 'Accept, Accept-Encoding'
+    }
+    if request.accept_encodings['gzip']:
+        headers['Content-Encoding'] = 'gzip'
+        chunks = dump.gzipped(chunks)
+    return Response(chunks, mimetype=mediatype, headers=headers)
+
+
+@routes.route('/collections/placenames/batch', methods=['GET', 'POST'])
+def placenames_batch():
+    '''
+    Looks up many placenames at once. The IDs are given as ?id= (repeated and/or comma separated), as a POSTed form
+    field id, or as a POSTed JSON list or plain text body. Returns JSON, CSV or the merged NCGA view RDF.
+    '''
+    values = request.values.getlist('id')
+    if request.method == 'POST' and not request.form:
+        if request.is_json:
+            body = request.get_json(silent=True)
+            body = body.get('ids') if isinstance(body, dict) else body
+            if not isinstance(body, list):
+                return Response('A JSON body must be a list of IDs or an object with an ids list', mimetype='text/plain',
+                                status=400)
+            values += [str(v) for v in body]
+        else:
+            values.append(request.get_data(as_text=True))
+    ids = batch.parse_ids(values)
+
+    mediatype = request.values.get('_mediatype') or request.values.get('_format') or \
+        request.accept_mimetypes.best_match(batch.MEDIATYPES, default=batch.MEDIATYPES[0])
+    if mediatype not in batch.MEDIATYPES:
+        return Response('Supported mediatypes are ' + ', '.join(batch.MEDIATYPES), mimetype='text/plain', status=400)
+    if not ids:
+        return Response('Give the placename IDs to look up as id parameters or the request body',
+                        mimetype='text/plain', status=400)
+    if len(ids) > conf.BATCH_MAX_IDS:
+        return Response('At most {} IDs can be looked up at once'.format(conf.BATCH_MAX_IDS),
+                        mimetype='text/plain', status=413)
+
+    try:
+        records, missing = batch.lookup(ids)
+    except Exception as e:
+        print(e)
+        return Response('The Place Names database is offline', mimetype='text/plain', status=500)
+    return Response(batch.serialize(records, missing, mediatype), mimetype=mediatype, headers={'Vary': 'Accept'})
+
+
+def _spatial_query(query):
+    index = SPATIAL_INDEX.get()
+    if index is None:
+        return Response('The spatial index is still being built, try again shortly', mimetype='text/plain',
+                        status=503, headers={'Retry-After': '30'})
+    try:
+        filters = {f: request.values[f.lower()] for f in FILTERS if request.values.get(f.lower())}
+        limit = int(request.values.get('limit', conf.SPATIAL_MAX_RESULTS))
+        if not 0 < limit <= conf.SPATIAL_MAX_RESULTS:
+            raise ValueError('limit must be between 1 and {}'.format(conf.SPATIAL_MAX_RESULTS))
+        result = query(index, filters, limit)
+    except (TypeError, ValueError) as e:
+        return Response(str(e), mimetype='text/plain', status=400)
+    if 'distances_km' in result:
+        result['distances_km'] = [round(d, 3) for d in result['distances_km']]
+    return jsonify(result)
+
+
+def _point():
+    try:
+        lon, lat = float(request.values['lon']), float(request.values['lat'])
+    except (KeyError, ValueError):
+        raise ValueError('lon and lat are required')
+    if not (-180 <= lon <= 180 and -90 <= lat <= 90):
+        raise ValueError('lon and lat must be a longitude and latitude in degrees')
+    return lon, lat
+
+
+@routes.route('/collections/placenames/nearest')
+def placenames_nearest():
+    '''
+    The ?k= (default 10) placenames nearest to ?lon=&lat=, optionally only those with the given ?feature=, ?category=,
+    ?group= and/or ?authority=, as register (ID, NAME) members with their distances
+    '''
+    def query(index, filters, limit):
+        k = int(request.values.get('k', 10))
+        if not 0 < k <= limit:
+            raise ValueError('k must be between 1 and {}'.format(limit))
+        members, distances = index.nearest(*_point(), k=k, filters=filters)
+        return {'members': members, 'distances_km': distances}
+    return _spatial_query(query)
+
+
+@routes.route('/collections/placenames/within')
+def placenames_within():
+    '''
+    The placenames within ?radius= km of ?lon=&lat= (nearest first) or inside ?bbox=minx,miny,maxx,maxy (in register
+    order), filtered as for /nearest. Gives the total and the first ?limit= members.
+    '''
+    def query(index, filters, limit):
+        if request.values.get('bbox'):
+            total, members = index.within_bbox(placemap.parse_bbox(request.values['bbox']), filters, limit)
+            return {'total': total, 'members': members}
+        radius = float(request.values.get('radius', 'nan'))
+        if not 0 < radius <= 20000:
+            raise ValueError('Give a bbox, or a radius in km (up to 20000) around lon and lat')
+        total, members, distances = index.within_radius(*_point(), radius_km=radius, filters=filters, limit=limit)
+        return {'total': total, 'members': members, 'distances_km': distances}
+    return _spatial_query(query)
+
+
+@routes.route('/collections/placenames/autocomplete')
+def placenames_autocomplete():
+    '''
+    Up to ?limit= (default 10) placenames whose names start with ?prefix=, optionally only those of ?authority=, as
+    [ID, NAME, FEATURE, AUTHORITY] completions, for search-as-you-type
+    '''
+    index = AUTOCOMPLETE_INDEX.get()
+    if index is None:
+        return Response('The autocomplete index is still being built, try again shortly', mimetype='text/plain',
+                        status=503, headers={'Retry-After': '30'})
+    prefix = request.values.get('prefix', '')
+    authority = request.values.get('authority', '').strip().upper() or None
+    try:
+        if not normalise(prefix):
+            raise ValueError('prefix must have a letter or digit')
+        if authority is not None and authority not in GAZETTEERS:
+            raise ValueError('authority must be one of {}'.format(', '.join(sorted(GAZETTEERS))))
+        limit = int(request.values.get('limit', 10))
+        if not 0 < limit <= conf.AUTOCOMPLETE_MAX_RESULTS:
+            raise ValueError('limit must be between 1 and {}'.format(conf.AUTOCOMPLETE_MAX_RESULTS))
+    except ValueError as e:
+        return Response(str(e), mimetype='text/plain', status=400)
+
+    def render():
+        return jsonify({'prefix': prefix, 'completions': index.complete(prefix, limit, authority)})
+
+    try:
+        count, modified = REGISTER_CACHE.get_or_compute(('version',), data_version)
     except Exception as e:
         print(e)
         return Response('The Place Names database is offline', mimetype='text/plain', status=500)
+    response = conditional.conditional(request, (request.endpoint, count), modified, render)
+    # every keystroke is a request, so let the browser and any proxy answer repeated ones
+    response.cache_control.public = True
+    response.cache_control.max_age = conf.AUTOCOMPLETE_MAX_AGE
+    return response
+
+
+@routes.route('/status/db-pool')
+def db_pool_status():
+    '''
+    Connection pool counters and recent acquire wait / query time percentiles, for sizing the pool
+    '''
+    return jsonify(conf.db_pool_stats())
+
+
+@routes.route('/metrics')
+def metrics_text():
+    '''
+    Request latency histograms per route and mediatype, stage timings, DB query counts and cache hit ratios, in the
+    Prometheus text format
+    '''
+    return Response(metrics.expose(conf.db_pool_metrics()), mimetype='text/plain; version=0.0.4')
+
 
-    return ContainerRenderer(request=request,
-                            instance_uri=request.url,
-                            label='Places Register',
-                            comment='A register of Places',
-                            parent_container_uri='http://linked.data.gov.au/def/placenames/PlaceName',
-                            parent_container_label='Places',
-                            members=items,
-                            members_total_count=no_of_items,
-                            profiles=None,
-                            default_profile_token=None,
-                            super_register=None,
-                            page_size_max=1000,
-                            register_template=None,
-                            per_page=per_page,
-                            search_query=search_string,
-                            search_enabled=True
-                            ).render()
+@routes.route('/status/cache')
+def cache_status():
+    '''
+    Size and hit/miss counts of each result cache
+    '''
+    stats = {name: cache.stats() for name, cache in CACHES.items()}
+    if shared_cache.get() is not None:
+        stats['shared'] = shared_cache.get().stats()
+    return jsonify(stats)
 
 
 @routes.route('/map')
 def show_map():
     '''
-    Function to render a map around the specified coordinates
+    Function to render a map around the specified coordinates (?name=&x=&y=), with the placenames in view clustered.
+    The page doesn't depend on the query string, so it is rendered once and then served from the cache.
     '''
-    name = request.values.get('name')
-    x = float(request.values.get('x'))
-    y = float(request.values.get('y'))
+    data_url = url_for('controller.map_data')
+    items_url = url_for('controller.placenames_item', placename_id='')
+    return MAP_PAGE_CACHE.get_or_compute((data_url, items_url), lambda: placemap.shell(data_url, items_url))
+
 
-    # create a new map object
-    folium_map = folium.Map(location=[y, x], zoom_start=10)
-    tooltip = 'Click for more information'
-    # create markers
-    folium.Marker([y, x],
-                  popup = name,
-                  tooltip=tooltip).add_to(folium_map),
+@routes.route('/map/data')
+def map_data():
+    '''
+    The placenames in ?bbox=minx,miny,maxx,maxy clustered for a map at ?zoom=, as GeoJSON
+    '''
+    try:
+        bbox = placemap.parse_bbox(request.values.get('bbox', '-180,-90,180,90'))
+        zoom = int(request.values.get('zoom', 4))
+    except ValueError as e:
+        return Response(str(e), mimetype='text/plain', status=400)
 
-    return folium_map.get_root().render()
+    size, bbox = placemap.grid(bbox, zoom)
+    index = SPATIAL_INDEX.get()
+    if index is not None:
+        return jsonify(index.clusters(size, bbox))
+    try:
+        return jsonify(MAP_CACHE.get_or_compute(('clusters', size, bbox),
+                                                lambda: backend.get().clusters(size, bbox)))
+    except Exception as e:
+        print(e)
+        return Response('The Place Names database is offline', mimetype='text/plain', status=500)
 
 
 @routes.route('/collections/placenames/items/<string:placename_id>')
 def placenames_item(placename_id):
-    pn = Placename(request, request.base_url)
-    return pn.render()
+    return _render_item(Placename, placename_id)
 
 
 @routes.route('/collections/places/items/<string:place_id>')
 def places_item(place_id):
-    pn = Place(request, request.base_url)
-    return pn.render()
+    return _render_item(Place, place_id)
@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+'''
+In-memory prefix index answering /collections/placenames/autocomplete?prefix=
+
+Every NAME is normalised (upper-cased, apostrophes dropped and any other run of punctuation and spaces made one space)
+and the normalised names are kept sorted, once for all the placenames and once per AUTHORITY. The names starting with
+a prefix are then a contiguous run of the sorted list, found with one binary search, and the completions are the first
+few of that run: the name itself if there is one, then the longer names in alphabetical order, and placenames with the
+same name in register order.
+'''
+import re
+import sys
+from bisect import bisect_left
+
+import numpy as np
+
+import conf
+from .dataset import IndexHolder, load_rows
+
+_SEPARATORS = re.compile('[^0-9A-Z]+')
+
+
+def normalise(text):
+    '''
+    The form names are compared in, e.g. MT ST JOHN for "Mt. St John's"
+    '''
+    return _SEPARATORS.sub(' ', str(text).upper().replace("'", '')).strip()
+
+
+class PrefixIndex(object):
+    """
+    The normalised NAME of every PLACENAMES row, sorted, overall and per AUTHORITY
+    """
+
+    def __init__(self, rows):
+        '''
+        :param rows: dicts with ID, NAME, FEATURE and AUTHORITY in register order, see dataset.load_rows()
+        '''
+        self.ids = []
+        self.names = []
+        self.features = []
+        self.authorities = []
+        keys = []
+        for row in rows:
+            self.ids.append(row['ID'])
+            self.names.append(row['NAME'])
+            # a few hundred feature types and ten authorities, each held once
+            self.features.append(sys.intern(str(row['FEATURE'])) if row['FEATURE'] is not None else None)
+            self.authorities.append(sys.intern(str(row['AUTHORITY'])))
+            keys.append(normalise(row['NAME']))
+
+        # (sorted keys, the positions they belong to) overall (None) and for each authority
+        self.sorted = {}
+        order = sorted(range(len(keys)), key=keys.__getitem__)  # stable, so equal names stay in register order
+        scopes = {None: order}
+        for position in order:
+            scopes.setdefault(self.authorities[position], []).append(position)
+        for scope, positions in scopes.items():
+            self.sorted[scope] = ([keys[p] for p in positions], np.array(positions, dtype=np.int32))
+
+    @classmethod
+    def build(cls, csv_file=None):
+        return cls(load_rows(['ID', 'NAME', 'FEATURE', 'AUTHORITY'], csv_file=csv_file))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def complete(self, prefix, limit=10, authority=None):
+        '''
+        Up to limit [ID, NAME, FEATURE, AUTHORITY] of the placenames whose names start with prefix, optionally only
+        those of one AUTHORITY
+        '''
+        # a prefix ending in a space or punctuation only completes to names with more words
+        ends_word = _SEPARATORS.match(str(prefix).upper().replace("'", '')[-1:])
+        prefix = normalise(prefix) + (' ' if ends_word else '')
+        keys, positions = self.sorted.get(authority, ([], None))
+        start = bisect_left(keys, prefix)
+        end = start
+        while end < len(keys) and end - start < limit and keys[end].startswith(prefix):
+            end += 1
+        return [[self.ids[p], self.names[p], self.features[p], self.authorities[p]]
+                for p in positions[start:end].tolist()] if end > start else []
+
+
+AUTOCOMPLETE_INDEX = IndexHolder('autocomplete', PrefixIndex.build, csv_file=conf.INDEX_CSV_FILE)
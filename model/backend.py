@@ -0,0 +1,210 @@
+# -*- coding: utf-8 -*-
+'''
+Interchangeable sources of the PLACENAMES data
+
+Routes and models get their data from get(), which is either the Postgres database (PostgresBackend) or, when
+conf.SNAPSHOT_CSV_FILE is set, a read-only column store loaded from a CSV file (SnapshotBackend, see
+model/snapshot.py). The snapshot needs no database at all, so a mirror or a load test can run from a dump CSV.
+
+Both backends return the same values: item rows with the columns of conf.PLACENAME_ITEM_QUERY, register pages as
+(ID, NAME) members with the same cursors, and dict rows in register order for the in-memory indexes.
+'''
+import threading
+
+import conf
+from . import register, placemap
+from .snapshot import SnapshotStore
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+class PostgresBackend(object):
+    """
+    The PLACENAMES table in Postgres, read through the connection pool in conf
+    """
+    name = 'postgres'
+
+    def item(self, placename_id):
+        # the item query is a prepared statement held by each pooled connection, see conf.PLACENAME_ITEM_QUERY
+        rows = conf.db_select_prepared('placename_item', (placename_id,))
+        if rows is None:
+            raise IOError('The Place Names database is offline')
+        return rows[0] if rows else None
+
+    def items(self, placename_ids):
+        rows = conf.db_select('SELECT "ID", {} FROM "PLACENAMES" WHERE "ID" = ANY(%s)'
+                              .format(conf.placename_item_columns()), (list(placename_ids),))
+        if rows is None:
+            raise IOError('The Place Names database is offline')
+        return {row[0]: tuple(row[1:]) for row in rows}
+
+    def modified(self, placename_id):
+        rows = conf.db_select_prepared('placename_modified', (placename_id,))
+        return rows[0][0] if rows else None
+
+    def register_count(self, search=None, dggs=None, filters=None):
+        return register.register_count(search, dggs, filters)
+
+    def register_page(self, total, per_page, page=1, search=None, after=None, before=None, dggs=None,
+                      filters=None):
+        return register.register_page(total, per_page, page=page, search=search, after=after, before=before,
+                                      dggs=dggs, filters=filters)
+
+    def facet_cube(self, search=None, dggs=None):
+        return register.facet_cube(search, dggs)
+
+    def has_dggs_cells(self):
+        return conf.DGGS_CELL_COLUMN in conf.placenames_columns()
+
+    def data_version(self):
+        '''
+        A cheap value that changes whenever the gazetteer is resupplied: the row count and the latest SUPPLY_DATE
+        '''
+        row = conf.db_select('SELECT COUNT(*), MAX("SUPPLY_DATE") FROM "PLACENAMES"')[0]
+        return row[0], row[1]
+
+    def rows(self, columns, since=None):
+        columns = list(columns)
+        for c in ('ID', 'AUTHORITY', 'AUTH_ID'):
+            if c not in columns:
+                columns.append(c)
+        sql = 'SELECT {}, {} AS "AUTH_ID_NUM" FROM "PLACENAMES"'.format(
+            ', '.join('"{}"'.format(c) for c in columns), register.SORT_KEY[1])
+        if since is not None:
+            sql += ' WHERE "SUPPLY_DATE" > %s'
+        rows = [dict(zip(columns + ['AUTH_ID_NUM'], row)) for row in conf.db_select(sql, (since,) if since is not None else None)]
+        # sorted here rather than by the database so that the order agrees with Python's comparison of the keys,
+        # whatever the database collation
+        rows.sort(key=register.register_key)
+        return rows
+
+    def stream_items(self, batch_size=None):
+        '''
+        Lists of (ID, item query columns...) rows for the whole table, in register order
+        '''
+        return conf.db_stream('SELECT "ID", {} FROM "PLACENAMES" ORDER BY {}'.format(
+            conf.placename_item_columns(), ', '.join(register.SORT_KEY)), batch_size=batch_size or
+            conf.DB_STREAM_BATCH_SIZE)
+
+    def stream_changed(self, since, batch_size=None):
+        '''
+        Lists of (ID, item query columns...) rows supplied after since, in register order
+        '''
+        return conf.db_stream('SELECT "ID", {} FROM "PLACENAMES" WHERE "SUPPLY_DATE" > %s ORDER BY {}'.format(
+            conf.placename_item_columns(), ', '.join(register.SORT_KEY)), (since,), batch_size=batch_size or
+            conf.DB_STREAM_BATCH_SIZE)
+
+    def stream_columns(self, columns, batch_size=None):
+        '''
+        Lists of rows of the given columns for the whole table, in register order
+        '''
+        return conf.db_stream('SELECT {} FROM "PLACENAMES" ORDER BY {}'.format(
+            ', '.join('"{}"'.format(c) for c in columns), ', '.join(register.SORT_KEY)), batch_size=batch_size or
+            conf.DB_STREAM_BATCH_SIZE)
+
+    def clusters(self, size, bbox):
+        return placemap.clusters(size, bbox)
+
+
+class SnapshotBackend(object):
+    """
+    A SnapshotStore of conf.SNAPSHOT_CSV_FILE. Each call uses the snapshot of the file as it is now, so replacing the
+    file switches to the new data.
+    """
+    name = 'snapshot'
+
+    def __init__(self, csv_file):
+        self.csv_file = csv_file
+
+    @property
+    def store(self):
+        return SnapshotStore.load(self.csv_file)
+
+    def item(self, placename_id):
+        store = self.store
+        position = store.positions.get(placename_id)
+        return store.item_row(position) if position is not None else None
+
+    def items(self, placename_ids):
+        store = self.store
+        return {placename_id: store.item_row(store.positions[placename_id])
+                for placename_id in placename_ids if placename_id in store.positions}
+
+    def modified(self, placename_id):
+        store = self.store
+        position = store.positions.get(placename_id)
+        return store.value('SUPPLY_DATE', position) if position is not None else None
+
+    def _hits(self, store, search, dggs, filters=None):
+        hits = store.search(search) if search else range(len(store))
+        if dggs:
+            cells = store.cell_positions(dggs)
+            hits = cells if not search else sorted(set(hits).intersection(cells))
+        if filters:
+            hits = store.with_values(hits, filters)
+        return hits
+
+    def register_count(self, search=None, dggs=None, filters=None):
+        store = self.store
+        return len(self._hits(store, search, dggs, filters))
+
+    def register_page(self, total, per_page, page=1, search=None, after=None, before=None, dggs=None,
+                      filters=None):
+        store = self.store
+        total, members, page, prev_cursor, next_cursor = store.page(
+            self._hits(store, search, dggs, filters), per_page, page=page, after=after, before=before)
+        return members, page, prev_cursor, next_cursor
+
+    def facet_cube(self, search=None, dggs=None):
+        store = self.store
+        return store.facet_cube(self._hits(store, search, dggs) if search or dggs else None)
+
+    def has_dggs_cells(self):
+        return self.store.cells is not None
+
+    def data_version(self):
+        return self.store.data_version()
+
+    def rows(self, columns, since=None):
+        return self.store.rows(columns, since=since)
+
+    def stream_items(self, batch_size=None):
+        store = self.store
+        batch_size = batch_size or conf.DB_STREAM_BATCH_SIZE
+        for start in range(0, len(store), batch_size):
+            yield [(store.ids[p],) + store.item_row(p) for p in range(start, min(start + batch_size, len(store)))]
+
+    def stream_changed(self, since, batch_size=None):
+        store = self.store
+        batch_size = batch_size or conf.DB_STREAM_BATCH_SIZE
+        positions = store.supplied_since(since)
+        for start in range(0, len(positions), batch_size):
+            yield [(store.ids[p],) + store.item_row(p) for p in positions[start:start + batch_size]]
+
+    def stream_columns(self, columns, batch_size=None):
+        store = self.store
+        batch_size = batch_size or conf.DB_STREAM_BATCH_SIZE
+        for start in range(0, len(store), batch_size):
+            yield [tuple(store.value(c, p) for c in columns)
+                   for p in range(start, min(start + batch_size, len(store)))]
+
+    def clusters(self, size, bbox):
+        from .spatial_index import SpatialIndex  # not at the top: spatial_index loads its rows through this module
+        store = self.store
+        if store.spatial_index is None:
+            store.spatial_index = SpatialIndex(store.rows(['NAME', 'LONGITUDE', 'LATITUDE', 'FEATURE', 'CATEGORY',
+                                                           'GROUP']))
+        return store.spatial_index.clusters(size, bbox)
+
+
+def get():
+    '''
+    The backend the service is configured to use
+    '''
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = SnapshotBackend(conf.SNAPSHOT_CSV_FILE) if conf.SNAPSHOT_CSV_FILE else PostgresBackend()
+    return _backend
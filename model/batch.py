@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+'''
+Lookup of many placenames by ID in one query
+
+Enrichment jobs that resolve thousands of IDs used to request each item page in turn, paying for a query, DGGS
+attribution and a render every time. lookup() reads all of them at once (in Postgres, with a single
+WHERE "ID" = ANY(...)) and loads each row into a PlacenameRecord, the same field mapping the item views use, so the
+JSON, CSV and RDF written here agree with them.
+'''
+import csv
+import io
+import json
+from collections import OrderedDict
+
+from . import backend, rdf_writer
+from .record import PlacenameRecord
+
+RDF_MEDIATYPES = rdf_writer.MEDIATYPES
+MEDIATYPES = ['application/json', 'text/csv'] + RDF_MEDIATYPES
+
+COLUMNS = ['ID', 'AUTH_ID', 'NAME', 'FEATURE', 'CATEGORY', 'GROUP', 'LATITUDE', 'LONGITUDE', 'AUTHORITY', 'SUPPLY_DATE',
+           'DGGS_CELL', 'URI']
+
+
+def parse_ids(values):
+    '''
+    The distinct IDs in a list of strings that may each hold several comma, space or newline separated IDs, in the
+    order first given
+    '''
+    ids = OrderedDict()
+    for value in values:
+        for placename_id in value.replace(',', ' ').split():
+            ids[placename_id] = None
+    return list(ids)
+
+
+def lookup(ids):
+    '''
+    The records for ids, in the order given, and the IDs that were not found
+    '''
+    found = backend.get().items(ids)
+    records = [PlacenameRecord(placename_id, found[placename_id]) for placename_id in ids if placename_id in found]
+    return records, [placename_id for placename_id in ids if placename_id not in found]
+
+
+def _values(record):
+    row = record.row
+    return OrderedDict(zip(COLUMNS, [
+        record.id,
+        record.auth_id,
+        record.hasName['value'],
+        row[3],
+        row[4],
+        row[5],
+        record.y,
+        record.x,
+        row[1],
+        str(record.supplyDate),
+        record.thisCell['label'],
+        rdf_writer.PNAME + record.id
+    ]))
+
+
+def to_json(records, missing):
+    return json.dumps({
+        'items': [_values(record) for record in records],
+        'missing': missing
+    })
+
+
+def to_csv(records):
+    out = io.StringIO()
+    writer = csv.writer(out, quoting=csv.QUOTE_ALL)
+    writer.writerow(COLUMNS)
+    for record in records:
+        writer.writerow(_values(record).values())
+    return out.getvalue()
+
+
+def to_rdf(records, mediatype):
+    '''
+    The records' NCGA view graphs merged into one document
+    '''
+    triples = []
+    for n, record in enumerate(records):
+        triples.extend(rdf_writer.item_triples(record, official_placename=True, place=True,
+                                               bnode_prefix='b{}'.format(n)))
+    return rdf_writer.serialize(triples, mediatype)
+
+
+def serialize(records, missing, mediatype):
+    if mediatype == 'application/json':
+        return to_json(records, missing)
+    elif mediatype == 'text/csv':
+        return to_csv(records)
+    return to_rdf(records, mediatype)
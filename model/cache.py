@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+'''
+A bounded, thread-safe result cache with LRU eviction and a time-to-live
+
+get_or_compute() holds a lock per key while computing a missing value, so when many threads miss on the same key at
+once (e.g. page 1 of a register just after the entry expired) only one of them runs the query and the others wait for
+its result. Every cache created here is listed in CACHES so its hit/miss counts can be inspected.
+'''
+import threading
+import time
+from collections import OrderedDict
+
+CACHES = {}
+
+_MISSING = object()
+
+
+class QueryCache(object):
+    """
+    Maps hashable keys to values for at most ttl seconds (for as long as they aren't evicted if ttl is None), keeping
+    at most maxsize entries
+    """
+
+    def __init__(self, name, maxsize=1024, ttl=300):
+        self.name = name
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (expiry time, value), least recently used first
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        CACHES[name] = self
+
+    def _get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return _MISSING
+            if entry[0] < time.time():
+                del self._entries[key]
+                self.expirations += 1
+                return _MISSING
+            self._entries.move_to_end(key)
+            return entry[1]
+
+    def get(self, key, default=None):
+        value = self._get(key)
+        with self._lock:
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl if self.ttl is not None else float('inf'), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def get_or_compute(self, key, compute):
+        '''
+        Returns the cached value for key, calling compute() to make it (once, however many threads ask) if there is
+        none. Exceptions raised by compute() are passed on and nothing is cached.
+        '''
+        value = self._get(key)
+        if value is not _MISSING:
+            with self._lock:
+                self.hits += 1
+            return value
+
+        with self._lock:
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        try:
+            with key_lock:
+                # another thread may have computed it while this one waited for the key lock
+                value = self._get(key)
+                with self._lock:
+                    if value is not _MISSING:
+                        self.hits += 1
+                        return value
+                    self.misses += 1
+                value = compute()
+                self.set(key, value)
+                return value
+        finally:
+            with self._lock:
+                if self._key_locks.get(key) is key_lock and not key_lock.locked():
+                    del self._key_locks[key]
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._entries),
+                'maxsize': self.maxsize,
+                'ttl': self.ttl,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_ratio': float(self.hits) / lookups if lookups else None,
+                'evictions': self.evictions,
+                'expirations': self.expirations
+            }
@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+'''
+Validators (ETag and Last-Modified) for conditional GETs
+
+A placename's representations only change when its row is resupplied, which sets SUPPLY_DATE, and the registers only
+change when some row does. The ETag is a hash of that date, the resource and everything the response is negotiated
+from (query string, Accept and Accept-Profile), so each representation gets its own strong validator without having
+to be rendered first. conf.CONTENT_VERSION is part of the hash too, for deployments that change what is rendered.
+'''
+import hashlib
+from datetime import datetime, timezone
+
+from flask import Response
+
+import conf
+
+VARY = ['Accept', 'Accept-Profile']
+
+
+def _http_date(value):
+    # SUPPLY_DATE is a timestamp without time zone, taken to be UTC
+    if isinstance(value, datetime):
+        value = value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+        return value.replace(microsecond=0)
+    return None
+
+
+def etag(request, resource, modified):
+    '''
+    A strong ETag for the representation of resource, last modified at modified, that request negotiates
+    '''
+    variant = [conf.CONTENT_VERSION, resource, str(modified), sorted(request.args.items(multi=True)),
+               request.headers.get('Accept'), request.headers.get('Accept-Profile')]
+    return hashlib.sha1(repr(variant).encode('utf-8')).hexdigest()
+
+
+def is_conditional(request):
+    return bool(request.if_none_match) or request.if_modified_since is not None
+
+
+def not_modified(request, tag, modified):
+    '''
+    Whether the client already holds this representation. If-None-Match is used if sent, else If-Modified-Since.
+    '''
+    if request.if_none_match:
+        return request.if_none_match.contains(tag)
+    modified = _http_date(modified)
+    since = request.if_modified_since
+    if since is None or modified is None:
+        return False
+    since = since if since.tzinfo else since.replace(tzinfo=timezone.utc)
+    return modified <= since
+
+
+def add_validators(response, tag, modified):
+    response.set_etag(tag)
+    if _http_date(modified) is not None:
+        response.last_modified = _http_date(modified)
+    response.vary.update(VARY)
+    return response
+
+
+def not_modified_response(tag, modified):
+    return add_validators(Response(status=304), tag, modified)
+
+
+def conditional(request, resource, modified, render):
+    '''
+    Answers request with a 304 if the client holds the current representation of resource, last modified at
+    modified, or else with render() and its validators. Responses other than 200 OK get no validators.
+    '''
+    if modified is None:
+        return render()
+    tag = etag(request, resource, modified)
+    if not_modified(request, tag, modified):
+        return not_modified_response(tag, modified)
+    response = render()
+    if response.status_code == 200:
+        add_validators(response, tag, modified)
+    return response
@@ -0,0 +1,122 @@
+# -*- coding: utf-8 -*-
+'''
+Loading of the PLACENAMES rows for in-memory indexes, and the holder that keeps such an index current
+
+Rows come from the configured backend (see model/backend.py) or from a given CSV file in the
+sample-data/placename_sample.csv layout. Either way they are returned in register order (see model/register.py).
+'''
+import logging
+import os
+import threading
+import time
+
+import conf
+from . import backend
+from .snapshot import SnapshotStore
+
+logger = logging.getLogger('dataset')
+
+
+def load_rows(columns, csv_file=None, since=None):
+    '''
+    Gets the given PLACENAMES columns for every row, in register order, as a list of dicts. The numeric part of the
+    sort key is included as AUTH_ID_NUM.
+
+    :param columns: column names, e.g. ['ID', 'NAME']
+    :param csv_file: read this CSV file instead of the backend
+    :param since: only get the rows whose SUPPLY_DATE is after this
+    '''
+    columns = list(columns)
+    for c in ('ID', 'AUTHORITY', 'AUTH_ID'):
+        if c not in columns:
+            columns.append(c)
+
+    if csv_file is not None:
+        return SnapshotStore.load(csv_file).rows(columns, since=since)
+    return backend.get().rows(columns, since=since)
+
+
+def data_version(csv_file=None):
+    '''
+    A cheap value that changes whenever the gazetteer is resupplied: the row count and the latest SUPPLY_DATE
+    '''
+    if csv_file is not None:
+        return SnapshotStore.load(csv_file).data_version()
+    return backend.get().data_version()
+
+
+class IndexHolder(object):
+    """
+    Holds an index built by build(csv_file) and rebuilds it in a background thread when data_version() changes.
+    The data version is checked at most every check_interval seconds. get() returns None until the first build has
+    finished, so callers must be able to fall back to the backend.
+
+    An index with a columns list and an unchanged(rows) method is kept, rather than rebuilt, when the row count is
+    the same and the rows supplied after the previous latest SUPPLY_DATE still have the values it holds, e.g. after
+    a resupply that only moved SUPPLY_DATE on.
+    """
+
+    def __init__(self, name, build, check_interval=None, csv_file=None):
+        self.name = name
+        self.build = build
+        self.check_interval = conf.INDEX_CHECK_INTERVAL if check_interval is None else check_interval
+        self.csv_file = csv_file
+        self.index = None
+        self.version = None
+        self._checked = 0
+        self._lock = threading.Lock()
+        self._building = False
+        # a build thread doesn't survive a fork, so a forked worker must not wait for it
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._building = False
+
+    def start(self, wait=False):
+        '''
+        Starts building the index in the background, e.g. at application startup, or builds it before returning if
+        wait is set (see app.warm_up())
+        '''
+        self._checked = time.time()
+        if wait:
+            self.rebuild()
+        else:
+            self._rebuild_async()
+
+    def _rebuild_async(self):
+        with self._lock:
+            if self._building:
+                return
+            self._building = True
+        threading.Thread(target=self.rebuild, name='{}-index'.format(self.name), daemon=True).start()
+
+    def rebuild(self):
+        try:
+            started = time.time()
+            version = data_version(self.csv_file)
+            if version != self.version or self.index is None:
+                if self._unchanged(version):
+                    self.version = version
+                    logger.info('{} index kept, checked in {:.1f}s'.format(self.name, time.time() - started))
+                    return
+                index = self.build(self.csv_file)
+                self.index, self.version = index, version
+                logger.info('{} index built in {:.1f}s'.format(self.name, time.time() - started))
+        except Exception as e:
+            print(e)
+        finally:
+            self._building = False
+
+    def _unchanged(self, version):
+        # whether the index built for self.version still holds for version
+        unchanged = getattr(self.index, 'unchanged', None)
+        if unchanged is None or self.version is None or self.version[1] is None or version[0] != self.version[0]:
+            return False
+        return unchanged(load_rows(self.index.columns, csv_file=self.csv_file, since=self.version[1]))
+
+    def get(self):
+        if time.time() - self._checked > self.check_interval:
+            self._checked = time.time()
+            self._rebuild_async()
+        return self.index
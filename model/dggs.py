@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+'''
+AusPIX (rHEALPix DGGS) cell attribution for placenames
+
+Finding the cell of a point on the ellipsoid is pure-Python projection work, so it is done once per record where
+possible: tools/precompute_dggs.py stores the resolution 9 cell of every row in the DGGS_CELL_9 column, which the item
+query returns when it exists, computing them in bulk with cell_ids(). Anything not precomputed goes through cell_id(),
+which memoises its results.
+
+rhealpixdggs (and the scipy it loads) takes about half a second to import, so it is only imported, and the one shared
+DGGS instance created, the first time a cell has to be computed.
+'''
+import re
+import threading
+from functools import lru_cache
+from math import pi
+
+import numpy as np
+
+import conf
+from . import metrics
+
+# DGGS_uri = 'https://fsdf.org.au/dataset/auspix/collections/auspix/items/'
+DGGS_URI = 'https://linked.data.gov.au/dataset/auspix/'
+RESOLUTION = 9
+
+# a cell ID: one of the six resolution 0 cells followed by a digit 0-8 for each finer resolution
+_CELL_ID = re.compile('^[NOPQRS][0-8]{{0,{}}}$'.format(RESOLUTION))
+
+_rdggs = None
+_rdggs_lock = threading.Lock()
+
+
+def rdggs():
+    '''
+    The one DGGS instance shared by all models and tools
+    '''
+    global _rdggs
+    if _rdggs is None:
+        with _rdggs_lock:
+            if _rdggs is None:
+                from rhealpixdggs import dggs
+                _rdggs = dggs.RHEALPixDGGS()
+    return _rdggs
+
+
+@lru_cache(maxsize=conf.DGGS_CACHE_SIZE)
+def cell_id(resolution, lon, lat):
+    '''
+    The ID (e.g. R783464105) of the cell containing the point, computed on the ellipsoidal curve
+    '''
+    with metrics.stage('dggs'):
+        return str(rdggs().cell_from_point(resolution, (lon, lat), plane=False))  # false = on the elipsoidal curve
+
+
+metrics.add_cache('dggs', lambda: cell_id.cache_info()[:2])
+
+
+def cell_ids(resolution, lons, lats):
+    '''
+    The IDs of the cells containing many points at once, the same as cell_id() gives for each (None for a point
+    outside the DGGS). The points are projected in one numpy pass and the cell digits worked out with array
+    arithmetic, following RHEALPixDGGS.cell_from_point() step by step.
+
+    :param lons: sequence of longitudes
+    :param lats: sequence of latitudes, of the same length
+    '''
+    from rhealpixdggs.dggs import CELLS0
+    dggs = rdggs()
+    x, y = dggs.rhealpix(np.asarray(lons, dtype=np.float64), np.asarray(lats, dtype=np.float64))
+    x, y = np.atleast_1d(x), np.atleast_1d(y)
+
+    # the resolution 0 cell: the north or south polar square, or one of the four equatorial ones
+    r = dggs.ellipsoid.R_A
+    ns, ss = dggs.north_square, dggs.south_square
+    equatorial = (y >= -r * pi / 4) & (y <= r * pi / 4)
+    cell0 = np.select([
+        (y > r * pi / 4) & (y < r * 3 * pi / 4) & (x > r * (-pi + ns * (pi / 2))) & (x < r * (-pi / 2 + ns * (pi / 2))),
+        (y > -r * 3 * pi / 4) & (y < -r * pi / 4) & (x > r * (-pi + ss * (pi / 2))) &
+        (x < r * (-pi / 2 + ss * (pi / 2))),
+        equatorial & (x >= -r * pi) & (x < -r * pi / 2),
+        equatorial & (x >= -r * pi / 2) & (x < 0),
+        equatorial & (x >= 0) & (x < r * pi / 2),
+        equatorial & (x >= r * pi / 2) & (x < r * pi),
+    ], [0, 5, 1, 2, 3, 4], default=-1)  # indexes into CELLS0: N, S, O, P, Q, R
+    inside = cell0 >= 0
+    cell0 = np.where(inside, cell0, 0)
+
+    # the distances from the upper left vertex of the resolution 0 cell, as fractions of its width, each truncated
+    # to a row and column number at the resolution
+    width = dggs.cell_width(0)
+    ul_x = np.array([dggs.ul_vertex[c][0] for c in CELLS0])[cell0]
+    ul_y = np.array([dggs.ul_vertex[c][1] for c in CELLS0])[cell0]
+    smidgen = 0.5 * dggs.cell_width(dggs.max_resolution) / width
+    dx = np.abs(x - ul_x) / width
+    dy = np.abs(y - ul_y) / width
+    dx = np.where(dx == 1, dx - smidgen, dx)
+    dy = np.where(dy == 1, dy - smidgen, dy)
+    n = dggs.N_side
+    rows = np.floor(np.where(inside, dy, 0) * n ** resolution).astype(np.int64)
+    columns = np.floor(np.where(inside, dx, 0) * n ** resolution).astype(np.int64)
+
+    # one character per resolution: the resolution 0 cell, then the child digit of each row and column digit pair
+    child_digits = np.zeros((n, n), dtype=np.uint8)
+    for (row, column), digit in ((k, v) for k, v in dggs.child_order.items() if isinstance(k, tuple)):
+        child_digits[row, column] = digit
+    characters = np.empty((len(x), resolution + 1), dtype=np.uint8)
+    characters[:, 0] = np.frombuffer(''.join(CELLS0).encode('ascii'), dtype=np.uint8)[cell0]
+    for i in range(resolution):
+        place = n ** (resolution - 1 - i)
+        characters[:, i + 1] = child_digits[rows // place % n, columns // place % n] + ord('0')
+    ids = characters.view('S{}'.format(resolution + 1)).ravel()
+    return [cell.decode('ascii') if ok else None for cell, ok in zip(ids, inside)]
+
+
+def cell(lon, lat, stored=None, resolution=RESOLUTION):
+    '''
+    The label and URI of the cell containing the point, as used by the item views. stored is the precomputed cell ID
+    read from the database, if there is one.
+    '''
+    label = stored if stored else cell_id(resolution, lon, lat)
+    return {
+        'label': label,
+        'uri': '{}{}'.format(DGGS_URI, label)
+    }
+
+
+def parse_cell(value):
+    '''
+    A cell ID of resolution RESOLUTION or coarser, e.g. R7852, in upper case. Raises ValueError for anything else.
+    '''
+    cell_id = value.strip().upper()
+    if not _CELL_ID.match(cell_id):
+        raise ValueError('dggs must be an AusPIX cell ID of resolution {} or coarser, e.g. R7852'.format(RESOLUTION))
+    return cell_id
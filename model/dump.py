@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+'''
+Whole-dataset dumps, written as a stream
+
+Harvesters used to crawl every item page to get the whole gazetteer. A dump instead reads the PLACENAMES table in
+register order from the backend (through a server-side cursor for Postgres, see conf.db_stream()) and writes each
+batch of rows as soon as it arrives, so memory use stays at one batch however large the table is. The RDF dumps hold, for every record, the same triples as
+its Placename item in the NCGA profile.
+'''
+import csv
+import io
+import zlib
+
+from . import backend, rdf_writer
+from .record import PlacenameRecord
+
+MEDIATYPES = ['application/n-triples', 'text/turtle', 'text/csv']
+EXTENSIONS = {
+    'application/n-triples': 'nt',
+    'text/turtle': 'ttl',
+    'text/csv': 'csv'
+}
+
+# the columns of sample-data/placename_sample.csv, less geom, so a CSV dump can be used wherever the sample is
+CSV_COLUMNS = ['ID', 'AUTH_ID', 'NAME', 'FEATURE', 'CATEGORY', 'GROUP', 'LATITUDE', 'LONGITUDE', 'AUTHORITY',
+               'SUPPLY_DATE']
+
+
+def _records(rows, start):
+    for n, row in enumerate(rows, start):
+        record = PlacenameRecord(row[0], row[1:])
+        # blank node labels must be unique within the whole document
+        yield rdf_writer.item_triples(record, official_placename=True, place=True, bnode_prefix='b{}'.format(n))
+
+
+def _ntriples(batches):
+    n = 0
+    for rows in batches:
+        yield ''.join(rdf_writer.to_ntriples(triples) for triples in _records(rows, n))
+        n += len(rows)
+
+
+def _turtle(batches):
+    yield rdf_writer.turtle_prefixes()
+    n = 0
+    for rows in batches:
+        yield ''.join('\n' + rdf_writer.to_turtle(triples, header=False) for triples in _records(rows, n))
+        n += len(rows)
+
+
+def _csv(batches):
+    out = io.StringIO()
+    writer = csv.writer(out, quoting=csv.QUOTE_ALL)
+    writer.writerow(CSV_COLUMNS)
+    for rows in batches:
+        writer.writerows(rows)
+        yield out.getvalue()
+        out.seek(0)
+        out.truncate()
+    yield out.getvalue()
+
+
+def dump(mediatype):
+    '''
+    The dataset in one of MEDIATYPES, as a generator of text chunks (about one per DB_STREAM_BATCH_SIZE records).
+    The first batch is read before this returns, so an unreachable database raises here rather than mid-stream.
+    '''
+    if mediatype == 'text/csv':
+        batches = backend.get().stream_columns(CSV_COLUMNS)
+        write = _csv
+    else:
+        batches = backend.get().stream_items()
+        write = _turtle if mediatype == 'text/turtle' else _ntriples
+
+    first = next(batches, None)
+
+    def all_batches():
+        if first is not None:
+            yield first
+            for rows in batches:
+                yield rows
+    return write(all_batches())
+
+
+def gzipped(chunks, level=6):
+    '''
+    Compresses a stream of text chunks into a gzip stream as it goes
+    '''
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 31)  # wbits 16 + 15: gzip header and trailer
+    for chunk in chunks:
+        data = compressor.compress(chunk.encode('utf-8'))
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+'''
+Facets of the registers: ?facets=AUTHORITY,FEATURE gives, with a page of members, how many of the listed placenames
+have each value of those columns, and ?authority=VIC&feature=BAY (any of the FACETS, lower case) lists only the
+placenames with those values.
+
+Both are answered from a "cube": the number of rows with each combination of the FACETS values (backend.facet_cube()),
+a few hundred combinations however many rows there are. For the whole register the cube is the table kept up to date
+by the triggers of sql/facet_counts.sql, so no request counts the placenames themselves, and for a search or DGGS cell
+it is one GROUP BY over the matching rows. The counts of each facet, and the number of placenames matching the
+filters, are sums over the combinations that match the filters.
+'''
+from collections import Counter
+
+FACETS = ['AUTHORITY', 'FEATURE', 'CATEGORY', 'GROUP']
+
+
+def parse_facets(value):
+    '''
+    The FACETS named in a comma separated ?facets= value, in order, e.g. ['AUTHORITY', 'FEATURE']
+    '''
+    facets = []
+    for name in str(value or '').split(','):
+        name = name.strip().upper()
+        if not name:
+            continue
+        if name not in FACETS:
+            raise ValueError('facets must be some of {}'.format(', '.join(FACETS)))
+        if name not in facets:
+            facets.append(name)
+    return facets
+
+
+def parse_filters(values):
+    '''
+    {column: value} of the FACETS given as (lower case) request parameters, e.g. {'AUTHORITY': 'VIC'}, with the values
+    in upper case as in the data (as the spatial filters)
+    '''
+    filters = {f: str(values.get(f.lower()) or '').strip().upper() for f in FACETS}
+    return {f: value for f, value in filters.items() if value}
+
+
+def facet_counts(cube, facets, filters=None):
+    '''
+    The counts of the rows of cube matching filters
+
+    :param cube: (AUTHORITY, FEATURE, CATEGORY, GROUP, count) tuples, see backend.facet_cube()
+    :param facets: the FACETS to count the values of
+    :return: (number of rows matching filters, {facet: [(value, count), ...] most common first})
+    '''
+    wanted = [(FACETS.index(column), value) for column, value in (filters or {}).items()]
+    columns = [FACETS.index(f) for f in facets]
+    total = 0
+    counts = {f: Counter() for f in facets}
+    for combination in cube:
+        if all(combination[i] == value for i, value in wanted):
+            total += combination[-1]
+            for facet, i in zip(facets, columns):
+                # rows without a value can't be filtered on, so they aren't listed
+                if combination[i] is not None:
+                    counts[facet][combination[i]] += combination[-1]
+    return total, {f: sorted(counts[f].items(), key=lambda c: (-c[1], c[0])) for f in facets}
@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+'''
+In-memory index answering fuzzy register searches, ?search=MEEREEK&match=fuzzy
+
+Names are split into words, and every distinct word gets two lookup keys:
+
+* a phonetic key, which keeps the consonant skeleton of the word and reduces each group of vowels to one mark, so
+  spelling variants of the same sounds (MEEREEK and MERIEK are both M*R*G) share a key. Consonants that colonial
+  transcriptions of Aboriginal names use interchangeably (B and P, D and T, G, K, C and Q, ...) are merged, and
+  doubled letters count once.
+* the word with up to FUZZY_MAX_DISTANCE of its letters deleted (symmetric delete), so that a query word and an
+  indexed word that many edits apart (e.g. THOMPSON and TOMSON, or two letters swapped) share a deletion, whatever the
+  phonetic key says.
+
+Deletions are stored as sorted 32 bit hashes with the number of the word they came from, and each word's rows as a
+slice of one array of register positions, which keeps the index small. A query word's candidates are the indexed
+words found through its own deletions, up to the edit bound (FUZZY_MAX_DISTANCE, less for short words), that are
+within that bound by Levenshtein distance, and those sharing its phonetic key within one edit more. A row matches
+when each query word has a candidate in its name, and the matches are ranked by the sum of those distances, then in
+register order.
+'''
+import re
+import zlib
+from array import array
+
+import numpy as np
+
+import conf
+from .dataset import IndexHolder, load_rows
+
+_WORD = re.compile('[A-Z0-9]+')
+
+# letters sounded alike, to the one standing for them in phonetic keys
+_SOUNDS = str.maketrans({'P': 'B', 'T': 'D', 'K': 'G', 'C': 'G', 'Q': 'G', 'X': 'G', 'Z': 'S', 'V': 'F', 'J': 'G'})
+_VOWELS = re.compile('[AEIOUYHW]+')
+
+
+def words(name):
+    '''
+    The words of a name, upper-cased, with apostrophes dropped (O'TOOLE is OTOOLE)
+    '''
+    return _WORD.findall(str(name).upper().replace("'", ''))
+
+
+def phonetic_key(word):
+    '''
+    The consonant skeleton of a word with similar sounds merged and each vowel group (H, W and Y included after the
+    first letter) reduced to *, e.g. M*R*G for MEEREEK and MERIEK
+    '''
+    word = word.replace('PH', 'F').replace('CH', 'J').replace('SH', 'S').translate(_SOUNDS)
+    key = word[0] + _VOWELS.sub('*', word[1:]) if word[0] not in 'AEIOU' else _VOWELS.sub('*', word)
+    return re.sub(r'(.)\1+', r'\1', key)
+
+
+def deletions(word, distance=1):
+    '''
+    The word itself and every string made by deleting up to distance of its letters
+    '''
+    found = level = {word}
+    for _ in range(distance):
+        level = {w[:i] + w[i + 1:] for w in level for i in range(len(w))}.difference(found)
+        found = found | level
+    return found
+
+
+def _hash(text):
+    return zlib.crc32(text.encode('utf-8'))
+
+
+def levenshtein(a, b, bound):
+    '''
+    The edit distance between a and b, or bound + 1 if it is more than bound
+    '''
+    if abs(len(a) - len(b)) > bound:
+        return bound + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > bound:
+            return bound + 1
+        previous = current
+    return min(previous[-1], bound + 1)
+
+
+def word_bound(word):
+    # the most edits a query word may be away from an indexed word it is matched with by spelling
+    if len(word) <= 2:
+        return 0
+    return 1 if len(word) <= 4 else conf.FUZZY_MAX_DISTANCE
+
+
+def phonetic_bound(word):
+    # the most edits a query word may be away from an indexed word sharing its phonetic key, one more than by spelling
+    # as sounding alike is some evidence of the same name
+    return word_bound(word) + 1
+
+
+class FuzzyIndex(object):
+    """
+    The phonetic keys and single-letter deletions of the words of every PLACENAMES NAME
+    """
+
+    def __init__(self, rows):
+        '''
+        :param rows: dicts with ID and NAME in register order, see dataset.load_rows()
+        '''
+        self.ids = []
+        self.names = []
+        word_numbers = {}
+        row_words = []  # (word number, position) for every word of every name
+        for position, row in enumerate(rows):
+            self.ids.append(row['ID'])
+            self.names.append(row['NAME'])
+            for word in dict.fromkeys(words(row['NAME'])):
+                number = word_numbers.setdefault(word, len(word_numbers))
+                row_words.append((number, position))
+        self.words = sorted(word_numbers, key=word_numbers.get)
+
+        # the positions of the rows with each word: positions[offsets[n]:offsets[n + 1]], in register order
+        pairs = np.array(row_words, dtype=np.int32).reshape(-1, 2)
+        pairs = pairs[np.lexsort((pairs[:, 1], pairs[:, 0]))]
+        self.positions = pairs[:, 1].copy()
+        self.offsets = np.searchsorted(pairs[:, 0], np.arange(len(self.words) + 1)).astype(np.int64)
+
+        self.phonetic = {}
+        # arrays rather than lists, as a word has dozens of deletions within two edits
+        hashes, numbers = array('I'), array('i')
+        for number, word in enumerate(self.words):
+            self.phonetic.setdefault(phonetic_key(word), []).append(number)
+            word_deletions = deletions(word, conf.FUZZY_MAX_DISTANCE)
+            hashes.extend(_hash(deletion) for deletion in word_deletions)
+            numbers.extend([number] * len(word_deletions))
+        hashes = np.frombuffer(hashes, dtype=np.uint32)
+        order = np.argsort(hashes, kind='stable')
+        self.deletion_hashes = hashes[order]
+        self.deletion_words = np.frombuffer(numbers, dtype=np.int32)[order]
+
+    @classmethod
+    def build(cls, csv_file=None):
+        return cls(load_rows(['ID', 'NAME'], csv_file=csv_file))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def candidates(self, word):
+        '''
+        {word number: edit distance} of the indexed words word may be a variant of
+        '''
+        bound = word_bound(word)
+        found = {}
+        for number in self.phonetic.get(phonetic_key(word), []):
+            distance = levenshtein(word, self.words[number], phonetic_bound(word))
+            if distance <= phonetic_bound(word):
+                found[number] = distance
+        if bound:
+            hashes = np.array([_hash(d) for d in deletions(word, bound)], dtype=np.uint32)
+            starts = np.searchsorted(self.deletion_hashes, hashes, side='left')
+            ends = np.searchsorted(self.deletion_hashes, hashes, side='right')
+            # a word shares many deletions with its neighbours, so each is compared once
+            shared = np.unique(np.concatenate([self.deletion_words[start:end] for start, end in zip(starts, ends)]))
+            for number in shared.tolist():
+                if number not in found:
+                    distance = levenshtein(word, self.words[number], bound)
+                    if distance <= bound:
+                        found[number] = distance
+        else:
+            number = self._word_number(word)
+            if number is not None:
+                found[number] = 0
+        return found
+
+    def _word_number(self, word):
+        start = np.searchsorted(self.deletion_hashes, _hash(word))
+        for number in self.deletion_words[start:np.searchsorted(self.deletion_hashes, _hash(word), side='right')]:
+            if self.words[number] == word:
+                return int(number)
+        return None
+
+    def _word_matches(self, word):
+        # the sorted positions of the rows with a candidate of word, and the least distance of each
+        found = self.candidates(word)
+        if not found:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+        numbers = list(found)
+        positions = np.concatenate([self.positions[self.offsets[n]:self.offsets[n + 1]] for n in numbers])
+        distances = np.repeat(np.array([found[n] for n in numbers], dtype=np.int32),
+                              [self.offsets[n + 1] - self.offsets[n] for n in numbers])
+        order = np.lexsort((distances, positions))
+        positions, distances = positions[order], distances[order]
+        first = np.ones(len(positions), dtype=bool)
+        first[1:] = positions[1:] != positions[:-1]
+        return positions[first], distances[first]
+
+    def search(self, search_string):
+        '''
+        The positions of the rows whose names match every word of search_string, best match first, and their
+        distances
+        '''
+        positions = distances = None
+        for word in dict.fromkeys(words(search_string)):
+            word_positions, word_distances = self._word_matches(word)
+            if positions is None:
+                positions, distances = word_positions, word_distances
+            else:
+                positions, mine, theirs = np.intersect1d(positions, word_positions, assume_unique=True,
+                                                         return_indices=True)
+                distances = distances[mine] + word_distances[theirs]
+            if not len(positions):
+                break
+        if positions is None or not len(positions):
+            return [], []
+        order = np.lexsort((positions, distances))
+        return positions[order].tolist(), distances[order].tolist()
+
+    def register_page(self, search_string, per_page, page=1):
+        '''
+        One page of the ranked matches
+
+        :return: (total, members, page number, None, None), as the other register pages but without cursors
+        '''
+        hits, _ = self.search(search_string)
+        selected = hits[(page - 1) * per_page:page * per_page]
+        return len(hits), [(self.ids[p], self.names[p]) for p in selected], page, None, None
+
+
+FUZZY_INDEX = IndexHolder('fuzzy', FuzzyIndex.build, csv_file=conf.INDEX_CSV_FILE)
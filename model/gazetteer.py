@@ -77,12 +77,12 @@ NAME_AUTHORITIES = {
     },
     'SA': {
         'label': 'SA Dept for Transport, Energy & Infrastructure',
-        'web': 'www.sa.gov.au/landservices/namingproposals',
+        'web': 'https://www.sa.gov.au/landservices/namingproposals',
         'email':'LSGPlaceNames@sa.gov.au'
     },
     'TAS': {
         'label': 'Tasmanian Dept of Primary Industries, Parks, Water and Environment',
-        'web': 'www.placenames.tas.gov.au',
+        'web': 'https://www.placenames.tas.gov.au',
         'email':'Nomenclature.Office@dpipwe.tas.gov.au'
     },
     'VIC': {
@@ -0,0 +1,258 @@
+# -*- coding: utf-8 -*-
+'''
+A packed file of the prebuilt RDF of every item, served through a memory map
+
+tools/build_store.py renders every placename and place, in each profile and in each format of rdf_writer.MEDIATYPES
+(the VARIANTS), and writes all the documents one after another into one file, followed by an index: the IDs, sorted,
+as fixed-width byte strings, and for each ID the offset and length of each of its documents and its SUPPLY_DATE. The
+file ends with a JSON footer locating those arrays.
+
+The service opens the file named by conf.ITEM_STORE_FILE read-only with mmap, and the index arrays are NumPy views of
+the mapping, so finding a document is a binary search over the IDs and the response body is copied straight out of
+the mapping: nothing is read from the database, built with rdflib or kept in the process. The pages of the file are
+the operating system's page cache, so every process serving from the same file shares one copy of it.
+
+The store is a copy of the table as it was when it was built, so it has to be built again after a resupply. The
+footer records the data version (row count and latest SUPPLY_DATE) and conf.CONTENT_VERSION it was built at, and the
+store is not used while either differs from the current one (see record.current_version()), so after a resupply or a
+release every item is rendered from the database until the store is rebuilt. The service switches to the new file
+within ITEM_STORE_CHECK_INTERVAL seconds of it replacing the old one. Items that aren't in the store, and the other
+formats and profiles, are rendered from the database as usual.
+'''
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from datetime import datetime, timedelta
+
+import numpy as np
+from flask import Response
+
+import conf
+from . import rdf_writer
+from .record import current_version
+
+MAGIC = b'PNITEMS1'
+
+# the collections and profiles stored, each in all the formats rdf_writer writes
+PROFILES = [
+    ('placenames', ['NCGA', 'pn']),
+    ('places', ['pn']),
+]
+MEDIATYPES = rdf_writer.MEDIATYPES
+VARIANTS = [(collection, profile, mediatype)
+            for collection, profiles in PROFILES for profile in profiles for mediatype in MEDIATYPES]
+
+_EPOCH = datetime(1970, 1, 1)
+_NO_DATE = np.iinfo(np.int64).min
+
+_store = None
+_version = None  # (inode, modification time, size) of the file _store was opened from
+_checked = 0
+_load_lock = threading.Lock()
+
+
+def version_settings(version):
+    '''
+    The footer settings recording the data version (see dataset.data_version()) a store is built at
+    '''
+    count, latest = version if version is not None else (None, None)
+    return {'data_version': [count, latest.isoformat() if latest is not None else None],
+            'content_version': conf.CONTENT_VERSION}
+
+
+def _microseconds(value):
+    return _NO_DATE if value is None else (value - _EPOCH) // timedelta(microseconds=1)
+
+
+class Packed(object):
+    """
+    One document of the store
+    """
+
+    def __init__(self, body, mediatype, modified):
+        self.body = body  # a memoryview of the mapped file
+        self.mediatype = mediatype
+        self.modified = modified
+
+    def response(self):
+        # WSGI servers take bytes, so the document is copied once, straight from the mapping
+        return Response(bytes(self.body), mimetype=self.mediatype)
+
+
+class ItemStore(object):
+    """
+    A store file opened with mmap
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.map[-len(MAGIC):] != MAGIC:
+            raise ValueError('{} is not an item store'.format(path))
+        footer_end = len(self.map) - len(MAGIC) - 8
+        footer_length, = struct.unpack('<Q', self.map[footer_end:footer_end + 8])
+        footer = json.loads(self.map[footer_end - footer_length:footer_end].decode('utf-8'))
+
+        self.settings = footer['settings']
+        self.version = (self.settings.get('data_version'), self.settings.get('content_version'))
+        self.variants = {tuple(variant): number for number, variant in enumerate(footer['variants'])}
+        count = footer['count']
+
+        def section(name, dtype):
+            offset, length = footer['sections'][name]
+            return np.frombuffer(self.map, dtype=dtype, count=length, offset=offset)
+
+        self.ids = section('ids', 'S{}'.format(footer['id_width']))
+        self.offsets = section('offsets', '<u8').reshape(count, len(self.variants))
+        self.lengths = section('lengths', '<u4').reshape(count, len(self.variants))
+        self.modified = section('modified', '<i8')
+        self.view = memoryview(self.map)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def position(self, item_id):
+        '''
+        The row of item_id in the index, or None if it isn't in the store
+        '''
+        key = item_id.encode('utf-8')
+        position = int(np.searchsorted(self.ids, key))
+        if position < len(self.ids) and self.ids[position] == key:
+            return position
+        return None
+
+    def supply_date(self, position):
+        value = int(self.modified[position])
+        return None if value == _NO_DATE else _EPOCH + timedelta(microseconds=value)
+
+    def find(self, collection, item_id, profile, mediatype):
+        '''
+        The document of item_id in collection, in the given profile and mediatype, or None if it isn't stored
+        '''
+        variant = self.variants.get((collection, profile, mediatype))
+        if variant is None:
+            return None
+        position = self.position(item_id)
+        if position is None:
+            return None
+        offset = int(self.offsets[position, variant])
+        body = self.view[offset:offset + int(self.lengths[position, variant])]
+        return Packed(body, mediatype, self.supply_date(position))
+
+
+def _current(store):
+    # whether store was built from the data as it is now, and renders it as this release does
+    settings = version_settings(current_version())
+    return store.version == (settings['data_version'], settings['content_version'])
+
+
+def get():
+    '''
+    The configured store, or None if there is none, it can't be opened or it is out of date. Whether the file has been
+    replaced is checked at most every ITEM_STORE_CHECK_INTERVAL seconds.
+    '''
+    global _store, _version, _checked
+    if conf.ITEM_STORE_FILE is None:
+        return None
+    if time.time() - _checked > conf.ITEM_STORE_CHECK_INTERVAL:
+        with _load_lock:
+            if time.time() - _checked > conf.ITEM_STORE_CHECK_INTERVAL:
+                try:
+                    stat = os.stat(conf.ITEM_STORE_FILE)
+                    version = (stat.st_ino, stat.st_mtime, stat.st_size)
+                    if version != _version:
+                        # the old mapping is closed once nothing refers to it any more
+                        _store, _version = ItemStore(conf.ITEM_STORE_FILE), version
+                except (OSError, ValueError) as e:
+                    print(e)
+                    _store, _version = None, None
+                _checked = time.time()
+    store = _store
+    return store if store is not None and _current(store) else None
+
+
+def find(collection, item_id, profile, mediatype):
+    '''
+    The stored document for a request, see ItemStore.find(), or None
+    '''
+    store = get()
+    return store.find(collection, item_id, profile, mediatype) if store is not None else None
+
+
+def supply_date(item_id):
+    '''
+    (whether item_id is in the store, its SUPPLY_DATE)
+    '''
+    store = get()
+    position = store.position(item_id) if store is not None else None
+    if position is None:
+        return False, None
+    return True, store.supply_date(position)
+
+
+class StoreWriter(object):
+    """
+    Writes a store file: add() each item's documents in any order, then close()
+    """
+
+    def __init__(self, path):
+        self.path = path
+        # written next to the file and renamed over it when complete, so a service using the old file isn't disturbed
+        self.partial = path + '.partial'
+        self.file = open(self.partial, 'wb')
+        self.file.write(MAGIC)
+        self.ids = []
+        self.offsets = array('Q')
+        self.lengths = array('I')
+        self.modified = array('q')
+
+    def add(self, item_id, modified, documents):
+        '''
+        :param documents: the bytes of the item's document for each of VARIANTS, in order
+        '''
+        self.ids.append(item_id.encode('utf-8'))
+        self.modified.append(_microseconds(modified))
+        for document in documents:
+            self.offsets.append(self.file.tell())
+            self.lengths.append(len(document))
+            self.file.write(document)
+
+    def _section(self, values):
+        # writes an array 8-byte aligned and returns its [offset, number of values]
+        self.file.write(b'\0' * (-self.file.tell() % 8))
+        offset = self.file.tell()
+        self.file.write(values.tobytes())
+        return [offset, len(values)]
+
+    def close(self, settings=None):
+        '''
+        Writes the index and footer and puts the file in place. Returns the number of items.
+        '''
+        ids = np.array(self.ids, dtype=bytes)
+        if len(ids) and b'\0' in b''.join(self.ids):
+            raise ValueError('IDs must not contain NUL characters')
+        order = np.argsort(ids, kind='stable')
+        if len(ids) > 1 and (ids[order][1:] == ids[order][:-1]).any():
+            raise ValueError('duplicate IDs')
+        width = len(VARIANTS)
+        footer = {
+            'settings': settings or {},
+            'variants': VARIANTS,
+            'count': len(ids),
+            'id_width': max(ids.itemsize, 1),
+            'sections': {
+                'ids': self._section(ids[order]),
+                'offsets': self._section(np.frombuffer(self.offsets, dtype='<u8').reshape(-1, width)[order].ravel()),
+                'lengths': self._section(np.frombuffer(self.lengths, dtype='<u4').reshape(-1, width)[order].ravel()),
+                'modified': self._section(np.frombuffer(self.modified, dtype='<i8')[order]),
+            }
+        }
+        footer = json.dumps(footer).encode('utf-8')
+        self.file.write(footer + struct.pack('<Q', len(footer)) + MAGIC)
+        self.file.close()
+        os.replace(self.partial, self.path)
+        return len(ids)
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+'''
+Request timing by stage, the Server-Timing header, and Prometheus metrics
+
+Hot paths wrap their work in stage('name') (or the @timed('name') decorator). Each stage's time is added to a
+per-stage histogram and, inside a request, to the request's own totals, which init_app() sends back in a Server-Timing
+header, e.g.
+
+    Server-Timing: db_connect;dur=0.1, db_select;dur=1.9, item_load;dur=2.3, export_html;dur=4.2, total;dur=6.8
+
+Stages nest (item_load includes the db_* stages of its query), so the durations are not meant to add up to total.
+
+expose() writes every metric in the Prometheus text format for the /metrics route: request latency histograms per
+route and response mediatype, the stage histograms, database query counts and the hit and miss counts and hit ratio
+of each cache. The numbers are per process, so with several worker processes each one is scraped separately (or the
+scraper sums what it finds on successive scrapes). A streamed response is timed up to the point its body starts.
+'''
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, has_request_context, request
+
+from .cache import CACHES
+
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+_metrics = []
+_caches = OrderedDict()  # name -> function returning (hits, misses), for caches other than those in model/cache.py
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join('{}="{}"'.format(name, _escape(value)) for name, value in pairs) + '}'
+
+
+def _number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return str(value) if isinstance(value, int) else repr(float(value))
+
+
+class Counter(object):
+    """
+    A count per combination of label values
+    """
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def inc(self, *label_values, amount=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+        for label_values, value in values:
+            yield self.name + _labels(self.labels, label_values), value
+
+
+class Histogram(object):
+    """
+    Counts of observed values (durations in seconds) at or below each of the buckets, per combination of label values
+    """
+    type = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=BUCKETS):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(buckets) + (float('inf'),)
+        self._values = {}  # label values -> [count per bucket (not cumulative)..., sum]
+        self._lock = threading.Lock()
+        _metrics.append(self)
+
+    def observe(self, value, *label_values):
+        with self._lock:
+            counts = self._values.get(label_values)
+            if counts is None:
+                counts = self._values[label_values] = [0] * len(self.buckets) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            counts[-1] += value
+
+    def samples(self):
+        with self._lock:
+            values = sorted((label_values, list(counts)) for label_values, counts in self._values.items())
+        for label_values, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                yield self.name + '_bucket' + _labels(self.labels, label_values, [('le', _number(bound))]), cumulative
+            yield self.name + '_sum' + _labels(self.labels, label_values), counts[-1]
+            yield self.name + '_count' + _labels(self.labels, label_values), cumulative
+
+
+REQUEST_SECONDS = Histogram('placenames_request_duration_seconds', 'Time taken to answer requests',
+                            ['route', 'mediatype'])
+STAGE_SECONDS = Histogram('placenames_stage_duration_seconds', 'Time spent in each stage of answering requests',
+                          ['stage'])
+DB_QUERIES = Counter('placenames_db_queries_total', 'Database queries run', ['statement'])
+
+
+def record_stage(name, seconds):
+    STAGE_SECONDS.observe(seconds, name)
+    if has_request_context():
+        stages = g.setdefault('stages', OrderedDict())
+        stages[name] = stages.get(name, 0.0) + seconds
+
+
+@contextmanager
+def stage(name):
+    '''
+    Times the enclosed block as the stage name
+    '''
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+def timed(name):
+    '''
+    Decorator timing each call of a function as the stage name
+    '''
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            with stage(name):
+                return f(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def add_cache(name, stats):
+    '''
+    Reports the hits and misses of a cache that is not a QueryCache, e.g. an lru_cache. stats() returns (hits, misses).
+    '''
+    _caches[name] = stats
+
+
+def server_timing(stages, total):
+    '''
+    The Server-Timing header value for stage durations in seconds and the total request time
+    '''
+    return ', '.join('{};dur={:.2f}'.format(name, seconds * 1000) for name, seconds in
+                     list(stages.items()) + [('total', total)])
+
+
+def init_app(app):
+    '''
+    Times every request of app, by endpoint and response mediatype, and adds its Server-Timing header
+    '''
+    @app.before_request
+    def start_timer():
+        g.request_started = time.perf_counter()
+
+    @app.after_request
+    def add_server_timing(response):
+        started = g.pop('request_started', None)
+        if started is not None:
+            total = time.perf_counter() - started
+            REQUEST_SECONDS.observe(total, request.endpoint or 'none', response.mimetype or 'none')
+            response.headers['Server-Timing'] = server_timing(g.get('stages', {}), total)
+        return response
+
+
+def _cache_stats():
+    stats = OrderedDict((name, (cache.hits, cache.misses)) for name, cache in sorted(CACHES.items()))
+    for name, cache_stats in _caches.items():
+        stats[name] = cache_stats()
+    return stats
+
+
+def expose(extra=None):
+    '''
+    All metrics in the Prometheus text exposition format. extra is a list of (name, type, help, [(labels, value)])
+    for gauges computed by the caller, e.g. from the database connection pool.
+    '''
+    lines = []
+
+    def family(name, type, help, samples):
+        lines.append('# HELP {} {}'.format(name, help))
+        lines.append('# TYPE {} {}'.format(name, type))
+        for sample, value in samples:
+            lines.append('{} {}'.format(sample, _number(value)))
+
+    for metric in _metrics:
+        family(metric.name, metric.type, metric.help, metric.samples())
+
+    caches = _cache_stats()
+    family('placenames_cache_hits_total', 'counter', 'Cache lookups answered from the cache',
+           [('placenames_cache_hits_total' + _labels(['cache'], [name]), hits)
+            for name, (hits, misses) in caches.items()])
+    family('placenames_cache_misses_total', 'counter', 'Cache lookups that had to be computed',
+           [('placenames_cache_misses_total' + _labels(['cache'], [name]), misses)
+            for name, (hits, misses) in caches.items()])
+    family('placenames_cache_hit_ratio', 'gauge', 'Share of cache lookups answered from the cache',
+           [('placenames_cache_hit_ratio' + _labels(['cache'], [name]), float(hits) / (hits + misses))
+            for name, (hits, misses) in caches.items() if hits + misses])
+
+    for name, type, help, samples in extra or []:
+        family(name, type, help, [(name + _labels([k for k, v in labels], [v for k, v in labels]), value)
+                                  for labels, value in samples])
+    return '\n'.join(lines) + '\n'
@@ -0,0 +1,152 @@
+# -*- coding: utf-8 -*-
+'''
+Clustered placenames for maps, and the map page they are drawn on
+
+clusters() groups the placenames inside a bounding box on a regular longitude/latitude grid in the database and
+returns one GeoJSON point per occupied grid cell, at the mean position of its placenames. The grid cell size follows
+the zoom level (about MAP_GRID_CELLS_PER_TILE cells across a 256 pixel map tile) and is a power-of-two fraction of 360
+degrees, so the cells, and the cache keys made from them, stay the same while a map is panned. The cells are widened
+as needed so that no response holds more than MAP_MAX_FEATURES points.
+
+The map page itself is data-free: a folium map whose script reads the marker from its own query string and fetches the
+clusters for whatever is in view, so it is rendered once per process and served from memory. folium is only imported
+when the page is first rendered, as importing it takes about half a second.
+'''
+import math
+
+import conf
+
+MAX_ZOOM = 20
+
+
+def parse_bbox(value):
+    '''
+    min longitude, min latitude, max longitude, max latitude from 'minx,miny,maxx,maxy'. Raises ValueError.
+    '''
+    try:
+        min_x, min_y, max_x, max_y = [float(v) for v in value.split(',')]
+    except (AttributeError, ValueError):
+        raise ValueError('bbox must be min longitude,min latitude,max longitude,max latitude')
+    if not all(map(math.isfinite, (min_x, min_y, max_x, max_y))) or min_x >= max_x or min_y >= max_y:
+        raise ValueError('bbox must be min longitude,min latitude,max longitude,max latitude')
+    return max(min_x, -180.0), max(min_y, -90.0), min(max_x, 180.0), min(max_y, 90.0)
+
+
+def _snap(bbox, size):
+    # the grid is anchored at -180, -90
+    return (math.floor((bbox[0] + 180) / size) * size - 180, math.floor((bbox[1] + 90) / size) * size - 90,
+            math.ceil((bbox[2] + 180) / size) * size - 180, math.ceil((bbox[3] + 90) / size) * size - 90)
+
+
+def grid(bbox, zoom, max_features=None):
+    '''
+    The grid cell size, in degrees, for a map at zoom showing bbox, and bbox widened to whole cells
+    '''
+    max_features = max_features or conf.MAP_MAX_FEATURES
+    size = 360.0 / 2 ** min(max(zoom, 0), MAX_ZOOM) / conf.MAP_GRID_CELLS_PER_TILE
+    size = max(size, math.sqrt((bbox[2] - bbox[0]) * (bbox[3] - bbox[1]) / max_features))
+    size = 360.0 / 2 ** math.floor(math.log2(360.0 / size))
+    snapped = _snap(bbox, size)
+    while round((snapped[2] - snapped[0]) / size) * round((snapped[3] - snapped[1]) / size) > max_features:
+        size *= 2
+        snapped = _snap(bbox, size)
+    return size, snapped
+
+
+def clusters(size, bbox):
+    '''
+    GeoJSON FeatureCollection of the placenames in bbox (already snapped to the grid) grouped into grid cells of size
+    degrees. A cell holding one placename gives its id and name, otherwise only the count.
+    '''
+    rows = conf.db_select('''
+        SELECT COUNT(*), AVG("LONGITUDE"), AVG("LATITUDE"), MIN("ID"), MIN("NAME")
+        FROM "PLACENAMES"
+        WHERE "LONGITUDE" >= %s AND "LONGITUDE" < %s AND "LATITUDE" >= %s AND "LATITUDE" < %s
+        GROUP BY floor(("LONGITUDE" + 180) / %s), floor(("LATITUDE" + 90) / %s)
+    ''', (bbox[0], bbox[2], bbox[1], bbox[3], size, size))
+    if rows is None:
+        raise IOError('The Place Names database is offline')
+
+    features = []
+    for count, lon, lat, placename_id, name in rows:
+        properties = {'count': count}
+        if count == 1:
+            properties.update({'id': placename_id, 'name': name})
+        features.append({
+            'type': 'Feature',
+            'geometry': {'type': 'Point', 'coordinates': [float(lon), float(lat)]},
+            'properties': properties
+        })
+    return {
+        'type': 'FeatureCollection',
+        'bbox': list(bbox),
+        'cell_size': size,
+        'features': features
+    }
+
+
+# script drawing the ?name=&x=&y= marker, if given, and the clusters from data_url for the area in view
+_CLUSTER_LAYER = u"""
+    {% macro script(this, kwargs) %}
+    (function() {
+        var map = {{ this._parent.get_name() }};
+        var params = new URLSearchParams(window.location.search);
+        var x = parseFloat(params.get('x')), y = parseFloat(params.get('y'));
+        var layer = L.layerGroup().addTo(map);
+
+        function label(text, href) {
+            var el = document.createElement(href ? 'a' : 'span');
+            el.textContent = text;
+            if (href) { el.href = href; el.target = '_top'; }
+            return el;
+        }
+
+        if (isFinite(x) && isFinite(y)) {
+            map.setView([y, x], 10);
+            L.marker([y, x]).bindTooltip('Click for more information')
+                .bindPopup(label(params.get('name') || '')).addTo(map);
+        }
+
+        function load() {
+            var b = map.getBounds();
+            var bbox = [Math.max(b.getWest(), -180), Math.max(b.getSouth(), -90),
+                        Math.min(b.getEast(), 180), Math.min(b.getNorth(), 90)].join(',');
+            fetch({{ this.data_url|tojson }} + '?bbox=' + bbox + '&zoom=' + map.getZoom())
+                .then(function(response) { return response.json(); })
+                .then(function(data) {
+                    layer.clearLayers();
+                    data.features.forEach(function(f) {
+                        var latlng = [f.geometry.coordinates[1], f.geometry.coordinates[0]];
+                        if (f.properties.count > 1) {
+                            L.circleMarker(latlng, {radius: 8 + 3 * Math.log(f.properties.count), weight: 1})
+                                .bindTooltip(f.properties.count + ' places').addTo(layer);
+                        } else {
+                            L.circleMarker(latlng, {radius: 5, weight: 1})
+                                .bindPopup(label(f.properties.name, {{ this.items_url|tojson }} + f.properties.id))
+                                .addTo(layer);
+                        }
+                    });
+                });
+        }
+        map.on('moveend', load);
+        load();
+    })();
+    {% endmacro %}
+"""
+
+
+def shell(data_url, items_url):
+    '''
+    The HTML of the map page, centred on Australia until the script moves it to the ?x=&y= marker
+    '''
+    import folium
+    from branca.element import MacroElement, Template
+
+    folium_map = folium.Map(location=[-27, 134], zoom_start=4)
+    layer = MacroElement()
+    layer._name = 'ClusterLayer'
+    layer._template = Template(_CLUSTER_LAYER)
+    layer.data_url = data_url
+    layer.items_url = items_url
+    layer.add_to(folium_map)
+    return folium_map.get_root().render()
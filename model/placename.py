@@ -1,25 +1,29 @@
 # -*- coding: utf-8 -*-
 
 from flask import render_template, Response
-import conf
 from pyldapi import Renderer, Profile
 from rdflib import Graph, URIRef, RDF, Namespace, Literal, BNode
 from rdflib.namespace import XSD   #imported for 'export_rdf' function
 
-from .gazetteer import GAZETTEERS, NAME_AUTHORITIES
+from .record import CompactRecord, PlacenameFields, cached_record
+from . import backend, rdf_writer, item_store, shared_cache
+from . import metrics
 
-# for DGGSC:C zone attribution
-from rhealpixdggs import dggs
-rdggs = dggs.RHEALPixDGGS()
 
-class Placename(Renderer):
+class Placename(PlacenameFields, Renderer):
     """
     This class represents a placename and methods in this class allow a placename to be loaded from the GA placenames
     database and to be exported in a number of formats including RDF, according to the 'PlaceNames Ontology'
     """
 
-    def __init__(self, request, uri):
-        format_list = ['text/html', 'text/turtle', 'application/ld+json', 'application/rdf+xml']
+    @metrics.timed('item_load')
+    def __init__(self, request, uri, row=None):
+        '''
+        :param row: the item query's columns for this item (see conf.PLACENAME_ITEM_QUERY) if they have already
+        been fetched, otherwise they are read from the shared record cache
+        '''
+        format_list = ['text/html', 'text/turtle', 'application/ld+json', 'application/rdf+xml',
+                       'application/n-triples']
         views = {
             'NCGA': Profile(
                 'http://linked.data.gov.au/def/placenames/',
@@ -41,127 +45,48 @@ class Placename(Renderer):
 
         super(Placename, self).__init__(request, uri, views, 'NCGA')
 
-        # DGGS_uri = 'https://fsdf.org.au/dataset/auspix/collections/auspix/items/'
-        DGGS_uri = 'https://linked.data.gov.au/dataset/auspix/'
-        resolution = 9
+        self.init_fields(uri.split('/')[-1])
 
-        self.id = uri.split('/')[-1]
-        self.auth_id = self.id.split('_')[-1]
+        # the prebuilt document, if this item is in the item store in the requested profile and format
+        self.packed = item_store.find('placenames', self.id, self.profile, self.mediatype) if row is None else None
+        # or else the response rendered earlier by any worker process, see model/shared_cache.py
+        self.shared = row is None
+        self.cached = shared_cache.find_item('placenames', self.id, self.profile, self.mediatype) \
+            if self.shared and self.packed is None else None
+        for stored in (self.packed, self.cached):
+            if stored is not None:
+                self.supplyDate = stored.modified
+                return
 
-        self.hasName = {
-            'uri': 'http://linked.data.gov.au/def/placenames/',
-            'label': 'from National Composite Gazetteer of Australia (beta version 0.5):',
-            'comment': 'The Entity has a name (label) which is a text sting.',
-            'value': None
-        }
-
-        self.thisCell = {
-            'label': None,
-            'uri': None
-        }
-
-        self.register = {
-            'label': None,
-            'uri': None
-        }
-
-        self.featureType = {
-            'label': None,
-            'uri': None
-        }
-
-        self.hasCategory = {
-            'label': None,
-            'uri': None
-        }
-
-        self.hasGroup = {
-            'label': None,
-            'uri': None
-        }
-
-        self.wasNamedBy = {
-            'label': None,
-            'uri': None
-        }
-
-        self.hasNameFormality = {
-            'label': 'Official',
-            'uri': 'http://linked.data.gov.au/def/placenames/nameFormality/Official'
-        }
-
-        self.authority = {
-            'label': None,
-            'web': None
-        }
-        self.email = None
-
-        self.modifiedDate = None
-
-        self.hasPronunciation = None   # None == don't display
-        # pronunciation will only be displyed on webpage if it exists
-
-        q = '''
-            SELECT 
-              	"NAME",
-                "AUTHORITY",
-                "SUPPLY_DATE", 
-                "FEATURE",
-                "CATEGORY",
-                "GROUP",
-                "LATITUDE",
-                "LONGITUDE"
-            FROM "PLACENAMES"
-            WHERE "ID" = '{}'
-        '''.format(self.id)
-
-        for placename in conf.db_select(q):
-            # set up x y location from database
-            self.y = placename[6]
-            self.x = placename[7]
-
-            self.hasName['value'] = str(placename[0])
-
-            self.featureType['label'] = '_'.join(str(placename[3]).split())
-            self.featureType['uri'] = 'http://vocabs.ands.org.au/repository/api/lda/ga/place-type/v1-0/resource?' \
-                                      'uri=http://pid.geoscience.gov.au/def/voc/ga/PlaceType/' + str(placename[3])\
-                                      .replace(' ','_')
-
-            self.hasCategory['label'] = '_'.join(str(placename[4]).split())
-            self.hasCategory['uri'] = 'http://vocabs.ands.org.au/repository/api/lda/ga/place-type/v1-0/resource?' \
-                                      'uri=http://pid.geoscience.gov.au/def/voc/ga/PlaceType/' + str(placename[4])\
-                                      .replace(' ','_')
-
-            self.hasGroup['label'] = '_'.join(str(placename[5]).split())
-            self.hasGroup['uri'] = 'http://vocabs.ands.org.au/repository/api/lda/ga/place-type/v1-0/resource?' \
-                                   'uri=http://pid.geoscience.gov.au/def/voc/ga/PlaceType/' + str(placename[5])\
-                                   .replace(' ','_')
-
-            self.authority['label'] = (NAME_AUTHORITIES[str(placename[1])]['label'])
-            self.authority['web'] = (NAME_AUTHORITIES[str(placename[1])]['web'])
-            self.email = (NAME_AUTHORITIES[str(placename[1])]['email'])
-
-            self.register['uri'] = (GAZETTEERS[str(placename[1])]['uri_id'])
-            self.register['label'] = (GAZETTEERS[str(placename[1])]['label'])
-
-            self.supplyDate = placename[2]
-            #DGGS function
-
-            coords = (self.x, self.y)
-            self.thisDGGSCell = rdggs.cell_from_point(resolution, coords, plane=False)  # false = on the elipsoidal curve
-            self.thisCell['label'] = str(self.thisDGGSCell)
-            self.thisCell['uri'] = '{}{}'.format(DGGS_uri, str(self.thisDGGSCell))
+        # the record is shared with the other item view, see record.cached_record()
+        record = CompactRecord(self.id, row) if row is not None else cached_record(self.id)
+        if record is not None:
+            self.load_record(record)
 
 
     def render(self):
+        if self.packed is not None:
+            return self.packed.response()
+        elif self.cached is not None:
+            return self.cached.response()
+        response = self._render()
+        if self.shared:
+            shared_cache.store_item('placenames', self.id, self.profile, self.mediatype, response,
+                                      getattr(self, 'supplyDate', None))
+        return response
+
+    def _render(self):
         if self.profile == 'alt':
-            return self._render_alt_profile()  # this function is in Renderer
-        elif self.mediatype in ['text/turtle', 'application/ld+json', 'application/rdf+xml']:
+            with metrics.stage('export_alt'):
+                return self._render_alt_profile()  # this function is in Renderer
+        elif self.mediatype in ['text/turtle', 'application/ld+json', 'application/rdf+xml',
+                                'application/n-triples']:
             return self.export_rdf(self.profile)
         else:  # default is HTML response: self.format == 'text/html':
             return self.export_html(self.profile)
 
 
+    @metrics.timed('export_html')
     def export_html(self, model_view='NCGA'):
         if model_view == 'NCGA':
             html_page = 'placename_ncga.html'
@@ -185,26 +110,31 @@ class Placename(Renderer):
                 supplyDate=self.supplyDate,
                 longitude = self.x,
                 latitude = self.y,
-                ausPIX_DGGS = self.thisCell
+                ausPIX_DGGS = self.thisCell,
+                has_dggs_cells=backend.get().has_dggs_cells()
             ),
             status=200,
             mimetype='text/html'
         )
 
-    def _generate_wkt(self):
-        if self.id is not None and self.x is not None and self.y is not None:
-            return 'POINT({} {})'.format(self.y, self.x)
-        else:
-            return ''
-
-    def _generate_dggs(self):
-        if self.id is not None and self.thisCell is not None:
-            return '{}'.format(self.thisCell)
-        else:
-            return ''
-
 
+    @metrics.timed('export_rdf')
     def export_rdf(self, model_view='NCGA'):
+        if self.mediatype in rdf_writer.MEDIATYPES:
+            triples = rdf_writer.item_triples(self, official_placename=True, place=(model_view == 'NCGA'))
+            return Response(
+                rdf_writer.serialize(triples, self.mediatype),
+                mimetype=self.mediatype
+            )
+        else:  # RDF/XML
+            return Response(
+                self._graph(model_view).serialize(format='application/rdf+xml'),
+                mimetype = 'application/rdf+xml'
+            )
+
+    @metrics.timed('rdf_graph')
+    def _graph(self, model_view='NCGA'):
+        # the rdflib equivalent of rdf_writer.item_triples(), used for RDF/XML
         g = Graph()  # make instance of a RDF graph
 
         # namespace declarations
@@ -269,21 +199,7 @@ class Placename(Renderer):
             g.add((this_place, pn.hasPlaceClassification, URIRef(ptype + self.hasGroup['label'])))
             g.add((this_place, pn.hasPlaceName, official_placename))
 
-        if self.mediatype == 'text/turtle':
-            return Response(
-                g.serialize(format='turtle'),
-                mimetype = 'text/turtle'
-            )
-        elif self.mediatype == 'application/rdf+xml':
-            return Response(
-                g.serialize(format='application/rdf+xml'),
-                mimetype = 'application/rdf+xml'
-            )
-        else: # JSON-LD
-            return Response(
-                g.serialize(format='json-ld'),
-                mimetype = 'application/ld+json'
-            )
+        return g
 
 
 if __name__ == '__main__':
@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+'''
+Direct RDF serialisation of the fixed-shape Place and Placename item graphs
+
+export_rdf() used to build an rdflib Graph of 10-20 triples per request and run rdflib's general-purpose serialisers
+over it, which is most of the cost of an RDF item response. The graphs always have the same shape, so item_triples()
+lists their triples as plain Python values and the functions below write them out as N-Triples, Turtle or JSON-LD.
+The output is the same graph (up to blank node labels) as the rdflib version kept in the models' _graph() methods,
+which is still used for RDF/XML. tools/check_rdf_writer.py checks this for every row of the sample data.
+'''
+import json
+import re
+from collections import OrderedDict, namedtuple
+
+
+class IRI(str):
+    pass
+
+
+class BNode(str):
+    pass
+
+
+Literal = namedtuple('Literal', ['value', 'datatype', 'lang'])
+
+RDF_TYPE = IRI('http://www.w3.org/1999/02/22-rdf-syntax-ns#type')
+XSD_STRING = 'http://www.w3.org/2001/XMLSchema#string'
+
+DCTERMS = 'http://purl.org/dc/terms/'
+GEO = 'http://www.opengis.net/ont/geosparql#'
+GEOX = 'http://linked.data.gov.au/def/geox#'
+PN = 'http://linked.data.gov.au/def/placenames/'
+PLACE = 'http://linked.data.gov.au/dataset/placenames/place/'
+PNAME = 'http://linked.data.gov.au/dataset/placenames/placenames/'
+PTYPE = 'http://pid.geoscience.gov.au/def/voc/ga/PlaceType/'
+RDFS = 'http://www.w3.org/2000/01/rdf-schema#'
+SF = 'http://www.opengis.net/ont/sf#'
+XSD = 'http://www.w3.org/2001/XMLSchema#'
+
+# the prefixes the rdflib version binds, used for Turtle output
+PREFIXES = OrderedDict([
+    ('dcterms', DCTERMS),
+    ('geo', GEO),
+    ('owl', 'http://www.w3.org/2002/07/owl#'),
+    ('rdfs', RDFS),
+    ('place', PLACE),
+    ('pname', PNAME),
+    ('auspix', 'http://ec2-52-63-73-113.ap-southeast-2.compute.amazonaws.com/AusPIX-DGGS-dataset/'),
+    ('pno', PN),
+    ('geox', GEOX),
+    ('xsd', XSD),
+    ('sf', SF),
+    ('ptype', PTYPE),
+    ('rdf', 'http://www.w3.org/1999/02/22-rdf-syntax-ns#'),
+])
+
+MEDIATYPES = ['text/turtle', 'application/n-triples', 'application/ld+json']
+
+
+def item_triples(item, official_placename=True, place=True, bnode_prefix='b'):
+    '''
+    The triples of a Placename ('pn' view: official_placename only, 'NCGA' view: both) or a Place (place only),
+    read from the attributes the model loaded. Blank node labels start with bnode_prefix, which must be unique within
+    a document if several items are written to it.
+    '''
+    official_placename_uri = IRI(PNAME + item.id)
+    this_place = IRI(PLACE + item.id)
+    id_gaz = Literal(item.id, PN + 'ID_GAZ', None)
+    id_auth = Literal(item.auth_id, PN + 'ID_AUTH', None)
+
+    triples = []
+    if official_placename:
+        triples.extend([
+            (official_placename_uri, RDF_TYPE, IRI(PN + 'OfficialPlaceName')),
+            (official_placename_uri, IRI(DCTERMS + 'identifier'), id_gaz),
+            (official_placename_uri, IRI(DCTERMS + 'identifier'), id_auth),
+            (official_placename_uri, IRI(DCTERMS + 'issued'), Literal(str(item.supplyDate), XSD + 'dateTime', None)),
+            (official_placename_uri, IRI(PN + 'name'), Literal(item.hasName['value'], None, 'en-AU')),
+            (official_placename_uri, IRI(PN + 'placeNameOf'), this_place),
+            (official_placename_uri, IRI(PN + 'wasNamedBy'), IRI(item.authority['web'])),
+            (official_placename_uri, IRI(RDFS + 'label'), Literal(item.hasName['value'], None, None)),
+        ])
+    if place:
+        place_point = BNode(bnode_prefix + 'point')
+        place_dggs = BNode(bnode_prefix + 'dggs')
+        triples.extend([
+            (this_place, RDF_TYPE, IRI(PN + 'Place')),
+            (this_place, IRI(DCTERMS + 'identifier'), id_gaz),
+            (this_place, IRI(DCTERMS + 'identifier'), id_auth),
+            (place_point, RDF_TYPE, IRI(SF + 'Point')),
+            (place_point, IRI(GEO + 'asWKT'), Literal(item._generate_wkt(), GEO + 'wktLiteral', None)),
+            (this_place, IRI(GEO + 'hasGeometry'), place_point),
+            (place_dggs, RDF_TYPE, IRI(GEO + 'Geometry')),
+            (place_dggs, IRI(GEOX + 'asDGGS'), Literal(item._generate_dggs(), GEOX + 'dggsLiteral', None)),
+            (this_place, IRI(GEO + 'hasGeometry'), place_dggs),
+            (this_place, IRI(PN + 'hasPlaceClassification'), IRI(PTYPE + item.featureType['label'])),
+            (this_place, IRI(PN + 'hasPlaceClassification'), IRI(PTYPE + item.hasCategory['label'])),
+            (this_place, IRI(PN + 'hasPlaceClassification'), IRI(PTYPE + item.hasGroup['label'])),
+            (this_place, IRI(PN + 'hasPlaceName'), official_placename_uri),
+        ])
+    return triples
+
+
+_STRING_ESCAPES = {'\\': '\\\\', '"': '\\"', '\n': '\\n', '\r': '\\r'}
+_STRING_SPECIALS = re.compile(r'[\\"\n\r]')
+# characters not allowed unescaped in an N-Triples / Turtle IRIREF
+_IRI_SPECIALS = re.compile(r'[\x00-\x20<>"{}|^`\\]')
+# prefixed names are only used where the local part is unambiguous in Turtle
+_LOCAL_NAME = re.compile(r'^([A-Za-z0-9_]([A-Za-z0-9_.-]*[A-Za-z0-9_-])?)?$')
+
+
+def _string(value):
+    return '"' + _STRING_SPECIALS.sub(lambda m: _STRING_ESCAPES[m.group(0)], value) + '"'
+
+
+def _iri(value):
+    return '<' + _IRI_SPECIALS.sub(lambda m: '\\u{:04X}'.format(ord(m.group(0))), value) + '>'
+
+
+def _nt_term(term):
+    if isinstance(term, Literal):
+        s = _string(term.value)
+        if term.lang:
+            return s + '@' + term.lang
+        if term.datatype and term.datatype != XSD_STRING:
+            return s + '^^' + _iri(term.datatype)
+        return s
+    if isinstance(term, BNode):
+        return '_:' + term
+    return _iri(term)
+
+
+def to_ntriples(triples):
+    return ''.join('{} {} {} .\n'.format(_nt_term(s), _nt_term(p), _nt_term(o)) for s, p, o in triples)
+
+
+class _TurtleWriter(object):
+    def __init__(self):
+        self.used_prefixes = set()
+        # longest namespace first, so e.g. pname: wins over a shorter namespace it starts with
+        self.namespaces = sorted(PREFIXES.items(), key=lambda kv: -len(kv[1]))
+
+    def iri(self, value):
+        for prefix, namespace in self.namespaces:
+            if value.startswith(namespace) and _LOCAL_NAME.match(value[len(namespace):]):
+                self.used_prefixes.add(prefix)
+                return '{}:{}'.format(prefix, value[len(namespace):])
+        return _iri(value)
+
+    def term(self, term, inline):
+        if isinstance(term, Literal):
+            s = _string(term.value)
+            if term.lang:
+                return s + '@' + term.lang
+            if term.datatype and term.datatype != XSD_STRING:
+                return s + '^^' + self.iri(term.datatype)
+            return s
+        if isinstance(term, BNode):
+            if term in inline:
+                return '[\n        {}\n    ]'.format(' ;\n        '.join(self.predicates(inline[term], inline)))
+            return '_:' + term
+        return self.iri(term)
+
+    def predicates(self, properties, inline):
+        lines = []
+        for p, objects in properties.items():
+            verb = 'a' if p == RDF_TYPE else self.iri(p)
+            lines.append('{} {}'.format(verb, ', '.join(self.term(o, inline) for o in objects)))
+        return lines
+
+
+def turtle_prefixes():
+    '''
+    The @prefix lines for every namespace in PREFIXES, for documents made of several to_turtle(..., header=False) bodies
+    '''
+    return ''.join('@prefix {}: <{}> .\n'.format(prefix, namespace) for prefix, namespace in PREFIXES.items())
+
+
+def to_turtle(triples, header=True):
+    subjects = OrderedDict()  # subject -> predicate -> objects, in the order they were added
+    references = {}
+    for s, p, o in triples:
+        subjects.setdefault(s, OrderedDict()).setdefault(p, []).append(o)
+        if isinstance(o, BNode):
+            references[o] = references.get(o, 0) + 1
+
+    # blank nodes used as the object of exactly one triple are written inline as [ ... ]
+    inline = OrderedDict((s, props) for s, props in subjects.items()
+                         if isinstance(s, BNode) and references.get(s) == 1)
+
+    writer = _TurtleWriter()
+    body = []
+    for s, properties in subjects.items():
+        if s in inline:
+            continue
+        body.append('{}\n    {} .\n'.format(
+            writer.term(s, {}), ' ;\n    '.join(writer.predicates(properties, inline))))
+
+    if not header:
+        return '\n'.join(body)
+    prefixes = ''.join('@prefix {}: <{}> .\n'.format(prefix, namespace)
+                       for prefix, namespace in PREFIXES.items() if prefix in writer.used_prefixes)
+    return prefixes + '\n' + '\n'.join(body)
+
+
+def _jsonld_term(term):
+    if isinstance(term, Literal):
+        value = OrderedDict([('@value', term.value)])
+        if term.lang:
+            value['@language'] = term.lang
+        elif term.datatype and term.datatype != XSD_STRING:
+            value['@type'] = term.datatype
+        return value
+    if isinstance(term, BNode):
+        return {'@id': '_:' + term}
+    return {'@id': term}
+
+
+def to_jsonld(triples):
+    nodes = OrderedDict()
+    for s, p, o in triples:
+        node = nodes.get(s)
+        if node is None:
+            node = nodes[s] = OrderedDict([('@id', '_:' + s if isinstance(s, BNode) else str(s))])
+        if p == RDF_TYPE and not isinstance(o, Literal):
+            node.setdefault('@type', []).append(_jsonld_term(o)['@id'])
+        else:
+            node.setdefault(str(p), []).append(_jsonld_term(o))
+    return json.dumps(list(nodes.values()), indent=2)
+
+
+def serialize(triples, mediatype):
+    '''
+    Writes triples in one of MEDIATYPES
+    '''
+    if mediatype == 'text/turtle':
+        return to_turtle(triples)
+    elif mediatype == 'application/n-triples':
+        return to_ntriples(triples)
+    elif mediatype == 'application/ld+json':
+        return to_jsonld(triples)
+    raise ValueError('Unsupported mediatype {}'.format(mediatype))
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+'''
+The fields of a placename record, loaded from a row of the item query
+
+Place, Placename and the bulk routes (e.g. the dataset dump) all show the same fields, read from the columns of
+conf.PLACENAME_ITEM_QUERY in the same way. PlacenameFields holds that mapping and PlacenameRecord is a plain record
+for routes that write many items without a Renderer per item.
+
+A row is first turned into a CompactRecord: the columns, the authority and gazetteer entries they refer to and the
+DGGS cell, in a __slots__ object of a few hundred bytes. The item views get theirs from RECORD_CACHE (see
+cached_record()), shared by Place and Placename, so viewing a placename again, or in the other view, needs neither a
+query nor a DGGS calculation. A cached record is only used while its SUPPLY_DATE is current: whenever the dataset's
+version (row count and latest SUPPLY_DATE) has changed since the record was checked, its SUPPLY_DATE is looked up again
+and the record reloaded if that has changed.
+'''
+import sys
+import threading
+import time
+
+import conf
+from . import backend
+from .cache import QueryCache
+from .gazetteer import GAZETTEERS, NAME_AUTHORITIES
+
+# for DGGS zone attribution
+from . import dggs
+
+PLACE_TYPE_URI = 'http://vocabs.ands.org.au/repository/api/lda/ga/place-type/v1-0/resource?' \
+                 'uri=http://pid.geoscience.gov.au/def/voc/ga/PlaceType/'
+
+
+def _place_type(value):
+    return {
+        'label': '_'.join(str(value).split()),
+        'uri': PLACE_TYPE_URI + str(value).replace(' ', '_')
+    }
+
+
+class CompactRecord(object):
+    """
+    The columns of an item query row, with the name authority and gazetteer entries of its AUTHORITY and its DGGS cell
+    ID resolved
+    """
+    __slots__ = ('id', 'name', 'authority', 'supply_date', 'feature', 'category', 'group', 'latitude', 'longitude',
+                 'cell', 'name_authority', 'gazetteer', 'version')
+
+    def __init__(self, placename_id, row, version=None):
+        '''
+        :param row: a row of conf.PLACENAME_ITEM_QUERY
+        :param version: the data version the record was read at, see cached_record()
+        '''
+        self.id = placename_id
+        self.name = str(row[0])
+        # the few distinct codes are shared by all records
+        self.authority = sys.intern(str(row[1]))
+        self.supply_date = row[2]
+        self.feature = sys.intern(str(row[3]))
+        self.category = sys.intern(str(row[4]))
+        self.group = sys.intern(str(row[5]))
+        self.latitude = row[6]
+        self.longitude = row[7]
+        # DGGS cell, precomputed in the database or else computed (and memoised) here
+        self.cell = dggs.cell(self.longitude, self.latitude, stored=row[8])['label']
+        self.name_authority = NAME_AUTHORITIES[self.authority]
+        self.gazetteer = GAZETTEERS[self.authority]
+        self.version = version
+
+
+RECORD_CACHE = QueryCache('record', maxsize=conf.RECORD_CACHE_SIZE, ttl=conf.RECORD_CACHE_TTL)
+
+_version_lock = threading.Lock()
+_version = {'value': None, 'checked': 0}
+
+
+def current_version():
+    '''
+    The dataset's version (row count, latest SUPPLY_DATE), looked up again at most every RECORD_CACHE_CHECK_INTERVAL
+    seconds
+    '''
+    if time.time() - _version['checked'] > conf.RECORD_CACHE_CHECK_INTERVAL:
+        with _version_lock:
+            if time.time() - _version['checked'] > conf.RECORD_CACHE_CHECK_INTERVAL:
+                try:
+                    _version['value'] = backend.get().data_version()
+                except Exception as e:
+                    print(e)
+                _version['checked'] = time.time()
+    return _version['value']
+
+
+def _load_record(placename_id, version):
+    row = backend.get().item(placename_id)
+    if row is None:
+        raise KeyError(placename_id)
+    return CompactRecord(placename_id, row, version)
+
+
+def cached_record(placename_id):
+    '''
+    The CompactRecord of placename_id, from RECORD_CACHE if it is current, or None if there is no such placename
+    '''
+    version = current_version()
+    try:
+        record = RECORD_CACHE.get_or_compute(placename_id, lambda: _load_record(placename_id, version))
+    except KeyError:
+        return None  # unknown IDs are not cached, so they are found as soon as they are added
+    if record.version != version:
+        # the dataset has changed since the record was read; keep it only if its own SUPPLY_DATE hasn't
+        if backend.get().modified(placename_id) != record.supply_date:
+            RECORD_CACHE.invalidate(placename_id)
+            return cached_record(placename_id)
+        record.version = version
+    return record
+
+
+class PlacenameFields(object):
+    """
+    Mixin setting up the fields shown for a placename, see load_fields()
+    """
+
+    def init_fields(self, placename_id):
+        self.id = placename_id
+        self.auth_id = self.id.split('_')[-1]
+
+        self.hasName = {
+            'uri': 'http://linked.data.gov.au/def/placenames/',
+            'label': 'from National Composite Gazetteer of Australia (beta version 0.5):',
+            'comment': 'The Entity has a name (label) which is a text sting.',
+            'value': None
+        }
+
+        self.thisCell = {
+            'label': None,
+            'uri': None
+        }
+
+        self.register = {
+            'label': None,
+            'uri': None
+        }
+
+        self.featureType = {
+            'label': None,
+            'uri': None
+        }
+
+        self.hasCategory = {
+            'label': None,
+            'uri': None
+        }
+
+        self.hasGroup = {
+            'label': None,
+            'uri': None
+        }
+
+        self.wasNamedBy = {
+            'label': None,
+            'uri': None
+        }
+
+        self.hasNameFormality = {
+            'label': 'Official',
+            'uri': 'http://linked.data.gov.au/def/placenames/nameFormality/Official'
+        }
+
+        self.authority = {
+            'label': None,
+            'web': None
+        }
+        self.email = None
+
+        self.modifiedDate = None
+
+        self.hasPronunciation = None   # None == don't display
+        # pronunciation will only be displayed on the webpage if it exists
+
+    def load_fields(self, placename):
+        '''
+        :param placename: a row of conf.PLACENAME_ITEM_QUERY
+        '''
+        self.load_record(CompactRecord(self.id, placename))
+
+    def load_record(self, record):
+        '''
+        :param record: a CompactRecord
+        '''
+        # set up x y location from database
+        self.y = record.latitude
+        self.x = record.longitude
+
+        self.hasName['value'] = record.name
+
+        self.featureType.update(_place_type(record.feature))
+        self.hasCategory.update(_place_type(record.category))
+        self.hasGroup.update(_place_type(record.group))
+
+        self.authority['label'] = record.name_authority['label']
+        self.authority['web'] = record.name_authority['web']
+        self.email = record.name_authority['email']
+
+        self.register['uri'] = record.gazetteer['uri_id']
+        self.register['label'] = record.gazetteer['label']
+
+        self.supplyDate = record.supply_date
+
+        self.thisCell.update({'label': record.cell, 'uri': '{}{}'.format(dggs.DGGS_URI, record.cell)})
+
+    def _generate_wkt(self):
+        if self.id is not None and self.x is not None and self.y is not None:
+            return 'POINT({} {})'.format(self.y, self.x)
+        else:
+            return ''
+
+    def _generate_dggs(self):
+        if self.id is not None and self.thisCell is not None:
+            return '{}'.format(self.thisCell)
+        else:
+            return ''
+
+
+class PlacenameRecord(PlacenameFields):
+    """
+    A placename's fields without the Renderer, for writing many items at once
+    """
+
+    def __init__(self, placename_id, row):
+        self.row = row  # the item query's columns, for formats that list them as they are
+        self.init_fields(placename_id)
+        self.load_fields(row)
@@ -0,0 +1,413 @@
+# -*- coding: utf-8 -*-
+'''
+Paging of the Place Names and Places registers
+
+Both registers list the PLACENAMES table ordered by authority, then the numeric part of AUTH_ID, then AUTH_ID (and ID
+to break ties). Paging with OFFSET makes Postgres compute that order for, and then discard, every preceding row, so
+next/prev links carry an opaque cursor instead: the sort key of the last (or first) row shown, which the next query
+seeks past using the index in sql/register_sort_index.sql. Page numbers still work; a page is read forwards from the
+start or backwards from the end, whichever is nearer, so both shallow pages and the last pages are cheap.
+'''
+import base64
+import json
+import math
+import re
+from bisect import bisect_left
+from urllib.parse import urlencode
+
+from flask_paginate import Pagination
+from pyldapi import ContainerRenderer
+from rdflib import Literal, Namespace, URIRef
+from rdflib.namespace import DCTERMS, RDF, RDFS, VOID
+
+import conf
+from .facets import FACETS
+
+# must match the index expression in sql/register_sort_index.sql
+SORT_KEY = ['"AUTHORITY"', r'''cast('0' || regexp_replace("AUTH_ID", '\D+', '') as integer)''', '"AUTH_ID"', '"ID"']
+_ROW_KEY = '({})'.format(', '.join(SORT_KEY))
+# the type of each SORT_KEY column, and whether it can be NULL (a row without AUTHORITY or AUTH_ID)
+_SORT_KEY_TYPES = [(str, True), (int, True), (str, True), (str, False)]
+
+_NON_DIGITS = re.compile(r'\D+')
+
+
+def auth_id_number(auth_id):
+    '''
+    Python equivalent of the numeric part of the register sort key,
+    cast('0' || regexp_replace("AUTH_ID", '\\D+', '') as integer)
+    '''
+    digits = _NON_DIGITS.sub('', auth_id, count=1)
+    try:
+        return int('0' + digits)
+    except ValueError:
+        return int('0' + _NON_DIGITS.sub('', digits))
+
+
+def register_key(row):
+    '''
+    The register sort key (AUTHORITY, numeric AUTH_ID, AUTH_ID, ID) of a dict row from dataset.load_rows()
+    '''
+    return row['AUTHORITY'], row['AUTH_ID_NUM'], row['AUTH_ID'], row['ID']
+
+
+def encode_cursor(page, key):
+    '''
+    Packs the number of the page a link leads to and the sort key to seek from into a URL-safe token
+    '''
+    return base64.urlsafe_b64encode(json.dumps([page] + list(key)).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    '''
+    The reverse of encode_cursor(). Raises ValueError for tokens not made by it.
+    '''
+    try:
+        value = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)).decode('utf-8'))
+    except Exception:
+        raise ValueError('Invalid page cursor')
+    if not isinstance(value, list) or len(value) != len(SORT_KEY) + 1 or not _is(value[0], int):
+        raise ValueError('Invalid page cursor')
+    for element, (kind, nullable) in zip(value[1:], _SORT_KEY_TYPES):
+        if not (_is(element, kind) or nullable and element is None):
+            raise ValueError('Invalid page cursor')
+    return value[0], value[1:]
+
+
+def _is(value, kind):
+    # isinstance, but JSON true and false aren't integers
+    return isinstance(value, kind) and not isinstance(value, bool)
+
+
+def _search_clause(search):
+    if search:
+        pattern = '%{}%'.format(search.strip().upper())
+        return 'UPPER("ID") LIKE %s OR UPPER("NAME") LIKE %s', [pattern, pattern]
+    return None, []
+
+
+def search_matches(search_string, candidates, id_texts, name_texts):
+    '''
+    The in-memory equivalent of _search_clause(): those of the candidate positions whose upper-cased ID or NAME (in
+    id_texts and name_texts) matches search_string, with the same semantics including the % and _ wildcards
+    '''
+    query = search_string.strip().upper()
+    fragments = [f for f in re.split(r'[%_]', query) if f]
+    if fragments == [query]:
+        return [p for p in candidates if query in id_texts[p] or query in name_texts[p]]
+
+    # the search string has LIKE wildcards in it: check the longest literal part first as that is cheap
+    pattern = re.compile('.*'.join(
+        '.'.join(re.escape(part) for part in segment.split('_')) for segment in query.split('%')
+    ), re.DOTALL)
+    longest = max(fragments, key=len) if fragments else ''
+    return [
+        p for p in candidates
+        if (longest in id_texts[p] and pattern.search(id_texts[p]) is not None)
+        or (longest in name_texts[p] and pattern.search(name_texts[p]) is not None)
+    ]
+
+
+def _filter_clause(search, dggs, filters=None):
+    '''
+    The WHERE condition for a search, DGGS cell and/or facet filter. dggs is a cell ID (see dggs.parse_cell()); every
+    resolution 9 cell inside it starts with it, so the stored cells are matched by prefix, which Postgres answers with a
+    range scan of the index in sql/dggs_cell_index.sql. filters maps facet columns (see facets.FACETS) to the value
+    they must have.
+    '''
+    where, params = _search_clause(search)
+    conditions = ['({})'.format(where)] if where else []
+    if dggs:
+        conditions.append('"{}" LIKE %s'.format(conf.DGGS_CELL_COLUMN))
+        params.append(dggs + '%')
+    for column, value in sorted((filters or {}).items()):
+        conditions.append('"{}" = %s'.format(column))
+        params.append(value)
+    return ' AND '.join(conditions) or None, params
+
+
+def register_count(search=None, dggs=None, filters=None):
+    where, params = _filter_clause(search, dggs, filters)
+    sql = 'SELECT COUNT(*) FROM "PLACENAMES"'
+    if where:
+        sql += ' WHERE ' + where
+    return conf.db_select(sql, params)[0][0]
+
+
+def facet_cube(search=None, dggs=None):
+    '''
+    (AUTHORITY, FEATURE, CATEGORY, GROUP, count) of each combination of those columns among the rows matching search
+    and dggs. The counts of the whole table are read from the table of sql/facet_counts.sql if there is one.
+    '''
+    where, params = _filter_clause(search, dggs)
+    if where is None and conf.db_select("SELECT to_regclass('\"PLACENAMES_FACETS\"')")[0][0] is not None:
+        rows = conf.db_select('SELECT "AUTHORITY", "FEATURE", "CATEGORY", "GROUP", "COUNT" FROM "PLACENAMES_FACETS"')
+        # the table holds NULL as ''
+        return [tuple(value if value != '' else None for value in row[:4]) + (row[4],) for row in rows]
+    sql = 'SELECT "AUTHORITY", "FEATURE", "CATEGORY", "GROUP", COUNT(*) FROM "PLACENAMES"'
+    if where:
+        sql += ' WHERE ' + where
+    return [tuple(row) for row in conf.db_select(sql + ' GROUP BY 1, 2, 3, 4', params)]
+
+
+def _select_page(search, limit, offset=0, descending=False, seek=None, dggs=None, filters=None):
+    where, params = _filter_clause(search, dggs, filters)
+    conditions = ['({})'.format(where)] if where else []
+    if seek is not None:
+        conditions.append('{} {} ({})'.format(_ROW_KEY, '<' if descending else '>', ', '.join(['%s'] * len(seek))))
+        params += list(seek)
+
+    sql = 'SELECT "ID", "NAME", {} FROM "PLACENAMES"'.format(', '.join(SORT_KEY[:3]))
+    if conditions:
+        sql += ' WHERE ' + ' AND '.join(conditions)
+    sql += ' ORDER BY ' + ', '.join('{} {}'.format(k, 'DESC' if descending else 'ASC') for k in SORT_KEY)
+    sql += ' OFFSET %s LIMIT %s'
+    rows = conf.db_select(sql, params + [offset, limit])
+    return list(reversed(rows)) if descending else rows
+
+
+def register_page(total, per_page, page=1, search=None, after=None, before=None, dggs=None, filters=None):
+    '''
+    Gets one page of (ID, NAME) register members
+
+    :param total: the number of matching items, as returned by register_count()
+    :param after: a cursor from a "next" link, or None
+    :param before: a cursor from a "prev" link, or None
+    :param dggs: only list placenames inside this DGGS cell
+    :param filters: only list placenames with these facet values, e.g. {'AUTHORITY': 'VIC'}
+    :return: (members, page number, cursor for the previous page, cursor for the next page)
+    '''
+    if after is not None:
+        page, key = decode_cursor(after)
+        rows = _select_page(search, per_page, seek=key, dggs=dggs, filters=filters)
+    elif before is not None:
+        page, key = decode_cursor(before)
+        rows = _select_page(search, per_page, descending=True, seek=key, dggs=dggs, filters=filters)
+    else:
+        offset = (page - 1) * per_page
+        limit = max(0, min(per_page, total - offset))
+        offset_from_end = total - offset - limit
+        if offset >= total:
+            rows = []  # past the end, which RegisterRenderer reports as a paging error
+        elif offset_from_end < offset:
+            rows = _select_page(search, limit, offset=offset_from_end, descending=True, dggs=dggs, filters=filters)
+        else:
+            rows = _select_page(search, per_page, offset=offset, dggs=dggs, filters=filters)
+
+    members = [(row[0], row[1]) for row in rows]
+    prev_cursor = next_cursor = None
+    if rows:
+        if page > 1:
+            prev_cursor = encode_cursor(page - 1, [rows[0][2], rows[0][3], rows[0][4], rows[0][0]])
+        if page * per_page < total:
+            next_cursor = encode_cursor(page + 1, [rows[-1][2], rows[-1][3], rows[-1][4], rows[-1][0]])
+    return members, page, prev_cursor, next_cursor
+
+
+class RegisterPositions(object):
+    """
+    Paging, with the same cursors as register_page(), over rows held in memory in register order. Subclasses have ids
+    and names lists and a key(position) method giving the register sort key of a row.
+    """
+
+    def _first_position(self, key, strictly_after):
+        # binary search over the register order for the first row whose key is > (or >=) key
+        key = tuple(key)
+        lo, hi = 0, len(self.ids)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            k = self.key(mid)
+            if k < key or (strictly_after and k == key):
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def page(self, hits, per_page, page=1, after=None, before=None):
+        '''
+        One page of the rows at the hits positions (ascending)
+
+        :return: (total, members, page number, cursor for the previous page, cursor for the next page)
+        '''
+        if after is not None:
+            page, key = decode_cursor(after)
+            start = bisect_left(hits, self._first_position(key, strictly_after=True))
+            selected = hits[start:start + per_page]
+        elif before is not None:
+            page, key = decode_cursor(before)
+            end = bisect_left(hits, self._first_position(key, strictly_after=False))
+            selected = hits[max(0, end - per_page):end]
+        else:
+            selected = hits[(page - 1) * per_page:page * per_page]
+
+        members = [(self.ids[p], self.names[p]) for p in selected]
+        prev_cursor = next_cursor = None
+        if selected:
+            if page > 1:
+                prev_cursor = encode_cursor(page - 1, self.key(selected[0]))
+            if page * per_page < len(hits):
+                next_cursor = encode_cursor(page + 1, self.key(selected[-1]))
+        return len(hits), members, page, prev_cursor, next_cursor
+
+
+class RegisterRenderer(ContainerRenderer):
+    """
+    A ContainerRenderer whose prev/next links (Link headers, HTML and the RDF mem profile) use page cursors rather
+    than page numbers, and which keeps the search query, search mode, DGGS cell and facet filters in all of its paging
+    links. Facet counts (see model/facets.py) are listed in the HTML and as VoID subsets of the register in the RDF.
+    """
+
+    def __init__(self, request, instance_uri, label, comment, parent_container_uri, parent_container_label,
+                 members, members_total_count, page=1, per_page=None, prev_cursor=None, next_cursor=None,
+                 search_query=None, dggs_cell=None, search_mode=None, filters=None, facet_counts=None, **kwargs):
+        # these are needed by _paging(), which ContainerRenderer.__init__() calls
+        self.cursor_page = page
+        self.cursor_per_page = per_page
+        self.prev_cursor = prev_cursor
+        self.next_cursor = next_cursor
+        self.search_query = search_query
+        self.dggs_cell = dggs_cell
+        self.search_mode = search_mode
+        self.filters = filters or {}
+        self.facet_counts = facet_counts
+        super(RegisterRenderer, self).__init__(
+            request,
+            instance_uri,
+            label,
+            comment,
+            parent_container_uri,
+            parent_container_label,
+            members,
+            members_total_count,
+            per_page=per_page,
+            search_query=search_query,
+            **kwargs
+        )
+
+    def _selection(self, filters):
+        # the parameters choosing which placenames are listed
+        params = []
+        if self.search_query:
+            params.append(('search', self.search_query))
+        if self.search_mode:
+            params.append(('match', self.search_mode))
+        if self.dggs_cell:
+            params.append(('dggs', self.dggs_cell))
+        params.extend((f.lower(), filters[f]) for f in FACETS if f in filters)
+        return params
+
+    def page_uri(self, filters=None, **args):
+        params = [('per_page', self.per_page)] + self._selection(self.filters if filters is None else filters)
+        if self.facet_counts is not None:
+            params.append(('facets', ','.join(self.facet_counts)))
+        params.extend(sorted(args.items()))
+        return '{}?{}'.format(self.instance_uri, urlencode(params))
+
+    def subset_uri(self, facet, value):
+        '''
+        The register of the listed placenames that have value for facet
+        '''
+        params = self._selection(dict(self.filters, **{facet: value}))
+        return '{}?{}'.format(self.instance_uri, urlencode(params))
+
+    def _paging(self):
+        self.page = self.cursor_page
+        if self.cursor_per_page is not None:
+            self.per_page = self.cursor_per_page
+        self.last_page = max(1, int(math.ceil(self.members_total_count / float(self.per_page))))
+
+        if self.page < 1 or self.page > self.last_page:
+            return 'You must enter either no value for page or an integer <= {} which is the last page number.'\
+                .format(self.last_page)
+
+        if self.per_page > self.page_size_max:
+            return 'You must choose a page size <= {}'.format(self.page_size_max)
+
+        self.first_page = 1
+        self.first_page_uri = self.page_uri()
+        self.last_page_uri = self.page_uri(page=self.last_page)
+
+        self.prev_page = self.page - 1 if self.page > 1 else None
+        self.prev_page_uri = None
+        if self.prev_page is not None:
+            if self.prev_page == 1:
+                self.prev_page_uri = self.first_page_uri
+            elif self.prev_cursor is not None:
+                self.prev_page_uri = self.page_uri(before=self.prev_cursor)
+            else:
+                self.prev_page_uri = self.page_uri(page=self.prev_page)
+
+        self.next_page = self.page + 1 if self.page < self.last_page else None
+        self.next_page_uri = None
+        if self.next_page is not None:
+            if self.next_cursor is not None:
+                self.next_page_uri = self.page_uri(after=self.next_cursor)
+            else:
+                self.next_page_uri = self.page_uri(page=self.next_page)
+
+        links = list()
+        # signalling this is an LDP Resource
+        links.append('<http://www.w3.org/ns/ldp#Resource>; rel="type"')
+        # signalling that this is, in fact, a Resource described in pages
+        links.append('<http://www.w3.org/ns/ldp#Page>; rel="type"')
+        links.append('<{}>; rel="first"'.format(self.first_page_uri))
+        if self.prev_page_uri is not None:
+            links.append('<{}>; rel="prev"'.format(self.prev_page_uri))
+        if self.next_page_uri is not None:
+            links.append('<{}>; rel="next"'.format(self.next_page_uri))
+        links.append('<{}>; rel="last"'.format(self.last_page_uri))
+
+        self.headers['Link'] += ', ' + ', '.join(links)
+
+        return None
+
+    def _render_mem_profile_html(self, template_context=None):
+        context = {
+            # numbered page links never carry a cursor, so they stay valid for any page
+            'pagination': Pagination(
+                page=self.page,
+                per_page=self.per_page,
+                total=self.members_total_count,
+                href=self.page_uri().replace('{', '{{').replace('}', '}}') + '&page={0}'
+            ),
+            'prev_page_uri': self.prev_page_uri,
+            'next_page_uri': self.next_page_uri,
+            'dggs_cell': self.dggs_cell,
+            'search_mode': self.search_mode,
+            # (value, page link without the filter) of each filter, and (value, count, page link) of each facet value
+            'filters': [(f, self.filters[f], self.page_uri(filters={k: v for k, v in self.filters.items() if k != f}))
+                        for f in FACETS if f in self.filters],
+            'facet_counts': [(f, [(value, count, self.page_uri(filters=dict(self.filters, **{f: value})))
+                                  for value, count in counts])
+                             for f, counts in (self.facet_counts or {}).items()]
+        }
+        if template_context is not None:
+            context.update(template_context)
+        return super(RegisterRenderer, self)._render_mem_profile_html(template_context=context)
+
+    def _generate_mem_profile_rdf(self):
+        g = super(RegisterRenderer, self)._generate_mem_profile_rdf()
+
+        XHV = Namespace('https://www.w3.org/1999/xhtml/vocab#')
+        for page_uri in list(g.subjects(XHV.first, None)):
+            g.remove((page_uri, XHV.prev, None))
+            g.remove((page_uri, XHV.next, None))
+            if self.prev_page_uri is not None:
+                g.add((page_uri, XHV.prev, URIRef(self.prev_page_uri)))
+            if self.next_page_uri is not None:
+                g.add((page_uri, XHV.next, URIRef(self.next_page_uri)))
+
+        # each facet value's placenames are a subset of the register
+        if self.facet_counts:
+            g.bind('void', VOID)
+            g.bind('dcterms', DCTERMS)
+            register_uri = URIRef(self.instance_uri)
+            for facet, counts in self.facet_counts.items():
+                for value, count in counts:
+                    subset = URIRef(self.subset_uri(facet, value))
+                    g.add((register_uri, VOID.subset, subset))
+                    g.add((subset, RDF.type, VOID.Dataset))
+                    g.add((subset, RDFS.label, Literal(value)))
+                    g.add((subset, DCTERMS.type, Literal(facet)))
+                    g.add((subset, VOID.entities, Literal(count)))
+        return g
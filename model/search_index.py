@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+'''
+In-memory trigram index answering the register `search` parameter
+
+The registers match a search string X with UPPER("ID") LIKE '%X%' OR UPPER("NAME") LIKE '%X%', which Postgres can only
+answer with a sequential scan. This index maps every three-character substring of the upper-cased ID and NAME to the
+(register-ordered) positions of the rows containing it. A search takes the shortest posting list of the query's
+trigrams and checks each candidate, which gives the matches already in register order, so counts and pages come
+straight out of the index. Queries with no literal part of three or more characters are checked against every row.
+'''
+import re
+from array import array
+
+import conf
+from .dataset import IndexHolder, load_rows
+from .register import RegisterPositions, register_key, search_matches
+
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex(RegisterPositions):
+    """
+    A trigram index over the ID and NAME of every PLACENAMES row
+    """
+    columns = ['ID', 'NAME']
+
+    def __init__(self, rows):
+        '''
+        :param rows: dicts with ID, NAME, AUTHORITY, AUTH_ID and AUTH_ID_NUM in register order, see dataset.load_rows()
+        '''
+        self.ids = []
+        self.names = []
+        self.authorities = []
+        self.auth_ids = []
+        self.auth_nums = array('q')
+        self.id_texts = []
+        self.name_texts = []
+        self.postings = {}
+
+        postings = {}
+        for position, row in enumerate(rows):
+            self.ids.append(row['ID'])
+            self.names.append(row['NAME'])
+            self.authorities.append(row['AUTHORITY'])
+            self.auth_ids.append(row['AUTH_ID'])
+            self.auth_nums.append(row['AUTH_ID_NUM'])
+            id_text = str(row['ID']).upper()
+            name_text = str(row['NAME']).upper()
+            self.id_texts.append(id_text)
+            self.name_texts.append(name_text)
+            for gram in _trigrams(id_text) | _trigrams(name_text):
+                posting = postings.get(gram)
+                if posting is None:
+                    posting = postings[gram] = array('i')
+                posting.append(position)
+        self.postings = postings
+
+    @classmethod
+    def build(cls, csv_file=None):
+        return cls(load_rows(cls.columns, csv_file=csv_file))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def key(self, position):
+        return (self.authorities[position], self.auth_nums[position], self.auth_ids[position], self.ids[position])
+
+    def unchanged(self, rows):
+        '''
+        Whether every one of rows (see dataset.load_rows()) is held with the same NAME at its place in the register
+        '''
+        for row in rows:
+            position = self._first_position(register_key(row), strictly_after=False)
+            if position == len(self.ids) or self.ids[position] != row['ID'] or self.names[position] != row['NAME']:
+                return False
+        return True
+
+    def search(self, search_string):
+        '''
+        Returns the positions of all rows matching search_string, with the same semantics (including the % and _
+        wildcards) as UPPER("ID") LIKE '%X%' OR UPPER("NAME") LIKE '%X%', in register order
+        '''
+        query = search_string.strip().upper()
+        fragments = [f for f in re.split(r'[%_]', query) if f]
+
+        grams = set()
+        for fragment in fragments:
+            grams |= _trigrams(fragment)
+        if grams:
+            postings = [self.postings.get(gram) for gram in grams]
+            if any(posting is None for posting in postings):
+                return []
+            candidates = min(postings, key=len)
+        else:
+            candidates = range(len(self.ids))
+
+        return search_matches(query, candidates, self.id_texts, self.name_texts)
+
+    def register_page(self, search_string, per_page, page=1, after=None, before=None):
+        '''
+        The in-memory equivalent of register_count() and register_page() in model/register.py, with the same
+        cursors
+
+        :return: (total, members, page number, cursor for the previous page, cursor for the next page)
+        '''
+        return self.page(self.search(search_string), per_page, page=page, after=after, before=before)
+
+
+SEARCH_INDEX = IndexHolder('search', TrigramIndex.build, csv_file=conf.INDEX_CSV_FILE)
@@ -0,0 +1,272 @@
+# -*- coding: utf-8 -*-
+'''
+A response cache shared by the worker processes of one host
+
+mod_wsgi runs app.wsgi in several processes, and the caches of model/cache.py are per process, so each process renders
+a popular page for itself and the hit rate falls as processes are added. This cache keeps rendered item and register
+responses in one SQLite database, the file conf.SHARED_CACHE_FILE, which every process on the host opens. The database
+is in WAL mode, so readers neither wait for the writer nor for each other, and writers take turns (waiting up to
+SHARED_CACHE_TIMEOUT seconds), so any process or thread may read and write at any time.
+
+Entries are keyed by (route, ID, profile, mediatype) and hold the response's headers and body, the SUPPLY_DATE it shows
+and the data version (row count and latest SUPPLY_DATE, see record.current_version()) it was rendered at. An entry of
+another version is not served, except an item's whose own SUPPLY_DATE hasn't changed (as in record.cached_record()).
+The bodies are kept under SHARED_CACHE_MAX_BYTES in total by evicting the entries least recently used, whose last use
+is recorded at most every SHARED_CACHE_TOUCH_INTERVAL seconds so that reading rarely writes.
+
+Errors (e.g. a full disk) are reported and treated as misses: the cache never fails a request.
+'''
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from flask import Response, request
+
+import conf
+from . import backend, metrics
+from .record import current_version
+
+_SCHEMA = [
+    '''CREATE TABLE IF NOT EXISTS responses (
+        key TEXT PRIMARY KEY,
+        version TEXT NOT NULL,
+        modified TEXT,
+        headers TEXT NOT NULL,
+        body BLOB NOT NULL,
+        size INTEGER NOT NULL,
+        used REAL NOT NULL
+    )''',
+    'CREATE INDEX IF NOT EXISTS responses_used ON responses (used)',
+    # the total size of the bodies, kept by triggers so that it needn't be summed
+    'CREATE TABLE IF NOT EXISTS total (bytes INTEGER NOT NULL)',
+    'INSERT INTO total SELECT 0 WHERE NOT EXISTS (SELECT * FROM total)',
+    '''CREATE TRIGGER IF NOT EXISTS responses_insert AFTER INSERT ON responses
+        BEGIN UPDATE total SET bytes = bytes + NEW.size; END''',
+    '''CREATE TRIGGER IF NOT EXISTS responses_update AFTER UPDATE OF size ON responses
+        BEGIN UPDATE total SET bytes = bytes - OLD.size + NEW.size; END''',
+    '''CREATE TRIGGER IF NOT EXISTS responses_delete AFTER DELETE ON responses
+        BEGIN UPDATE total SET bytes = bytes - OLD.size; END''',
+]
+
+# the entries read at a time when evicting, and the fraction of SHARED_CACHE_MAX_BYTES evicting frees the cache down
+# to, so that a full cache doesn't evict on every write
+_EVICT_BATCH = 64
+_EVICT_TO = 0.9
+
+# headers recomputed for each response
+_SKIPPED_HEADERS = {'content-length'}
+
+_cache = None
+_cache_lock = threading.Lock()
+
+
+class Entry(object):
+    """
+    One cached response
+    """
+
+    def __init__(self, headers, body, modified):
+        self.headers = headers
+        self.body = body
+        self.modified = modified
+
+    def response(self):
+        return Response(self.body, headers=self.headers)
+
+
+class SharedCache(object):
+    """
+    The cache in one SQLite file, with a connection per process and thread
+    """
+
+    def __init__(self, path, max_bytes, max_entry_bytes=None):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes or max_bytes
+        self._local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._write(lambda db: [db.execute(statement) for statement in _SCHEMA])
+
+    def _db(self):
+        # connections can't be shared by threads, nor survive a fork
+        local = self._local
+        if getattr(local, 'pid', None) != os.getpid():
+            db = sqlite3.connect(self.path, timeout=conf.SHARED_CACHE_TIMEOUT, isolation_level=None)
+            db.execute('PRAGMA journal_mode=WAL')
+            # a cache can lose its last writes in a power failure, so commits needn't wait for the disk
+            db.execute('PRAGMA synchronous=NORMAL')
+            local.db, local.pid = db, os.getpid()
+        return local.db
+
+    def _write(self, change):
+        # BEGIN IMMEDIATE takes the write lock first, so the transaction waits for other writers instead of failing
+        db = self._db()
+        db.execute('BEGIN IMMEDIATE')
+        try:
+            result = change(db)
+            db.execute('COMMIT')
+            return result
+        except BaseException:
+            db.execute('ROLLBACK')
+            raise
+
+    def get(self, key, version, current=None):
+        '''
+        The Entry for key rendered at version, or None. current(modified) tells whether an entry of another version
+        still holds, given the SUPPLY_DATE it shows.
+        '''
+        row = self._db().execute('SELECT version, modified, headers, body, used FROM responses WHERE key = ?',
+                                 (key,)).fetchone()
+        if row is not None:
+            modified = datetime.fromisoformat(row[1]) if row[1] is not None else None
+            if row[0] != version and (current is None or not current(modified)):
+                row = None
+            elif row[0] != version or time.time() - row[4] > conf.SHARED_CACHE_TOUCH_INTERVAL:
+                self._write(lambda db: db.execute('UPDATE responses SET version = ?, used = ? WHERE key = ?',
+                                                  (version, time.time(), key)))
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return Entry(json.loads(row[2]), row[3], modified)
+
+    def put(self, key, version, response, modified=None):
+        '''
+        Caches response, a 200 OK, as the Entry for key rendered at version
+        '''
+        body = response.get_data()
+        if len(body) > self.max_entry_bytes:
+            return
+        headers = json.dumps([[k, v] for k, v in response.headers.items() if k.lower() not in _SKIPPED_HEADERS])
+        row = (key, version, modified.isoformat() if modified is not None else None, headers, body, len(body),
+               time.time())
+
+        def change(db):
+            db.execute('''INSERT INTO responses (key, version, modified, headers, body, size, used)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT (key) DO UPDATE SET version = excluded.version, modified = excluded.modified,
+                    headers = excluded.headers, body = excluded.body, size = excluded.size, used = excluded.used''',
+                       row)
+            total, = db.execute('SELECT bytes FROM total').fetchone()
+            if total > self.max_bytes:
+                self._evict(db, total - int(self.max_bytes * _EVICT_TO))
+        self._write(change)
+
+    def _evict(self, db, excess):
+        # deletes the least recently used entries until at least excess bytes are freed
+        while excess > 0:
+            oldest = db.execute('SELECT key, size FROM responses ORDER BY used LIMIT ?', (_EVICT_BATCH,)).fetchall()
+            if not oldest:
+                break
+            for key, size in oldest:
+                db.execute('DELETE FROM responses WHERE key = ?', (key,))
+                self.evictions += 1
+                excess -= size
+                if excess <= 0:
+                    break
+
+    def clear(self):
+        self._write(lambda db: db.execute('DELETE FROM responses'))
+
+    def stats(self):
+        entries, = self._db().execute('SELECT COUNT(*) FROM responses').fetchone()
+        size, = self._db().execute('SELECT bytes FROM total').fetchone()
+        lookups = self.hits + self.misses
+        return {
+            'file': self.path,
+            'entries': entries,
+            'bytes': size,
+            'max_bytes': self.max_bytes,
+            # the counts below are this process's
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_ratio': float(self.hits) / lookups if lookups else None,
+            'evictions': self.evictions
+        }
+
+
+def get():
+    '''
+    The configured cache, or None if there is none or it can't be opened
+    '''
+    global _cache
+    if conf.SHARED_CACHE_FILE is None:
+        return None
+    if _cache is None:
+        with _cache_lock:
+            if _cache is None:
+                try:
+                    _cache = SharedCache(conf.SHARED_CACHE_FILE, conf.SHARED_CACHE_MAX_BYTES,
+                                         conf.SHARED_CACHE_MAX_ENTRY_BYTES)
+                except sqlite3.Error as e:
+                    print(e)
+                    return None
+    return _cache
+
+
+def key(route, resource_id, profile, mediatype):
+    # the host is part of the key as the responses hold absolute URIs
+    return json.dumps([request.host_url, route, resource_id, profile, mediatype])
+
+
+def _version(version):
+    return repr((conf.CONTENT_VERSION, version))
+
+
+def find_item(collection, item_id, profile, mediatype):
+    '''
+    The cached Entry for an item request, or None
+    '''
+    cache = get()
+    if cache is None or profile == 'alt':
+        return None
+    try:
+        return cache.get(key(collection, item_id, profile, mediatype), _version(current_version()),
+                         lambda modified: backend.get().modified(item_id) == modified)
+    except Exception as e:
+        print(e)
+        return None
+
+
+def store_item(collection, item_id, profile, mediatype, response, modified):
+    '''
+    Caches the response to an item request, if it can be
+    '''
+    cache = get()
+    if cache is None or profile == 'alt' or response.status_code != 200 or response.is_streamed:
+        return
+    try:
+        cache.put(key(collection, item_id, profile, mediatype), _version(current_version()), response, modified)
+    except Exception as e:
+        print(e)
+
+
+def cached(cache_key, version, render):
+    '''
+    The cached response for cache_key at version, or else render(), cached if it is a 200 OK
+    '''
+    cache = get()
+    if cache is None:
+        return render()
+    try:
+        entry = cache.get(cache_key, _version(version))
+    except Exception as e:
+        print(e)
+        entry = None
+    if entry is not None:
+        return entry.response()
+    response = render()
+    if response.status_code == 200 and not response.is_streamed:
+        try:
+            cache.put(cache_key, _version(version), response)
+        except Exception as e:
+            print(e)
+    return response
+
+
+metrics.add_cache('shared', lambda: (_cache.hits, _cache.misses) if _cache is not None else (0, 0))
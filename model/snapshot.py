@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+'''
+Column-oriented in-memory snapshot of the PLACENAMES table, loaded from a CSV file
+
+A CSV file in the sample-data/placename_sample.csv layout (such as a /collections/placenames/dump CSV) is held one
+column at a time, in register order: coordinates in arrays of doubles, the numeric part of AUTH_ID in an array of
+integers, and the few distinct values of AUTHORITY, FEATURE, CATEGORY, GROUP and SUPPLY_DATE interned once each and
+referred to by integer codes. That is a fraction of the memory of a row object per placename, and it answers item
+lookups, register pages, counts and searches (see backend.SnapshotBackend) without a database.
+'''
+import csv
+import os
+import sys
+import threading
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from datetime import datetime
+
+import conf
+from .facets import FACETS
+from .register import RegisterPositions, auth_id_number, register_key, search_matches
+
+# columns stored as codes into a list of their distinct values
+CATEGORIES = FACETS + ['SUPPLY_DATE']
+
+_loaded = {}  # CSV path -> ((modification time, size), SnapshotStore)
+_load_lock = threading.Lock()
+
+
+def _float(value):
+    return float(value) if value not in (None, '') else float('nan')
+
+
+def _date(value):
+    try:
+        return datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    except ValueError:
+        return datetime.fromisoformat(value)
+
+
+class SnapshotStore(RegisterPositions):
+    """
+    The PLACENAMES rows of a CSV file, stored by column
+    """
+
+    def __init__(self, rows):
+        '''
+        :param rows: dicts with the columns of the CSV layout (values as read from the file), in any order
+        '''
+        rows = list(rows)
+        for row in rows:
+            row['AUTH_ID_NUM'] = auth_id_number(row['AUTH_ID'])
+        rows.sort(key=register_key)
+
+        self.ids = []
+        self.names = []
+        self.auth_ids = []
+        self.auth_nums = array('q')
+        self.id_texts = []
+        self.name_texts = []
+        self.latitudes = array('d')
+        self.longitudes = array('d')
+        self.codes = {c: array('I') for c in CATEGORIES}
+        self.values = {c: [] for c in CATEGORIES}
+        self.cells = [] if rows and conf.DGGS_CELL_COLUMN in rows[0] else None
+        self.positions = {}
+
+        value_codes = {c: {} for c in CATEGORIES}
+        for position, row in enumerate(rows):
+            self.ids.append(row['ID'])
+            self.names.append(row['NAME'])
+            self.auth_ids.append(row['AUTH_ID'])
+            self.auth_nums.append(row['AUTH_ID_NUM'])
+            id_text = row['ID'].upper()
+            name_text = row['NAME'].upper()
+            # most IDs are upper case already, so share the string
+            self.id_texts.append(row['ID'] if id_text == row['ID'] else id_text)
+            self.name_texts.append(row['NAME'] if name_text == row['NAME'] else name_text)
+            self.latitudes.append(_float(row['LATITUDE']))
+            self.longitudes.append(_float(row['LONGITUDE']))
+            for c in CATEGORIES:
+                code = value_codes[c].get(row[c])
+                if code is None:
+                    code = value_codes[c][row[c]] = len(self.values[c])
+                    self.values[c].append(_date(row[c]) if c == 'SUPPLY_DATE' else sys.intern(row[c]))
+                self.codes[c].append(code)
+            if self.cells is not None:
+                self.cells.append(row[conf.DGGS_CELL_COLUMN] or None)
+            self.positions[row['ID']] = position
+
+        self._cell_index = None
+        self._facet_cube = None
+        self.spatial_index = None  # built by SnapshotBackend.clusters() if needed
+
+    @classmethod
+    def load(cls, csv_file):
+        '''
+        The snapshot of csv_file, read again only if the file has changed since it was last loaded
+        '''
+        path = os.path.realpath(csv_file)
+        stat = os.stat(path)
+        version = (stat.st_mtime, stat.st_size)
+        loaded = _loaded.get(path)
+        if loaded is None or loaded[0] != version:
+            with _load_lock:
+                loaded = _loaded.get(path)
+                if loaded is None or loaded[0] != version:
+                    with open(path, newline='', encoding='utf-8') as f:
+                        loaded = _loaded[path] = (version, cls(csv.DictReader(f)))
+        return loaded[1]
+
+    def __len__(self):
+        return len(self.ids)
+
+    def key(self, position):
+        return (self.value('AUTHORITY', position), self.auth_nums[position], self.auth_ids[position],
+                self.ids[position])
+
+    def value(self, column, position):
+        '''
+        The value of any column of the CSV layout (or AUTH_ID_NUM) at a position
+        '''
+        if column in self.codes:
+            return self.values[column][self.codes[column][position]]
+        if column == 'LATITUDE' or column == 'LONGITUDE':
+            value = (self.latitudes if column == 'LATITUDE' else self.longitudes)[position]
+            return None if value != value else value  # NaN means no coordinate
+        if column == conf.DGGS_CELL_COLUMN:
+            return self.cells[position] if self.cells is not None else None
+        return {'ID': self.ids, 'NAME': self.names, 'AUTH_ID': self.auth_ids, 'AUTH_ID_NUM': self.auth_nums}[column][
+            position]
+
+    def item_row(self, position):
+        '''
+        The columns of conf.PLACENAME_ITEM_QUERY for the row at position
+        '''
+        return tuple(self.value(c, position) for c in ['NAME', 'AUTHORITY', 'SUPPLY_DATE', 'FEATURE', 'CATEGORY',
+                                                       'GROUP', 'LATITUDE', 'LONGITUDE', conf.DGGS_CELL_COLUMN])
+
+    def rows(self, columns, since=None):
+        '''
+        The given columns of every row (or of those supplied after since), with ID, AUTHORITY, AUTH_ID and
+        AUTH_ID_NUM, as dicts in register order
+        '''
+        columns = list(columns)
+        for c in ('ID', 'AUTHORITY', 'AUTH_ID', 'AUTH_ID_NUM'):
+            if c not in columns:
+                columns.append(c)
+        positions = range(len(self.ids)) if since is None else self.supplied_since(since)
+        return [{c: self.value(c, p) for c in columns} for p in positions]
+
+    def supplied_since(self, since):
+        '''
+        The positions, in register order, of the rows whose SUPPLY_DATE is after since
+        '''
+        codes = {code for code, value in enumerate(self.values['SUPPLY_DATE']) if value > since}
+        supply_dates = self.codes['SUPPLY_DATE']
+        return [p for p in range(len(self.ids)) if supply_dates[p] in codes]
+
+    def search(self, search_string):
+        return search_matches(search_string, range(len(self.ids)), self.id_texts, self.name_texts)
+
+    def cell_positions(self, cell_id):
+        '''
+        The positions, in register order, of the rows whose DGGS cell lies inside cell_id, found by a range scan of
+        the sorted cell IDs
+        '''
+        if self._cell_index is None:
+            order = sorted((p for p in range(len(self.ids)) if self.cells[p]), key=lambda p: self.cells[p])
+            self._cell_index = ([self.cells[p] for p in order], array('i', order))
+        cells, positions = self._cell_index
+        # every cell inside cell_id starts with it, and sorts before cell_id followed by '9'
+        start, end = bisect_left(cells, cell_id), bisect_left(cells, cell_id + '9')
+        return sorted(positions[start:end])
+
+    def with_values(self, positions, filters):
+        '''
+        Those of positions whose columns have the values in filters, e.g. {'AUTHORITY': 'VIC'}
+        '''
+        wanted = []
+        for column, value in filters.items():
+            if value not in self.values[column]:
+                return []
+            wanted.append((self.codes[column], self.values[column].index(value)))
+        return [p for p in positions if all(codes[p] == code for codes, code in wanted)]
+
+    def facet_cube(self, positions=None):
+        '''
+        (AUTHORITY, FEATURE, CATEGORY, GROUP, count) of each combination of those columns among the rows at positions,
+        or all rows
+        '''
+        if positions is None and self._facet_cube is not None:
+            return self._facet_cube
+        columns = [self.codes[c] for c in FACETS]
+        counts = Counter(zip(*columns)) if positions is None else \
+            Counter(tuple(codes[p] for codes in columns) for p in positions)
+        cube = [tuple(self.values[c][code] for c, code in zip(FACETS, combination)) + (count,)
+                for combination, count in counts.items()]
+        if positions is None:
+            self._facet_cube = cube
+        return cube
+
+    def data_version(self):
+        return len(self.ids), max(self.values['SUPPLY_DATE']) if self.ids else None
@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+'''
+In-memory spatial index of the placenames' coordinates
+
+Points are bucketed on a fixed longitude/latitude grid of CELL_SIZE degrees and stored in NumPy arrays sorted by grid
+cell, row-major. The cells of one grid row that overlap a bounding box then hold a contiguous run of points, found with
+two binary searches, so a bounding box query reads one slice per grid row and checks only those points. Radius queries
+are a bounding box query plus a great-circle distance check, and k-nearest-neighbour queries widen a radius query until
+it holds k points. Positions are register positions (see dataset.load_rows()), so sorting them gives register order.
+
+Longitudes do not wrap around at 180 degrees, which no gazetteer feature is close to.
+
+The index also clusters placenames for /map/data (see model/placemap.py) once it is built.
+'''
+import math
+
+import numpy as np
+
+import conf
+from .dataset import IndexHolder, load_rows
+
+CELL_SIZE = 0.25
+_COLUMNS = int(360 / CELL_SIZE)
+_ROWS = int(180 / CELL_SIZE)
+
+EARTH_RADIUS_KM = 6371.0088
+FILTERS = ['FEATURE', 'CATEGORY', 'GROUP', 'AUTHORITY']
+
+
+def _column(lon):
+    return np.clip(((np.asarray(lon) + 180) / CELL_SIZE).astype(np.int64), 0, _COLUMNS - 1)
+
+
+def _row(lat):
+    return np.clip(((np.asarray(lat) + 90) / CELL_SIZE).astype(np.int64), 0, _ROWS - 1)
+
+
+def haversine_km(lon, lat, lons, lats):
+    '''
+    Great-circle distances in km from (lon, lat) to each of (lons, lats)
+    '''
+    lon, lat, lons, lats = np.radians(lon), np.radians(lat), np.radians(lons), np.radians(lats)
+    a = np.sin((lats - lat) / 2) ** 2 + np.cos(lat) * np.cos(lats) * np.sin((lons - lon) / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+def radius_bbox(lon, lat, radius_km):
+    '''
+    A bounding box holding every point within radius_km of (lon, lat)
+    '''
+    dlat = math.degrees(radius_km / EARTH_RADIUS_KM)
+    max_lat = min(abs(lat) + dlat, 90.0)
+    if max_lat >= 90.0 or math.cos(math.radians(max_lat)) * 180 <= dlat:
+        return -180.0, max(lat - dlat, -90.0), 180.0, min(lat + dlat, 90.0)
+    dlon = dlat / math.cos(math.radians(max_lat))
+    return max(lon - dlon, -180.0), max(lat - dlat, -90.0), min(lon + dlon, 180.0), min(lat + dlat, 90.0)
+
+
+class SpatialIndex(object):
+    """
+    A grid index over the LONGITUDE and LATITUDE of every PLACENAMES row that has both
+    """
+
+    def __init__(self, rows):
+        '''
+        :param rows: dicts with ID, NAME, LONGITUDE, LATITUDE and the FILTERS columns in register order, see
+        dataset.load_rows()
+        '''
+        self.ids = []
+        self.names = []
+        self.codes = {f: {} for f in FILTERS}  # column -> value -> integer code
+        positions, lons, lats = [], [], []
+        values = {f: [] for f in FILTERS}
+        for position, row in enumerate(rows):
+            self.ids.append(row['ID'])
+            self.names.append(row['NAME'])
+            for f in FILTERS:
+                # matched case-insensitively
+                values[f].append(self.codes[f].setdefault(str(row[f]).upper(), len(self.codes[f])))
+            if row['LONGITUDE'] in (None, '') or row['LATITUDE'] in (None, ''):
+                continue
+            positions.append(position)
+            lons.append(float(row['LONGITUDE']))
+            lats.append(float(row['LATITUDE']))
+
+        lons = np.array(lons, dtype=np.float64)
+        lats = np.array(lats, dtype=np.float64)
+        keys = _row(lats) * _COLUMNS + _column(lons)
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.lons = lons[order]
+        self.lats = lats[order]
+        self.positions = np.array(positions, dtype=np.int64)[order]
+        self.filters = {f: np.array(values[f], dtype=np.int32)[self.positions] for f in FILTERS}
+
+    @classmethod
+    def build(cls, csv_file=None):
+        return cls(load_rows(['ID', 'NAME', 'LONGITUDE', 'LATITUDE'] + FILTERS, csv_file=csv_file))
+
+    def __len__(self):
+        return len(self.positions)
+
+    def _mask(self, points, filters):
+        '''
+        Which of the points (indexes into the sorted arrays) have the given FILTERS column values
+        '''
+        mask = np.ones(len(points), dtype=bool)
+        for f, value in (filters or {}).items():
+            code = self.codes[f].get(value.strip().upper())
+            if code is None:
+                return np.zeros(len(points), dtype=bool)
+            mask &= self.filters[f][points] == code
+        return mask
+
+    def _bbox_points(self, bbox, filters=None):
+        min_x, min_y, max_x, max_y = bbox
+        first_column, last_column = int(_column(min_x)), int(_column(max_x))
+        slices = []
+        for grid_row in range(int(_row(min_y)), int(_row(max_y)) + 1):
+            start, stop = np.searchsorted(self.keys, [grid_row * _COLUMNS + first_column,
+                                                      grid_row * _COLUMNS + last_column + 1])
+            if stop > start:
+                slices.append(np.arange(start, stop))
+        if not slices:
+            return np.zeros(0, dtype=np.int64)
+        points = np.concatenate(slices)
+        lons, lats = self.lons[points], self.lats[points]
+        points = points[(lons >= min_x) & (lons <= max_x) & (lats >= min_y) & (lats <= max_y)]
+        return points[self._mask(points, filters)]
+
+    def _members(self, points):
+        return [(self.ids[p], self.names[p]) for p in self.positions[points]]
+
+    def within_bbox(self, bbox, filters=None, limit=None):
+        '''
+        The number of placenames in bbox (min longitude, min latitude, max longitude, max latitude) and the first
+        limit of them, in register order, as (ID, NAME) members
+        '''
+        points = self._bbox_points(bbox, filters)
+        points = points[np.argsort(self.positions[points], kind='stable')]
+        return len(points), self._members(points[:limit])
+
+    def within_radius(self, lon, lat, radius_km, filters=None, limit=None):
+        '''
+        The number of placenames within radius_km of (lon, lat) and the first limit of them, nearest first, as
+        (ID, NAME) members and their distances in km
+        '''
+        points = self._bbox_points(radius_bbox(lon, lat, radius_km), filters)
+        distances = haversine_km(lon, lat, self.lons[points], self.lats[points])
+        inside = distances <= radius_km
+        points, distances = points[inside], distances[inside]
+        order = np.lexsort((self.positions[points], distances))[:limit]
+        return len(points), self._members(points[order]), distances[order].tolist()
+
+    def nearest(self, lon, lat, k, filters=None):
+        '''
+        The k placenames nearest to (lon, lat), nearest first, as (ID, NAME) members and their distances in km
+        '''
+        radius_km = CELL_SIZE * 111.0
+        while True:
+            points = self._bbox_points(radius_bbox(lon, lat, radius_km), filters)
+            bbox_covers_world = radius_km >= math.pi * EARTH_RADIUS_KM
+            if len(points) >= k or bbox_covers_world:
+                distances = haversine_km(lon, lat, self.lons[points], self.lats[points])
+                if len(points) >= k:
+                    kth = np.partition(distances, k - 1)[k - 1]
+                    # the k nearest in the box are the k nearest overall only if none could lie outside it
+                    if kth > radius_km and not bbox_covers_world:
+                        radius_km = kth
+                        continue
+                order = np.lexsort((self.positions[points], distances))[:k]
+                return self._members(points[order]), distances[order].tolist()
+            radius_km *= 2
+
+    def clusters(self, size, bbox):
+        '''
+        The same clusters as placemap.clusters(), computed from the index
+        '''
+        points = self._bbox_points(bbox)
+        lons, lats = self.lons[points], self.lats[points]
+        # half-open cells as in the SQL version, with the points on the far edges of bbox left out
+        keep = (lons < bbox[2]) & (lats < bbox[3])
+        points, lons, lats = points[keep], lons[keep], lats[keep]
+        columns = np.floor((lons + 180) / size).astype(np.int64)
+        rows = np.floor((lats + 90) / size).astype(np.int64)
+        cells, inverse, counts = np.unique(rows * (int(round(360 / size)) + 1) + columns,
+                                           return_inverse=True, return_counts=True)
+        sum_lons = np.bincount(inverse, weights=lons)
+        sum_lats = np.bincount(inverse, weights=lats)
+        first = np.zeros(len(cells), dtype=np.int64)
+        first[inverse[::-1]] = points[::-1]  # any point of the cell; only used when it is the only one
+
+        features = []
+        for i, count in enumerate(counts.tolist()):
+            properties = {'count': count}
+            if count == 1:
+                position = self.positions[first[i]]
+                properties.update({'id': self.ids[position], 'name': self.names[position]})
+            features.append({
+                'type': 'Feature',
+                'geometry': {'type': 'Point', 'coordinates': [sum_lons[i] / count, sum_lats[i] / count]},
+                'properties': properties
+            })
+        return {
+            'type': 'FeatureCollection',
+            'bbox': list(bbox),
+            'cell_size': size,
+            'features': features
+        }
+
+
+SPATIAL_INDEX = IndexHolder('spatial', SpatialIndex.build, csv_file=conf.INDEX_CSV_FILE)
@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+'''
+Change detection between builds of artefacts made from the whole PLACENAMES table, e.g. the static site
+
+A Manifest records, for the last build, every row's ID, SUPPLY_DATE and a hash of the columns its views are made from,
+and the latest SUPPLY_DATE (the watermark). The next build then only reads the rows supplied after the watermark
+(backend.stream_changed()), and finds deleted rows and rows added with an earlier SUPPLY_DATE from a scan of the IDs.
+The views show SUPPLY_DATE, so every row a resupply touches is redone. A change that keeps SUPPLY_DATE or sets it back
+is only found by a verifying run, which reads every row and redoes those whose hash differs.
+'''
+import hashlib
+import json
+import os
+from datetime import datetime
+
+from . import backend
+
+# item query columns hashed: all but the DGGS cell, which follows from the coordinates
+HASHED_COLUMNS = 8
+
+
+def content_hash(row):
+    '''
+    A hash of an item row's columns (see conf.PLACENAME_ITEM_QUERY)
+    '''
+    return hashlib.sha1(repr(tuple(row[:HASHED_COLUMNS])).encode('utf-8')).hexdigest()[:16]
+
+
+def _date(value):
+    return value.isoformat() if value is not None else None
+
+
+class Manifest(object):
+    """
+    The rows, register pages and settings of one build, saved as JSON
+    """
+
+    def __init__(self, settings=None, items=None, pages=None):
+        self.settings = settings or {}
+        self.items = items or {}  # ID -> [SUPPLY_DATE as ISO 8601, content hash]
+        self.pages = pages or []  # hash of each register page
+
+    @classmethod
+    def load(cls, path):
+        '''
+        The manifest saved at path, or an empty one if there is none
+        '''
+        if not os.path.exists(path):
+            return cls()
+        with open(path, encoding='utf-8') as f:
+            saved = json.load(f)
+        return cls(saved['settings'], saved['items'], saved['pages'])
+
+    def save(self, path):
+        partial = path + '.partial'
+        with open(partial, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'settings': self.settings, 'watermark': _date(self.watermark()), 'items': self.items,
+                                'pages': self.pages}))
+        os.replace(partial, path)
+
+    def watermark(self):
+        '''
+        The latest SUPPLY_DATE of the build, or None for an empty manifest
+        '''
+        latest = max((supply_date for supply_date, _ in self.items.values() if supply_date), default=None)
+        return datetime.fromisoformat(latest) if latest else None
+
+    def record(self, row):
+        '''
+        Records an item row, (ID, item query columns...), as built
+        '''
+        self.items[row[0]] = [_date(row[3]), content_hash(row[1:])]
+
+    def changed(self, row):
+        entry = self.items.get(row[0])
+        return entry is None or entry[1] != content_hash(row[1:])
+
+
+def changed_rows(manifest, ids, verify=False, batch_size=None):
+    '''
+    Yields lists of the item rows, (ID, item query columns...), that are new or changed since the manifest was made
+
+    :param ids: the set of all IDs there are now
+    :param verify: hash every row rather than those supplied since the watermark
+    '''
+    data = backend.get()
+    watermark = manifest.watermark()
+    added = ids.difference(manifest.items)
+    if verify or watermark is None:
+        batches = data.stream_items(batch_size)
+    else:
+        batches = data.stream_changed(watermark, batch_size)
+    for rows in batches:
+        added.difference_update(row[0] for row in rows)
+        rows = [row for row in rows if manifest.changed(row)]
+        if rows:
+            yield rows
+
+    # rows added with an earlier SUPPLY_DATE than the watermark
+    added = sorted(added)
+    for start in range(0, len(added), 1000):
+        rows = data.items(added[start:start + 1000])
+        yield [(placename_id,) + tuple(row) for placename_id, row in rows.items()]
+
+
+def deleted_ids(manifest, ids):
+    '''
+    The IDs in the manifest that are not among ids any more
+    '''
+    return sorted(set(manifest.items).difference(ids))
@@ -0,0 +1,4 @@
+-- Index for the bounding box queries of /map/data (see model/placemap.py). Maps zoomed in on a small area only read
+-- the rows in a narrow band of longitude instead of the whole table.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "PLACENAMES_coordinates_idx"
+    ON "PLACENAMES" ("LONGITUDE", "LATITUDE");
@@ -0,0 +1,23 @@
+-- Column holding the precomputed resolution 9 AusPIX cell of each placename, filled by tools/precompute_dggs.py.
+-- The item views read it when present and compute the cell themselves when it is NULL.
+ALTER TABLE "PLACENAMES" ADD COLUMN IF NOT EXISTS "DGGS_CELL_9" text;
+
+-- A resupply that moves a placename clears its stored cells, in DGGS_CELL_9 and any DGGS_CELL_<resolution> column
+-- added for tools/precompute_dggs.py --resolutions, so that a stale cell is never served and the next run fills them.
+CREATE OR REPLACE FUNCTION placenames_clear_dggs_cell() RETURNS trigger AS $$
+BEGIN
+    IF NEW."LATITUDE" IS DISTINCT FROM OLD."LATITUDE" OR NEW."LONGITUDE" IS DISTINCT FROM OLD."LONGITUDE" THEN
+        NEW := jsonb_populate_record(NEW, (
+            SELECT jsonb_object_agg(column_name, NULL)
+            FROM information_schema.columns
+            WHERE table_schema = TG_TABLE_SCHEMA AND table_name = TG_TABLE_NAME AND column_name LIKE 'DGGS\_CELL\_%'
+        ));
+    END IF;
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS placenames_clear_dggs_cell ON "PLACENAMES";
+CREATE TRIGGER placenames_clear_dggs_cell
+    BEFORE UPDATE OF "LATITUDE", "LONGITUDE" ON "PLACENAMES"
+    FOR EACH ROW EXECUTE PROCEDURE placenames_clear_dggs_cell();
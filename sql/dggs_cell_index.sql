@@ -0,0 +1,5 @@
+-- Index for the register ?dggs=<cell> filter (see model/register.py). Cell IDs are hierarchical, so the placenames in
+-- a cell of any resolution are those whose resolution 9 cell starts with its ID: a prefix LIKE, which text_pattern_ops
+-- lets Postgres answer with a range scan of this index. Needs the column from dggs_cell_column.sql.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "PLACENAMES_dggs_cell_idx"
+    ON "PLACENAMES" ("DGGS_CELL_9" text_pattern_ops);
@@ -0,0 +1,64 @@
+-- Materialised counts of the placenames with each combination of AUTHORITY, FEATURE, CATEGORY and GROUP, which answer
+-- the register ?facets= counts (see model/facets.py) without a GROUP BY over the whole table. NULL values are stored as
+-- ''. Statement triggers keep the counts up to date: each INSERT, UPDATE or DELETE adds or takes away the counts of the
+-- rows it changed, grouped, so a resupply of many rows costs one small upsert per combination it touches.
+CREATE TABLE IF NOT EXISTS "PLACENAMES_FACETS" (
+    "AUTHORITY" text NOT NULL,
+    "FEATURE" text NOT NULL,
+    "CATEGORY" text NOT NULL,
+    "GROUP" text NOT NULL,
+    "COUNT" bigint NOT NULL,
+    PRIMARY KEY ("AUTHORITY", "FEATURE", "CATEGORY", "GROUP")
+);
+
+CREATE OR REPLACE FUNCTION placenames_facets_apply() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP IN ('UPDATE', 'DELETE') THEN
+        INSERT INTO "PLACENAMES_FACETS" AS f
+        SELECT COALESCE("AUTHORITY", ''), COALESCE("FEATURE", ''), COALESCE("CATEGORY", ''), COALESCE("GROUP", ''),
+               -COUNT(*)
+        FROM old_rows GROUP BY 1, 2, 3, 4
+        ON CONFLICT ("AUTHORITY", "FEATURE", "CATEGORY", "GROUP") DO UPDATE SET "COUNT" = f."COUNT" + EXCLUDED."COUNT";
+    END IF;
+    IF TG_OP IN ('INSERT', 'UPDATE') THEN
+        INSERT INTO "PLACENAMES_FACETS" AS f
+        SELECT COALESCE("AUTHORITY", ''), COALESCE("FEATURE", ''), COALESCE("CATEGORY", ''), COALESCE("GROUP", ''),
+               COUNT(*)
+        FROM new_rows GROUP BY 1, 2, 3, 4
+        ON CONFLICT ("AUTHORITY", "FEATURE", "CATEGORY", "GROUP") DO UPDATE SET "COUNT" = f."COUNT" + EXCLUDED."COUNT";
+    END IF;
+    DELETE FROM "PLACENAMES_FACETS" WHERE "COUNT" = 0;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION placenames_facets_truncate() RETURNS trigger AS $$
+BEGIN
+    TRUNCATE "PLACENAMES_FACETS";
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- a trigger with transition tables can only be for one event
+DROP TRIGGER IF EXISTS placenames_facets_insert ON "PLACENAMES";
+CREATE TRIGGER placenames_facets_insert AFTER INSERT ON "PLACENAMES" REFERENCING NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE placenames_facets_apply();
+DROP TRIGGER IF EXISTS placenames_facets_update ON "PLACENAMES";
+CREATE TRIGGER placenames_facets_update AFTER UPDATE ON "PLACENAMES"
+    REFERENCING OLD TABLE AS old_rows NEW TABLE AS new_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE placenames_facets_apply();
+DROP TRIGGER IF EXISTS placenames_facets_delete ON "PLACENAMES";
+CREATE TRIGGER placenames_facets_delete AFTER DELETE ON "PLACENAMES" REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE PROCEDURE placenames_facets_apply();
+DROP TRIGGER IF EXISTS placenames_facets_truncate ON "PLACENAMES";
+CREATE TRIGGER placenames_facets_truncate AFTER TRUNCATE ON "PLACENAMES"
+    FOR EACH STATEMENT EXECUTE PROCEDURE placenames_facets_truncate();
+
+-- the counts of the rows already in the table, taken in the same transaction as the triggers start counting
+BEGIN;
+LOCK TABLE "PLACENAMES" IN SHARE MODE;
+TRUNCATE "PLACENAMES_FACETS";
+INSERT INTO "PLACENAMES_FACETS"
+SELECT COALESCE("AUTHORITY", ''), COALESCE("FEATURE", ''), COALESCE("CATEGORY", ''), COALESCE("GROUP", ''), COUNT(*)
+FROM "PLACENAMES" GROUP BY 1, 2, 3, 4;
+COMMIT;
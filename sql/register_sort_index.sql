@@ -0,0 +1,5 @@
+-- Index backing keyset (cursor) paging of the /collections/placenames/ and /collections/places/ registers.
+-- The column list and expression must match model/register.py SORT_KEY exactly for the planner to use it.
+-- AUTHORITY and AUTH_ID are assumed to be NOT NULL; rows with NULLs in the sort key are skipped by cursor seeks.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "PLACENAMES_register_order_idx"
+    ON "PLACENAMES" ("AUTHORITY", (cast('0' || regexp_replace("AUTH_ID", '\D+', '') as integer)), "AUTH_ID", "ID");
@@ -0,0 +1,4 @@
+-- Index for the SUPPLY_DATE watermark queries (see model/sync.py): the rows supplied since the last static site
+-- build or since an in-memory index was built, instead of the whole table.
+CREATE INDEX CONCURRENTLY IF NOT EXISTS "PLACENAMES_supply_date_idx"
+    ON "PLACENAMES" ("SUPPLY_DATE");
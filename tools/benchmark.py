@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+'''
+Route-level benchmarks of the app, run with Flask's test client against a local stand-in for the database
+
+The stand-in is a CSV snapshot (see model/backend.py) seeded from sample-data/placename_sample.csv and scaled to each
+requested number of rows: copy n of a sample row gets the ID AUTHORITY_(AUTH_ID + n * 10000000) and coordinates moved
+by up to 0.05 degrees, so registers, search and the map get realistic numbers of distinct placenames. Scaled files are
+written once to --data-dir and reused.
+
+Each size runs in its own process, so nothing cached or indexed at one size is seen by the next. The in-memory search
+and spatial indexes are built before timing starts, and the result caches are cleared before each case, so the
+numbers are those of a warm process answering varied requests. For every route and view (HTML, Turtle, JSON-LD,
+RDF/XML and the alt profile) the throughput and the p50, p95 and p99 latency are written as JSON, and --baseline
+compares them with an earlier run, e.g. one from the previous commit.
+
+    python -m tools.benchmark [--rows 10000 100000 1000000] [--requests 200] [--output bench.json]
+                              [--baseline previous.json] [--cases place]
+'''
+import argparse
+import csv
+import json
+import os
+import platform
+import random
+import re
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from os.path import dirname, realpath, join
+from urllib.parse import urlencode
+
+sys.path.insert(0, dirname(dirname(realpath(__file__))))
+
+APP_DIR = dirname(dirname(realpath(__file__)))
+SAMPLE_CSV = join(APP_DIR, 'sample-data', 'placename_sample.csv')
+CSV_COLUMNS = ['ID', 'AUTH_ID', 'NAME', 'FEATURE', 'CATEGORY', 'GROUP', 'LATITUDE', 'LONGITUDE', 'AUTHORITY',
+               'SUPPLY_DATE']
+COPY_STRIDE = 10000000  # larger than any sample AUTH_ID, so every copy has its own ID
+
+# name, URL template. {id}, {page} and {search} are filled in for each request.
+ROUTES = [
+    ('placename', '/collections/placenames/items/{id}'),
+    ('place', '/collections/places/items/{id}'),
+    ('placenames_register', '/collections/placenames/?page={page}&per_page=20'),
+    ('places_register', '/collections/places/?page={page}&per_page=20'),
+    ('placenames_search', '/collections/placenames/?search={search}&per_page=20'),
+]
+
+# view name, query string parameters
+VIEWS = [
+    ('html', {'_mediatype': 'text/html'}),
+    ('turtle', {'_mediatype': 'text/turtle'}),
+    ('json-ld', {'_mediatype': 'application/ld+json'}),
+    ('rdf-xml', {'_mediatype': 'application/rdf+xml'}),
+    ('alt', {'_profile': 'alt'}),
+]
+
+
+def scaled_csv(rows, source=SAMPLE_CSV, data_dir=None):
+    '''
+    The path of a CSV file with rows placenames made from copies of those in source, written if not there yet
+    '''
+    data_dir = data_dir or join(tempfile.gettempdir(), 'placenames-benchmark')
+    os.makedirs(data_dir, exist_ok=True)
+    path = join(data_dir, 'placenames_{}.csv'.format(rows))
+    if os.path.exists(path):
+        return path
+
+    with open(source, newline='', encoding='utf-8') as f:
+        sample = list(csv.DictReader(f))
+    random_ = random.Random(rows)
+    partial = path + '.partial'
+    with open(partial, 'w', newline='', encoding='utf-8') as f:
+        writer = csv.writer(f, quoting=csv.QUOTE_ALL)
+        writer.writerow(CSV_COLUMNS)
+        for n in range(rows):
+            row = dict(sample[n % len(sample)])
+            copy = n // len(sample)
+            if copy:
+                row['AUTH_ID'] = str(int(row['AUTH_ID']) + copy * COPY_STRIDE)
+                row['ID'] = '{}_{}'.format(row['AUTHORITY'], row['AUTH_ID'])
+                for c in ('LATITUDE', 'LONGITUDE'):
+                    if row[c]:
+                        row[c] = '{:.5f}'.format(float(row[c]) + random_.uniform(-0.05, 0.05))
+            writer.writerow([row[c] for c in CSV_COLUMNS])
+    os.replace(partial, path)
+    return path
+
+
+def percentile(values, p):
+    # nearest-rank percentile of sorted values
+    return values[max(0, min(len(values) - 1, int(round(p / 100.0 * len(values))) - 1))]
+
+
+def _wait_for_indexes(timeout=600):
+    from model.search_index import SEARCH_INDEX
+    from model.spatial_index import SPATIAL_INDEX
+    started = time.time()
+    while SEARCH_INDEX.get() is None or SPATIAL_INDEX.get() is None:
+        if time.time() - started > timeout:
+            raise RuntimeError('The search and spatial indexes were not built within {}s'.format(timeout))
+        time.sleep(0.05)
+
+
+def run_cases(csv_file, requests, case_filter=None, warmup=5, seed=1):
+    '''
+    Times every route and view against csv_file in this process. conf.SNAPSHOT_CSV_FILE must already be csv_file.
+    '''
+    started = time.time()
+    from app import app
+    from model import backend
+    from model.cache import CACHES
+    store = backend.get().store
+    _wait_for_indexes()
+    startup = time.time() - started
+
+    random_ = random.Random(seed)
+    ids = store.ids
+    pages = max(1, len(ids) // 20)
+    words = sorted({w for name in store.names[:1000] for w in re.findall(r'[A-Za-z]{4,}', name)})
+    values = {
+        'id': lambda: ids[random_.randrange(len(ids))],
+        'page': lambda: random_.randint(1, pages),
+        'search': lambda: random_.choice(words)
+    }
+
+    client = app.test_client()
+    cases = []
+    for route, template in ROUTES:
+        for view, params in VIEWS:
+            name = '{} {}'.format(route, view)
+            if case_filter and not re.search(case_filter, name):
+                continue
+            for cache in CACHES.values():
+                cache.clear()
+            latencies = []
+            errors = 0
+            for n in range(warmup + requests):
+                url = template.format(**{k: v() for k, v in values.items() if '{' + k + '}' in template})
+                url += ('&' if '?' in url else '?') + urlencode(params)
+                request_started = time.perf_counter()
+                response = client.get(url)
+                response.get_data()
+                elapsed = time.perf_counter() - request_started
+                if n < warmup:
+                    continue
+                latencies.append(elapsed)
+                if response.status_code != 200:
+                    errors += 1
+            seconds = sum(latencies)
+            latencies.sort()
+            cases.append({
+                'route': route,
+                'view': view,
+                'params': params,
+                'requests': len(latencies),
+                'errors': errors,
+                'seconds': round(seconds, 4),
+                'throughput': round(len(latencies) / seconds, 2) if seconds else None,
+                'mean_ms': round(seconds / len(latencies) * 1000, 3),
+                'p50_ms': round(percentile(latencies, 50) * 1000, 3),
+                'p95_ms': round(percentile(latencies, 95) * 1000, 3),
+                'p99_ms': round(percentile(latencies, 99) * 1000, 3),
+            })
+    return {'rows': len(ids), 'startup_seconds': round(startup, 2), 'cases': cases}
+
+
+def _run_size(rows, args):
+    csv_file = scaled_csv(rows, source=args.source, data_dir=args.data_dir)
+    command = [sys.executable, '-m', 'tools.benchmark', '--worker', csv_file, '--requests', str(args.requests)]
+    if args.cases:
+        command += ['--cases', args.cases]
+    environment = dict(os.environ, PLACENAMES_SNAPSHOT_CSV=csv_file)
+    output = subprocess.run(command, cwd=APP_DIR, env=environment, stdout=subprocess.PIPE, check=True).stdout
+    return json.loads(output.decode('utf-8').splitlines()[-1])
+
+
+def _commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=APP_DIR, stdout=subprocess.PIPE,
+                              stderr=subprocess.DEVNULL, check=True).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _case_key(size, case):
+    return size['rows'], case['route'], case['view']
+
+
+def report(run, baseline=None, out=sys.stderr):
+    '''
+    Prints run as a table, with the change in throughput and p50 from baseline where it has the same case
+    '''
+    previous = {}
+    for size in (baseline or {}).get('sizes', []):
+        for case in size['cases']:
+            previous[_case_key(size, case)] = case
+    out.write('{:>8} {:<20} {:<8} {:>9} {:>9} {:>9} {:>9} {:>6}{}\n'.format(
+        'rows', 'route', 'view', 'req/s', 'p50 ms', 'p95 ms', 'p99 ms', 'errors', '  vs baseline' if baseline else ''))
+    for size in run['sizes']:
+        for case in size['cases']:
+            line = '{:>8} {:<20} {:<8} {:>9} {:>9} {:>9} {:>9} {:>6}'.format(
+                size['rows'], case['route'], case['view'], case['throughput'], case['p50_ms'], case['p95_ms'],
+                case['p99_ms'], case['errors'])
+            old = previous.get(_case_key(size, case))
+            if old:
+                line += '  req/s {:+.1%} p50 {:+.1%}'.format(case['throughput'] / old['throughput'] - 1,
+                                                             case['p50_ms'] / old['p50_ms'] - 1)
+            out.write(line + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the API routes against scaled sample data')
+    parser.add_argument('--rows', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help='dataset sizes to run at')
+    parser.add_argument('--requests', type=int, default=200, help='timed requests per route and view')
+    parser.add_argument('--cases', help='only run the cases whose "route view" name matches this regular expression')
+    parser.add_argument('--source', default=SAMPLE_CSV, help='CSV file the scaled data is copied from')
+    parser.add_argument('--data-dir', help='where the scaled CSV files are kept')
+    parser.add_argument('--output', help='write the results as JSON to this file (default: standard output)')
+    parser.add_argument('--baseline', help='JSON results of an earlier run to compare with')
+    parser.add_argument('--worker', metavar='CSV', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker:
+        # one size, in a process whose PLACENAMES_SNAPSHOT_CSV is the scaled file
+        print(json.dumps(run_cases(args.worker, args.requests, case_filter=args.cases)))
+        return
+
+    run = {
+        'commit': _commit(),
+        'started': datetime.now().isoformat(timespec='seconds'),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'requests': args.requests,
+        'sizes': [_run_size(rows, args) for rows in args.rows]
+    }
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    report(run, baseline)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(run, f, indent=2)
+    else:
+        print(json.dumps(run, indent=2))
+
+
+if __name__ == '__main__':
+    main()
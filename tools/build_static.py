@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+'''
+Writes every placename and place item, in every profile and format, and every page of the two registers to a directory
+tree that a plain web server can publish
+
+The rows are read in register order and in batches (see backend.stream_items()) and rendered by a pool of worker
+processes with the same models and templates as the API, so the files are the API's responses:
+
+    <output>/collections/placenames/items/<ID>/<profile>.<ext>    profiles NCGA and pn
+    <output>/collections/places/items/<ID>/<profile>.<ext>        profile pn
+    <output>/collections/placenames/page/<page>.<ext>             the mem profile, --per-page members per page
+    <output>/collections/places/page/<page>.<ext>
+
+where ext is html, ttl, jsonld, rdf or nt. Links in the pages are made with --base-url, the public address of the
+site, and register pages link to each other with ?page= numbers rather than cursors. The alt profile is not written.
+
+<output>/manifest.json records what was written (see model/sync.py). Running the build again over the same output
+only writes the items and register pages that have changed since, and deletes those of removed placenames, unless
+--full is given. --verify also finds changes that kept their SUPPLY_DATE, by reading every row.
+
+    python -m tools.build_static --output site [--base-url http://linked.data.gov.au/dataset/placenames]
+                                 [--workers 8] [--per-page 50] [--batch-size 5000] [--full] [--verify]
+'''
+import argparse
+import hashlib
+import multiprocessing
+import os
+import shutil
+import sys
+import time
+from os.path import dirname, realpath, join
+
+sys.path.insert(0, dirname(dirname(realpath(__file__))))
+
+from flask import Flask, request
+
+import conf
+from controller import routes
+from model import backend, sync
+from model.place import Place
+from model.placename import Placename
+
+# file extension of each mediatype written
+EXTENSIONS = [
+    ('text/html', 'html'),
+    ('text/turtle', 'ttl'),
+    ('application/ld+json', 'jsonld'),
+    ('application/rdf+xml', 'rdf'),
+    ('application/n-triples', 'nt'),
+]
+
+# collection, item model, profiles written
+ITEMS = [
+    ('placenames', Placename, ['NCGA', 'pn']),
+    ('places', Place, ['pn']),
+]
+
+CHUNK_SIZE = 200  # rows rendered per worker task
+MANIFEST_FILE = 'manifest.json'  # see model/sync.py
+
+# the app pages are rendered in, without the index threads app.py starts. Made before the pool so workers inherit it.
+app = Flask(__name__, template_folder=conf.TEMPLATES_DIR, static_folder=conf.STATIC_DIR)
+app.register_blueprint(routes.routes)
+
+_base_url = None
+_output = None
+
+
+def _init_worker(base_url, output):
+    global _base_url, _output
+    _base_url = base_url
+    _output = output
+
+
+def _write(path, response):
+    with open(path, 'wb') as f:
+        f.write(response.get_data())
+
+
+def render_items(rows):
+    '''
+    Writes the files of all items of rows, each (ID, item query columns...), and returns how many rows were done
+    '''
+    for row in rows:
+        for collection, model, profiles in ITEMS:
+            path = '/collections/{}/items/{}'.format(collection, row[0])
+            directory = join(_output, path.lstrip('/'))
+            os.makedirs(directory, exist_ok=True)
+            for profile in profiles:
+                # the item is loaded once per profile and rendered in each format
+                with app.test_request_context(path, base_url=_base_url, query_string={'_profile': profile}):
+                    item = model(request, request.base_url, row=row[1:])
+                    for mediatype, extension in EXTENSIONS:
+                        item.mediatype = mediatype
+                        response = item.render()
+                        if response.status_code != 200:
+                            raise RuntimeError('{}?_profile={}&_mediatype={} returned {}'.format(
+                                path, profile, mediatype, response.status_code))
+                        _write(join(directory, '{}.{}'.format(profile, extension)), response)
+    return len(rows)
+
+
+def render_page(page, members, total, per_page):
+    '''
+    Writes the files of one page of both registers
+    '''
+    for collection, (label, comment, parent_container_label) in routes.REGISTERS.items():
+        path = '/collections/{}/'.format(collection)
+        directory = join(_output, path.lstrip('/'), 'page')
+        for mediatype, extension in EXTENSIONS:
+            with app.test_request_context(path, base_url=_base_url,
+                                          query_string={'per_page': per_page, 'page': page, '_mediatype': mediatype}):
+                response = routes.register_response(label, comment, parent_container_label, members, total, page,
+                                                    per_page)
+            _write(join(directory, '{}.{}'.format(page, extension)), response)
+    return 0
+
+
+def _page_hash(total, members):
+    return hashlib.sha1(repr((total, members)).encode('utf-8')).hexdigest()[:16]
+
+
+def _remove(path):
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+
+def build(output, base_url, workers=None, per_page=routes.DEFAULT_ITEMS_PER_PAGE, batch_size=None, full=False,
+          verify=False):
+    '''
+    Writes the site to output, or, if output has the manifest of an earlier build with the same settings and full is
+    not set, brings it up to date by writing only the new and changed items and register pages and deleting those
+    that are gone, see model/sync.py
+    '''
+    for collection in routes.REGISTERS:
+        os.makedirs(join(output, 'collections', collection, 'page'), exist_ok=True)
+    manifest_file = join(output, MANIFEST_FILE)
+    settings = {'base_url': base_url, 'per_page': per_page, 'content_version': conf.CONTENT_VERSION}
+    # the last build's manifest still tells which files a rebuild from scratch must delete
+    previous = manifest = sync.Manifest.load(manifest_file)
+    if full or manifest.settings != settings:
+        manifest = sync.Manifest(settings)
+    data = backend.get()
+    workers = workers or os.cpu_count()
+    # fork the workers before counting and the streams open a database connection
+    pool = multiprocessing.get_context('fork').Pool(workers, initializer=_init_worker, initargs=(base_url, output))
+    pending = []
+    done = 0
+    started = reported = time.time()
+
+    def submit(f, *args):
+        nonlocal done, reported
+        pending.append(pool.apply_async(f, args))
+        # keep a few tasks per worker queued, so the rows in flight stay bounded however big the table is
+        while len(pending) > workers * 2:
+            done += pending.pop(0).get()
+        if time.time() - reported > 10:
+            reported = time.time()
+            print('{} rows, {:.0f} rows/s'.format(done, done / (reported - started)))
+
+    try:
+        total = data.register_count()
+        # the register pages, and all IDs for finding deleted rows, from one pass over (ID, NAME) in register order
+        ids = set()
+        pages = []
+        pages_written = 0
+        members = []
+        for rows in data.stream_columns(['ID', 'NAME'], batch_size):
+            for row in rows:
+                ids.add(row[0])
+                members.append(tuple(row))
+                if len(members) == per_page:
+                    pages_written += _submit_page(submit, manifest, pages, members, total, per_page)
+                    members = []
+        if members or not pages:
+            pages_written += _submit_page(submit, manifest, pages, members, total, per_page)
+        for page in range(len(pages) + 1, len(previous.pages) + 1):
+            for collection in routes.REGISTERS:
+                for mediatype, extension in EXTENSIONS:
+                    _remove(join(output, 'collections', collection, 'page', '{}.{}'.format(page, extension)))
+        manifest.pages = pages
+
+        changed = 0
+        for rows in sync.changed_rows(manifest, ids, verify=verify, batch_size=batch_size):
+            for start in range(0, len(rows), CHUNK_SIZE):
+                submit(render_items, rows[start:start + CHUNK_SIZE])
+            for row in rows:
+                manifest.record(row)
+            changed += len(rows)
+        for result in pending:
+            done += result.get()
+    finally:
+        pool.close()
+        pool.join()
+
+    deleted = sync.deleted_ids(previous, ids)
+    for placename_id in deleted:
+        for collection, model, profiles in ITEMS:
+            _remove(join(output, 'collections', collection, 'items', placename_id))
+        manifest.items.pop(placename_id, None)
+    manifest.save(manifest_file)
+
+    elapsed = time.time() - started
+    print('{} items written and {} deleted, {} of {} register pages written, in {:.0f}s'.format(
+        changed, len(deleted), pages_written, len(pages), elapsed))
+    return changed, len(deleted), pages_written
+
+
+def _submit_page(submit, manifest, pages, members, total, per_page):
+    # renders the next register page unless the last build wrote the same one
+    page = len(pages) + 1
+    pages.append(_page_hash(total, members))
+    if page <= len(manifest.pages) and manifest.pages[page - 1] == pages[-1]:
+        return 0
+    submit(render_page, page, members, total, per_page)
+    return 1
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Write all items and register pages as static files')
+    parser.add_argument('--output', required=True, help='directory the files are written to')
+    parser.add_argument('--base-url', default='http://localhost:5000',
+                        help='public address of the site, used in the links of the pages')
+    parser.add_argument('--workers', type=int, help='rendering processes (default: one per CPU)')
+    parser.add_argument('--per-page', type=int, default=routes.DEFAULT_ITEMS_PER_PAGE, help='register page size')
+    parser.add_argument('--batch-size', type=int, help='rows read from the database at a time')
+    parser.add_argument('--full', action='store_true', help='write everything, even if the output has a manifest')
+    parser.add_argument('--verify', action='store_true',
+                        help='hash every row, to find changes that did not move SUPPLY_DATE on')
+    args = parser.parse_args()
+    build(args.output, args.base_url.rstrip('/'), workers=args.workers, per_page=args.per_page,
+          batch_size=args.batch_size, full=args.full, verify=args.verify)
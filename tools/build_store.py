@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+'''
+Writes the item store served when PLACENAMES_ITEM_STORE is set: the Turtle, N-Triples and JSON-LD of every placename
+(NCGA and pn profiles) and place (pn) packed into one file, see model/item_store.py
+
+The rows are read in batches (see backend.stream_items()) and rendered by a pool of worker processes with the same
+models as the API, so the documents are the API's responses. The file is written next to --output and renamed over it
+when complete, and a running service switches to it within conf.ITEM_STORE_CHECK_INTERVAL seconds. Run it again after
+each resupply and each change of conf.CONTENT_VERSION: until then the service doesn't use the out of date store.
+
+    python -m tools.build_store --output items.store [--workers 8] [--batch-size 5000]
+'''
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from os.path import dirname, realpath
+
+sys.path.insert(0, dirname(dirname(realpath(__file__))))
+
+from flask import Flask, request
+
+import conf
+from controller import routes
+from model import backend, item_store
+from model.place import Place
+from model.placename import Placename
+
+MODELS = {'placenames': Placename, 'places': Place}
+CHUNK_SIZE = 200  # rows rendered per worker task
+
+# the app items are rendered in, without the index threads app.py starts. Made before the pool so workers inherit it.
+app = Flask(__name__, template_folder=conf.TEMPLATES_DIR, static_folder=conf.STATIC_DIR)
+app.register_blueprint(routes.routes)
+
+
+def render_items(rows):
+    '''
+    (ID, SUPPLY_DATE, [document for each of item_store.VARIANTS]) for each of rows, each (ID, item query columns...)
+    '''
+    items = []
+    for row in rows:
+        documents = []
+        for collection, profiles in item_store.PROFILES:
+            path = '/collections/{}/items/{}'.format(collection, row[0])
+            for profile in profiles:
+                # the item is loaded once per profile and rendered in each format
+                with app.test_request_context(path, query_string={'_profile': profile}):
+                    item = MODELS[collection](request, request.base_url, row=row[1:])
+                    for mediatype in item_store.MEDIATYPES:
+                        item.mediatype = mediatype
+                        response = item.render()
+                        if response.status_code != 200:
+                            raise RuntimeError('{}?_profile={}&_mediatype={} returned {}'.format(
+                                path, profile, mediatype, response.status_code))
+                        documents.append(response.get_data())
+        items.append((row[0], row[3], documents))
+    return items
+
+
+def build(output, workers=None, batch_size=None):
+    '''
+    Writes the store of every row to output. Returns the number of items.
+    '''
+    workers = workers or os.cpu_count()
+    # fork the workers before the stream opens a database connection
+    pool = multiprocessing.get_context('fork').Pool(workers)
+    writer = item_store.StoreWriter(output)
+    pending = []
+    done = 0
+    started = reported = time.time()
+
+    def write(items):
+        nonlocal done, reported
+        for item_id, modified, documents in items:
+            writer.add(item_id, modified, documents)
+        done += len(items)
+        if time.time() - reported > 10:
+            reported = time.time()
+            print('{} rows, {:.0f} rows/s'.format(done, done / (reported - started)))
+
+    try:
+        # taken before the rows are read, so that a resupply during the build leaves the store out of date
+        settings = item_store.version_settings(backend.get().data_version())
+        for rows in backend.get().stream_items(batch_size):
+            for start in range(0, len(rows), CHUNK_SIZE):
+                pending.append(pool.apply_async(render_items, (rows[start:start + CHUNK_SIZE],)))
+                # keep a few tasks per worker queued, so the rows in flight stay bounded however big the table is
+                while len(pending) > workers * 2:
+                    write(pending.pop(0).get())
+        for result in pending:
+            write(result.get())
+        settings['built'] = time.strftime('%Y-%m-%dT%H:%M:%S')
+        count = writer.close(settings)
+    finally:
+        pool.close()
+        pool.join()
+        if not writer.file.closed:
+            writer.file.close()
+            os.remove(writer.partial)
+
+    elapsed = time.time() - started
+    print('{} items, {} MB, in {:.0f}s'.format(count, os.path.getsize(output) // 2 ** 20, elapsed))
+    return count
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Pack the RDF of every item into one memory-mappable file')
+    parser.add_argument('--output', default=conf.ITEM_STORE_FILE, required=conf.ITEM_STORE_FILE is None,
+                        help='the store file (default: PLACENAMES_ITEM_STORE)')
+    parser.add_argument('--workers', type=int, help='rendering processes (default: one per CPU)')
+    parser.add_argument('--batch-size', type=int, help='rows read from the database at a time')
+    args = parser.parse_args()
+    build(args.output, workers=args.workers, batch_size=args.batch_size)
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+'''
+Checks that model/fuzzy_index.py matches known spelling variants at the expected distance, and doesn't match words
+further apart than the bounds
+
+Each pair is indexed on its own, without touching the database, with the name as the only row, and the query is
+searched for. Exits with status 1 if any pair matches differently.
+
+    python -m tools.check_fuzzy_index
+'''
+import sys
+from os.path import dirname, realpath
+
+sys.path.insert(0, dirname(dirname(realpath(__file__))))
+
+from model.fuzzy_index import FuzzyIndex
+
+# (query, name, distance of the match, or None if they mustn't match)
+PAIRS = [
+    ('CREEK', 'CREEK', 0),
+    ('CREEK', 'CREAK', 1),
+    ('KREEK', 'CREEK', 1),
+    ('MERIEK', 'MEEREEK', 2),
+    ('MERIEK', 'MARIAK', 2),
+    # two edits apart with different phonetic keys, so only found by spelling
+    ('THOMPSON', 'TOMSON', 2),
+    ('SANDFORD', 'SANFORT', 2),
+    ('KOOLAMBIN', 'KULAMBIN', 2),
+    # three edits, beyond FUZZY_MAX_DISTANCE
+    ('THOMPSON', 'TOMSEN', None),
+    # short words: one edit for three or four letters, none for one or two
+    ('BAY', 'PAY', 1),
+    ('BAY', 'BOWIE', None),
+    ('BAY', 'PAUWAYE', None),
+    ('MT', 'MOUNT', None),
+]
+
+
+def check():
+    failures = 0
+    for query, name, expected in PAIRS:
+        index = FuzzyIndex([{'ID': 'X_1', 'NAME': name}])
+        positions, distances = index.search(query)
+        found = distances[0] if positions else None
+        if found != expected:
+            failures += 1
+            print('{} -> {}: expected {}, found {}'.format(query, name, expected, found))
+    print('{} pairs checked, {} differ'.format(len(PAIRS), failures))
+    return failures == 0
+
+
+if __name__ == '__main__':
+    sys.exit(0 if check() else 1)
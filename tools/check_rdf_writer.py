@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+'''
+Checks that model/rdf_writer.py writes the same graphs as the rdflib-based Place and Placename _graph() methods
+
+Every row of a CSV file in the sample-data/placename_sample.csv layout is loaded into each item view (Placename NCGA,
+Placename pn and Place) without touching the database. The Turtle, N-Triples and JSON-LD written by rdf_writer are
+parsed back with rdflib and compared, by graph isomorphism, with rdflib's own serialisation of _graph() in the same
+format. Exits with status 1 if any graph differs.
+
+    python -m tools.check_rdf_writer [sample-data/placename_sample.csv]
+'''
+import csv
+import sys
+from datetime import datetime
+from os.path import dirname, realpath, join
+
+sys.path.insert(0, dirname(dirname(realpath(__file__))))
+
+from rdflib import Graph
+from rdflib.compare import isomorphic, graph_diff
+
+from app import app
+from model import rdf_writer
+from model.place import Place
+from model.placename import Placename
+
+FORMATS = {
+    'text/turtle': 'turtle',
+    'application/n-triples': 'nt',
+    'application/ld+json': 'json-ld'
+}
+
+
+def item_row(row):
+    # the columns of conf.PLACENAME_ITEM_QUERY, typed as psycopg2 would return them
+    return (
+        row['NAME'],
+        row['AUTHORITY'],
+        datetime.strptime(row['SUPPLY_DATE'], '%Y-%m-%d %H:%M:%S'),
+        row['FEATURE'],
+        row['CATEGORY'],
+        row['GROUP'],
+        float(row['LATITUDE']),
+        float(row['LONGITUDE']),
+        None
+    )
+
+
+def views(placename_id, mediatype, row):
+    base = 'http://localhost/collections/{}/items/' + placename_id
+    with app.test_request_context(base.format('placenames'), query_string={'_profile': 'NCGA', '_mediatype': mediatype}):
+        from flask import request
+        pn = Placename(request, base.format('placenames'), row=row)
+        yield 'Placename NCGA', rdf_writer.item_triples(pn, True, True), pn._graph('NCGA')
+        yield 'Placename pn', rdf_writer.item_triples(pn, True, False), pn._graph('pn')
+        p = Place(request, base.format('places'), row=row)
+        yield 'Place', rdf_writer.item_triples(p, False, True), p._graph()
+
+
+def check(csv_file):
+    failures = 0
+    checked = 0
+    with open(csv_file, newline='', encoding='utf-8') as f:
+        rows = list(csv.DictReader(f))
+    for row in rows:
+        for mediatype, rdflib_format in FORMATS.items():
+            for view, triples, graph in views(row['ID'], mediatype, item_row(row)):
+                written = Graph().parse(data=rdf_writer.serialize(triples, mediatype), format=rdflib_format,
+                                        publicID='http://localhost/')
+                expected = Graph().parse(data=graph.serialize(format=rdflib_format), format=rdflib_format,
+                                         publicID='http://localhost/')
+                checked += 1
+                if not isomorphic(written, expected):
+                    failures += 1
+                    in_both, only_written, only_expected = graph_diff(written, expected)
+                    print('{} {} {} differs'.format(row['ID'], view, mediatype))
+                    for t in only_written:
+                        print('  + {}'.format(t))
+                    for t in only_expected:
+                        print('  - {}'.format(t))
+    print('{} graphs checked, {} differ'.format(checked, failures))
+    return failures == 0
+
+
+if __name__ == '__main__':
+    csv_file = sys.argv[1] if len(sys.argv) > 1 else join(dirname(dirname(realpath(__file__))),
+                                                          'sample-data', 'placename_sample.csv')
+    sys.exit(0 if check(csv_file) else 1)
@@ -0,0 +1,229 @@
+# -*- coding: utf-8 -*-
+'''
+Stores the AusPIX cells of each PLACENAMES row, at one or more resolutions, in DGGS_CELL_<resolution> columns or in a
+sidecar CSV file
+
+Run sql/dggs_cell_column.sql first to add the DGGS_CELL_9 column (add a DGGS_CELL_<r> text column the same way for any
+other resolution). The coordinates are read in chunks of --batch-size rows, keyed by ID, and each chunk's cells are
+computed by a pool of worker processes with dggs.cell_ids(), which projects a whole chunk at once. A coarser cell is a
+prefix of a finer one, so only the finest resolution asked for is computed. Each chunk is copied into a temporary table
+and written with one UPDATE, and committed.
+
+By default only rows missing one of the cells are attributed, so re-running after an interruption, or after a resupply
+(which clears the DGGS_CELL_9 of moved placenames), only does the remaining work. With --all every row is recomputed;
+an interrupted --all run is resumed with the --after ID it printed last. A sidecar file is appended to chunk by chunk
+and resumed after the last ID in it.
+
+    python -m tools.precompute_dggs [--resolutions 9 [7 ...]] [--all] [--after ID] [--batch-size 20000]
+                                    [--workers 4] [--sidecar cells.csv]
+'''
+import argparse
+import csv
+import io
+import multiprocessing
+import os
+import sys
+import time
+from os.path import dirname, realpath
+
+sys.path.insert(0, dirname(dirname(realpath(__file__))))
+
+import psycopg2
+
+import conf
+from model import backend, dggs
+
+
+def column(resolution):
+    return 'DGGS_CELL_{}'.format(resolution)
+
+
+def _resolutions(resolutions):
+    # the distinct resolutions asked for, in order, which the DGGS must have cells at
+    resolutions = sorted(set(resolutions))
+    highest = dggs.rdggs().max_resolution
+    if resolutions[0] < 0 or resolutions[-1] > highest:
+        raise ValueError('resolutions must be between 0 and {}'.format(highest))
+    return resolutions
+
+
+def compute(resolutions, rows):
+    '''
+    (ID, cell at each of resolutions...) for rows of (ID, LONGITUDE, LATITUDE), with None cells for rows without
+    coordinates
+    '''
+    located = [row for row in rows if row[1] is not None and row[2] is not None]
+    finest = dggs.cell_ids(max(resolutions), [row[1] for row in located], [row[2] for row in located])
+    cells = {row[0]: cell for row, cell in zip(located, finest)}
+    result = []
+    for row in rows:
+        cell = cells.get(row[0])
+        result.append((row[0],) + tuple(cell[:resolution + 1] if cell else None for resolution in resolutions))
+    return result
+
+
+class Progress(object):
+    def __init__(self):
+        self.done = 0
+        self.started = time.time()
+
+    def add(self, rows, last_id):
+        self.done += rows
+        print('{} rows, {:.0f} rows/s, resume with --after {}'.format(
+            self.done, self.done / (time.time() - self.started), last_id))
+
+
+def _pool(workers):
+    # made before any database connection is opened, so the workers don't inherit one
+    return multiprocessing.get_context('fork').Pool(workers)
+
+
+def _pipeline(pool, workers, chunks, resolutions, write):
+    # computes the chunks in the pool, keeping a few per worker in flight, and writes the results in order
+    pending = []
+    for rows in chunks:
+        pending.append(pool.apply_async(compute, (resolutions, rows)))
+        while len(pending) > workers * 2:
+            write(pending.pop(0).get())
+    for result in pending:
+        write(result.get())
+
+
+def precompute(resolutions=(dggs.RESOLUTION,), recompute_all=False, after='', batch_size=20000, workers=None):
+    '''
+    Stores the cells in the PLACENAMES table. Returns the number of rows written.
+    '''
+    resolutions = _resolutions(resolutions)
+    columns = [column(r) for r in resolutions]
+    workers = workers or os.cpu_count()
+    pool = _pool(workers)
+    reader = psycopg2.connect(**conf.DB_CON_DICT['db_con'])
+    reader.autocommit = True
+    writer = psycopg2.connect(**conf.DB_CON_DICT['db_con'])
+    condition = '' if recompute_all else 'AND ({})'.format(' OR '.join('"{}" IS NULL'.format(c) for c in columns))
+    progress = Progress()
+
+    def chunks():
+        # keyset over ID, so rows whose cell cannot be computed are not read again
+        last_id = after or ''
+        while True:
+            with reader.cursor() as cur:
+                cur.execute('''
+                    SELECT "ID", "LONGITUDE", "LATITUDE" FROM "PLACENAMES"
+                    WHERE "ID" > %s {} AND "LONGITUDE" IS NOT NULL AND "LATITUDE" IS NOT NULL
+                    ORDER BY "ID" LIMIT %s
+                '''.format(condition), (last_id, batch_size))
+                rows = cur.fetchall()
+            if not rows:
+                return
+            last_id = rows[-1][0]
+            yield rows
+
+    def write(cells):
+        data = io.StringIO()
+        csv.writer(data).writerows(cells)
+        data.seek(0)
+        with writer.cursor() as cur:
+            cur.copy_expert('COPY dggs_cells FROM STDIN WITH (FORMAT csv)', data)
+            cur.execute('UPDATE "PLACENAMES" AS p SET {} FROM dggs_cells AS v WHERE p."ID" = v.id'.format(
+                ', '.join('"{0}" = v."{0}"'.format(c) for c in columns)))
+        writer.commit()
+        progress.add(len(cells), cells[-1][0])
+
+    try:
+        with reader.cursor() as cur:
+            cur.execute("SELECT column_name FROM information_schema.columns WHERE table_name = 'PLACENAMES'")
+            missing = set(columns).difference(row[0] for row in cur.fetchall())
+        if missing:
+            raise ValueError('Add the column first, e.g. ALTER TABLE "PLACENAMES" ADD COLUMN "{}" text'.format(
+                sorted(missing)[0]))
+        with writer.cursor() as cur:
+            cur.execute('CREATE TEMPORARY TABLE dggs_cells (id text, {}) ON COMMIT DELETE ROWS'.format(
+                ', '.join('"{}" text'.format(c) for c in columns)))
+        writer.commit()
+        _pipeline(pool, workers, chunks(), resolutions, write)
+        # refresh the column statistics, so the planner knows how selective the ?dggs= register filter is
+        with writer.cursor() as cur:
+            cur.execute('ANALYZE "PLACENAMES"')
+        writer.commit()
+    finally:
+        pool.close()
+        pool.join()
+        reader.close()
+        writer.close()
+    return progress.done
+
+
+def _last_id(path):
+    # the ID of the last complete line of a sidecar file, dropping a line cut short by an interruption: '' if only the
+    # header is complete, None if not even that
+    with open(path, 'rb+') as f:
+        data = f.read()
+        end = data.rfind(b'\n') + 1
+        f.truncate(end)
+    lines = data[:end].decode('utf-8').splitlines()
+    if not lines:
+        return None
+    return next(csv.reader([lines[-1]]))[0] if len(lines) > 1 else ''
+
+
+def precompute_sidecar(path, resolutions=(dggs.RESOLUTION,), batch_size=20000, workers=None):
+    '''
+    Writes the cells of every row, in register order, to the CSV file path, with an ID column and one column per
+    resolution. Works with either backend. Returns the number of rows written.
+    '''
+    resolutions = _resolutions(resolutions)
+    workers = workers or os.cpu_count()
+    pool = _pool(workers)
+    last_id = _last_id(path) if os.path.exists(path) else None
+    progress = Progress()
+
+    def chunks():
+        skipping = bool(last_id)
+        for rows in backend.get().stream_columns(['ID', 'LONGITUDE', 'LATITUDE'], batch_size):
+            if skipping:
+                # resume after the last row in the file
+                ids = [row[0] for row in rows]
+                if last_id not in ids:
+                    continue
+                rows = rows[ids.index(last_id) + 1:]
+                skipping = False
+            if rows:
+                yield [tuple(row) for row in rows]
+
+    try:
+        with open(path, 'a', newline='', encoding='utf-8') as f:
+            out = csv.writer(f)
+            if last_id is None:
+                out.writerow(['ID'] + [column(r) for r in resolutions])
+
+            def write(cells):
+                out.writerows(cells)
+                f.flush()
+                progress.add(len(cells), cells[-1][0])
+
+            _pipeline(pool, workers, chunks(), resolutions, write)
+    finally:
+        pool.close()
+        pool.join()
+    return progress.done
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Store the AusPIX DGGS cells of each placename')
+    parser.add_argument('--resolutions', type=int, nargs='+', default=[dggs.RESOLUTION],
+                        help='resolutions to store, each in its own column (default: 9)')
+    parser.add_argument('--all', action='store_true', help='recompute the cells of all rows, not just missing ones')
+    parser.add_argument('--after', default='', help='only rows with a greater ID, to resume an interrupted --all run')
+    parser.add_argument('--batch-size', type=int, default=20000, help='rows read, computed and written at a time')
+    parser.add_argument('--workers', type=int, help='computing processes (default: one per CPU)')
+    parser.add_argument('--sidecar', help='write the cells to this CSV file instead of the database')
+    args = parser.parse_args()
+    started = time.time()
+    if args.sidecar:
+        done = precompute_sidecar(args.sidecar, args.resolutions, batch_size=args.batch_size, workers=args.workers)
+    else:
+        done = precompute(args.resolutions, recompute_all=args.all, after=args.after, batch_size=args.batch_size,
+                          workers=args.workers)
+    elapsed = time.time() - started
+    print('{} rows in {:.0f}s, {:.0f} rows/s'.format(done, elapsed, done / elapsed if elapsed else 0))